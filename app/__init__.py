@@ -55,6 +55,10 @@ def create_app(config_class=DevelopmentConfig):
             UPLOAD_FOLDER = os.path.join(app.instance_path, 'uploads'),
             DRAWING_UPLOAD_FOLDER = os.path.join(app.instance_path, 'drawings')
         )
+        # Архив журнала аудита (создается командой flask archive-audit)
+        app.config.setdefault('AUDIT_ARCHIVE_FOLDER', os.path.join(app.instance_path, 'audit_archive'))
+        from .services import cache_service
+        cache_service.init_app(app)
         if not os.path.exists(app.config['UPLOAD_FOLDER']):
             os.makedirs(app.config['UPLOAD_FOLDER'])
         if not os.path.exists(app.config['DRAWING_UPLOAD_FOLDER']):
@@ -111,6 +115,10 @@ def create_app(config_class=DevelopmentConfig):
         from . import commands
         app.cli.add_command(commands.seed_command)
         app.cli.add_command(commands.seed_cypress_command)
+        app.cli.add_command(commands.rebuild_product_progress_command)
+        app.cli.add_command(commands.rebuild_part_closure_command)
+        app.cli.add_command(commands.partitions_group)
+        app.cli.add_command(commands.archive_audit_command)
 
     # Возвращаем оба объекта для использования в run.py
     return app, socketio
\ No newline at end of file
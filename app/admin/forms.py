@@ -1,8 +1,10 @@
 # app/admin/forms.py
 
+import uuid
+
 from flask_wtf import FlaskForm
 from wtforms import (StringField, PasswordField, BooleanField, SubmitField,
-                     SelectMultipleField, SelectField, IntegerField, TextAreaField)
+                     SelectMultipleField, SelectField, IntegerField, TextAreaField, HiddenField)
 from wtforms.validators import DataRequired, Optional, Length, ValidationError, NumberRange
 from flask_wtf.file import FileField, FileAllowed, FileRequired
 from app.models.models import RouteTemplate, Stage, Role, Permission, User
@@ -202,6 +204,9 @@ class ConfirmStageQuantityForm(FlaskForm):
         ]
     )
     operator_name = StringField('Ваше ФИО', validators=[DataRequired()])
+    # Ключ идемпотентности: новый при каждой отрисовке формы, поэтому повторная
+    # отправка той же формы (двойное нажатие, повтор браузера) не подтверждает этап дважды
+    idempotency_key = HiddenField(default=lambda: uuid.uuid4().hex, validators=[Optional(), Length(max=64)])
     submit = SubmitField('Подтвердить выполнение')
 
 
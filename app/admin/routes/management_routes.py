@@ -2,8 +2,9 @@
 
 from flask import Blueprint, render_template, request, flash, redirect, url_for
 from flask_login import login_required, current_user
-from app.models.models import db, Part, AuditLog, RouteTemplate, RouteStage, Stage, Permission
+from app.models.models import db, Part, AuditLog, RouteTemplate, RouteStage, Stage, Permission, PartStageProgress, StatusHistory
 from app.admin.forms import PartForm, FileUploadForm, StageDictionaryForm, RouteTemplateForm
+from app.services import progress_service, route_service
 
 management_bp = Blueprint('management', __name__)
 
@@ -51,9 +52,14 @@ def delete_stage(stage_id):
     stage = db.get_or_404(Stage, stage_id)
     if RouteStage.query.filter_by(stage_id=stage_id).first():
         flash('Нельзя удалить этап, так как он используется в одном или нескольких маршрутах.', 'error')
+    elif StatusHistory.query.filter_by(stage_id=stage_id).first():
+        flash('Нельзя удалить этап, так как он присутствует в истории деталей.', 'error')
     else:
         stage_name = stage.name
+        # Прогресс по этапу - производные данные, удаляем вместе с этапом
+        PartStageProgress.query.filter_by(stage_id=stage_id).delete()
         db.session.delete(stage)
+        route_service.invalidate()
         db.session.commit()
         flash(f'Этап "{stage_name}" удален из справочника.', 'success')
     return redirect(url_for('admin.management.list_stages'))
@@ -83,6 +89,7 @@ def add_route():
 
             log_entry = AuditLog(user_id=current_user.id, action="Управление маршрутами", details=f"Создан новый маршрут '{new_template.name}'.", category='management')
             db.session.add(log_entry)
+            route_service.invalidate()
             
             db.session.commit()
             
@@ -115,6 +122,9 @@ def edit_route(route_id):
             for i, stage_id in enumerate(form.stages.data):
                 route_stage = RouteStage(template=template, stage_id=stage_id, order=i)
                 db.session.add(route_stage)
+            # Этапы маршрута входят в выдачу деталей изделий, использующих маршрут
+            progress_service.bump_product_versions_for_parts(Part.route_template_id == template.id)
+            route_service.invalidate()
 
             log_entry = AuditLog(user_id=current_user.id, action="Управление маршрутами", details=f"Изменен маршрут '{template.name}'.", category='management')
             db.session.add(log_entry)
@@ -141,6 +151,7 @@ def delete_route(route_id):
         db.session.delete(template)
         log_entry = AuditLog(user_id=current_user.id, action="Управление маршрутами", details=f"Удален маршрут '{template_name}'.", category='management')
         db.session.add(log_entry)
+        route_service.invalidate()
         db.session.commit()
         flash(f'Маршрут "{template_name}" успешно удален.', 'success')
     return redirect(url_for('admin.management.list_routes'))
\ No newline at end of file
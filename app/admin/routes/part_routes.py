@@ -81,7 +81,7 @@ def upload_excel():
 @permission_required(Permission.EDIT_PARTS)
 def edit_part(part_id):
     """Отображает и обрабатывает форму редактирования детали."""
-    part_to_edit = db.get_or_404(Part, part_id)
+    part_to_edit = Part.query.filter_by(part_id=part_id).first_or_404()
     form = EditPartForm(obj=part_to_edit)
 
     if form.validate_on_submit():
@@ -107,7 +107,7 @@ def edit_part(part_id):
 @permission_required(Permission.DELETE_PARTS)
 def delete_part(part_id):
     """Обрабатывает удаление одной детали."""
-    part_to_delete = db.get_or_404(Part, part_id)
+    part_to_delete = Part.query.filter_by(part_id=part_id).first_or_404()
     try:
         part_service.delete_single_part(part_to_delete, current_user, current_app.config)
         flash(f"Деталь {part_id} и вся ее история удалены.", 'success')
@@ -154,7 +154,7 @@ def qr_print_preview():
 @permission_required(Permission.EDIT_PARTS)
 def change_part_route(part_id):
     """Отображает и обрабатывает форму смены технологического маршрута."""
-    part = db.get_or_404(Part, part_id)
+    part = Part.query.filter_by(part_id=part_id).first_or_404()
     form = ChangeRouteForm(obj=part)
 
     if form.validate_on_submit():
@@ -210,7 +210,7 @@ def bulk_action():
 @permission_required(Permission.EDIT_PARTS)
 def change_responsible(part_id):
     """Отображает и обрабатывает форму смены ответственного."""
-    part = db.get_or_404(Part, part_id)
+    part = Part.query.filter_by(part_id=part_id).first_or_404()
     form = ChangeResponsibleForm()
 
     if request.method == 'GET':
@@ -231,7 +231,7 @@ def change_responsible(part_id):
 @permission_required(Permission.EDIT_PARTS)
 def change_responsible_form(part_id):
     """Возвращает HTML-код формы для смены ответственного (для модального окна)."""
-    part = db.get_or_404(Part, part_id)
+    part = Part.query.filter_by(part_id=part_id).first_or_404()
     form = ChangeResponsibleForm()
     form.responsible.data = part.responsible
     
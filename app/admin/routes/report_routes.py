@@ -5,10 +5,11 @@ from flask import (Blueprint, render_template, request, jsonify, flash,
 from flask_login import login_required
 from datetime import datetime
 from sqlalchemy import func
+from sqlalchemy.orm import aliased
 import io
 
-from app.models.models import db, StatusHistory, Part, Permission
-from app.admin.utils import permission_required
+from app.models.models import db, StatusHistory, Part, Stage, Operator, Permission
+from app.admin.utils import permission_required, parse_date_range
 from app.admin.forms import GenerateFromCloudForm
 from app.services import graph_service, document_service
 
@@ -39,7 +40,11 @@ def report_operator_performance():
 @permission_required(Permission.VIEW_REPORTS)
 def report_stage_duration():
     """Отображает страницу отчета по средней длительности этапов."""
-    return render_template('reports/stage_duration.html')
+    return render_template(
+        'reports/stage_duration.html',
+        date_from=request.args.get('date_from', ''),
+        date_to=request.args.get('date_to', '')
+    )
 
 
 @report_bp.route('/generate_from_cloud', methods=['GET', 'POST'])
@@ -106,18 +111,18 @@ def generate_from_cloud():
 @report_bp.route('/api/reports/operator_performance')
 @login_required
 def api_report_operator_performance():
-    date_from_str = request.args.get('date_from')
-    date_to_str = request.args.get('date_to')
+    start, end = parse_date_range(request.args)
+    # Группируем по идентификатору оператора, имя берем из справочника
     query = db.session.query(
-        StatusHistory.operator_name,
+        Operator.name.label('operator_name'),
         func.count(StatusHistory.id).label('stages_completed')
-    ).group_by(StatusHistory.operator_name).order_by(func.count(StatusHistory.id).desc())
-    if date_from_str:
-        date_from = datetime.strptime(date_from_str, '%Y-%m-%d').date()
-        query = query.filter(StatusHistory.timestamp >= date_from)
-    if date_to_str:
-        date_to = datetime.strptime(date_to_str, '%Y-%m-%d').date()
-        query = query.filter(StatusHistory.timestamp <= date_to)
+    ).join(Operator, Operator.id == StatusHistory.operator_id).group_by(
+        Operator.id, Operator.name
+    ).order_by(func.count(StatusHistory.id).desc())
+    if start:
+        query = query.filter(StatusHistory.timestamp >= start)
+    if end:
+        query = query.filter(StatusHistory.timestamp < end)
     
     data = query.all()
     
@@ -137,19 +142,38 @@ def api_report_operator_performance():
 @report_bp.route('/api/reports/stage_duration')
 @login_required
 def api_report_stage_duration():
-    previous_event_time = func.lag(StatusHistory.timestamp).over(
-        partition_by=StatusHistory.part_id, 
-        order_by=StatusHistory.timestamp
-    )
-    cte = db.session.query(
-        StatusHistory.status.label('stage_name'),
+    start, end = parse_date_range(request.args)
+    if start:
+        # С нижней границей предыдущее событие может лежать до начала периода:
+        # ищем его точечным запросом по индексу (part_pk, timestamp), а сами
+        # события периода выбираются только из нужных секций
+        previous_history = aliased(StatusHistory)
+        previous_event_time = db.session.query(func.max(previous_history.timestamp)).filter(
+            previous_history.part_pk == StatusHistory.part_pk,
+            previous_history.timestamp < StatusHistory.timestamp
+        ).scalar_subquery()
+    else:
+        previous_event_time = func.lag(StatusHistory.timestamp).over(
+            partition_by=StatusHistory.part_pk, 
+            order_by=StatusHistory.timestamp
+        )
+    cte_query = db.session.query(
+        StatusHistory.stage_id,
         (StatusHistory.timestamp - func.coalesce(previous_event_time, Part.date_added)).label('duration')
-    ).join(Part, Part.part_id == StatusHistory.part_id).subquery()
+    ).join(Part, Part.id == StatusHistory.part_pk)
+    if start:
+        cte_query = cte_query.filter(StatusHistory.timestamp >= start)
+    if end:
+        cte_query = cte_query.filter(StatusHistory.timestamp < end)
+    cte = cte_query.subquery()
     
+    # Группируем по идентификатору этапа, название берем из справочника
     report_data = db.session.query(
-        cte.c.stage_name,
+        Stage.name.label('stage_name'),
         func.extract('epoch', func.avg(cte.c.duration)).label('avg_duration_seconds'),
-    ).group_by(cte.c.stage_name).order_by(func.extract('epoch', func.avg(cte.c.duration)).desc()).all()
+    ).join(Stage, Stage.id == cte.c.stage_id).group_by(Stage.id, Stage.name).order_by(
+        func.extract('epoch', func.avg(cte.c.duration)).desc()
+    ).all()
 
     chart_data = {
         'labels': [row.stage_name for row in report_data],
@@ -1,14 +1,15 @@
 
 # app/admin/routes/user_routes.py
 
-from flask import Blueprint, render_template, request, flash, redirect, url_for
+from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from sqlalchemy.orm import joinedload
 from sqlalchemy.exc import IntegrityError
 
-from app.models.models import db, User, AuditLog, Role, Permission
+from app.models.models import db, User, AuditLog, Role, Permission, Part
 from app.admin.forms import LoginForm, AddUserForm, EditUserForm, RoleForm
-from app.admin.utils import admin_required, permission_required
+from app.admin.utils import admin_required, permission_required, parse_date_range
+from app.services import archive_service, progress_service
 
 user_bp = Blueprint('user', __name__)
 
@@ -16,8 +17,27 @@ user_bp = Blueprint('user', __name__)
 @permission_required(Permission.VIEW_AUDIT_LOG)
 def audit_log():
     page = request.args.get('page', 1, type=int)
-    logs = AuditLog.query.options(joinedload(AuditLog.user)).filter_by(category='part').order_by(AuditLog.timestamp.desc()).paginate(page=page, per_page=25)
-    return render_template('audit_log.html', logs=logs)
+    start, end = parse_date_range(request.args)
+    archived = request.args.get('archived', type=int) == 1
+    if archived:
+        # Архивные записи читаются из файлов только по явному запросу
+        records = archive_service.read_archived_logs(
+            current_app.config['AUDIT_ARCHIVE_FOLDER'], categories=['part'], start=start, end=end
+        )
+        return render_template(
+            'audit_log.html', logs=archive_service.ArchivePage(records, page, 25), archived=True,
+            date_from=request.args.get('date_from', ''), date_to=request.args.get('date_to', '')
+        )
+    query = AuditLog.query.options(joinedload(AuditLog.user)).filter_by(category='part')
+    if start:
+        query = query.filter(AuditLog.timestamp >= start)
+    if end:
+        query = query.filter(AuditLog.timestamp < end)
+    logs = query.order_by(AuditLog.timestamp.desc()).paginate(page=page, per_page=25)
+    return render_template(
+        'audit_log.html', logs=logs, archived=False,
+        date_from=request.args.get('date_from', ''), date_to=request.args.get('date_to', '')
+    )
 
 @user_bp.route('/user_log')
 @permission_required(Permission.VIEW_AUDIT_LOG)
@@ -151,6 +171,9 @@ def edit_user(user_id):
         if existing_user:
             flash('Пользователь с таким именем уже существует.', 'error')
         else:
+            if user.username != form.username.data:
+                # Имя ответственного входит в выдачу деталей изделий
+                progress_service.bump_product_versions_for_parts(Part.responsible_id == user.id)
             user.username = form.username.data
             user.role = form.role.data
             if form.password.data:
@@ -1,6 +1,7 @@
 # app/admin/utils.py
 
 import functools
+from datetime import datetime, timedelta
 from flask import flash, redirect, url_for
 from flask_login import login_required, current_user
 from app.models.models import Permission
@@ -18,4 +19,20 @@ def permission_required(permission):
     return decorator
 
 def admin_required(f):
-    return permission_required(Permission.ADMIN)(f)
\ No newline at end of file
+    return permission_required(Permission.ADMIN)(f)
+
+
+def parse_date_range(args):
+    """
+    Преобразует параметры date_from/date_to (ГГГГ-ММ-ДД) в полуоткрытый
+    интервал [начало, конец); граница "по" включает весь указанный день.
+    Пустые или некорректные значения дают None. Явные границы по timestamp
+    позволяют PostgreSQL отсекать лишние помесячные секции.
+    """
+    def parse(name):
+        try:
+            return datetime.strptime(args.get(name, ''), '%Y-%m-%d')
+        except ValueError:
+            return None
+    start, end = parse('date_from'), parse('date_to')
+    return start, end + timedelta(days=1) if end else None
@@ -4,8 +4,13 @@ import secrets
 import string
 import sys
 import os
+from datetime import date
+from flask import current_app
 from flask.cli import with_appcontext
-from .models.models import db, User, Role, Part, Stage, RouteTemplate, RouteStage, AuditLog, PartNote, ResponsibleHistory, StatusHistory
+from .models.models import (db, User, Role, Part, Stage, RouteTemplate, RouteStage, AuditLog, PartNote,
+                            ResponsibleHistory, StatusHistory, PartStageProgress, ProductProgress,
+                            PartClosure, Operator)
+from .services import progress_service, hierarchy_service, partition_service, archive_service, operator_service, route_service
 
 @click.command('seed')
 @with_appcontext
@@ -59,6 +64,11 @@ def seed_cypress_command():
     db.session.query(PartNote).delete()
     db.session.query(ResponsibleHistory).delete()
     db.session.query(StatusHistory).delete()
+    db.session.query(Operator).delete()
+    operator_service.invalidate()
+    db.session.query(PartStageProgress).delete()
+    db.session.query(ProductProgress).delete()
+    db.session.query(PartClosure).delete()
     db.session.query(Part).delete() 
     db.session.query(RouteStage).delete()
     db.session.query(User).delete() 
@@ -67,6 +77,7 @@ def seed_cypress_command():
     db.session.query(Role).delete()
     db.session.query(RouteTemplate).delete()
     db.session.query(Stage).delete()
+    route_service.invalidate()
     
     db.session.commit()
     # --- КОНЕЦ ИЗМЕНЕНИЯ ---
@@ -106,4 +117,83 @@ def seed_cypress_command():
     )
     db.session.add_all([part1, part2])
     db.session.commit()
-    click.secho("✅ База данных готова для Cypress-тестов.", fg="green")
\ No newline at end of file
+    progress_service.rebuild_product_progress()
+    hierarchy_service.rebuild_part_closure()
+    click.secho("✅ База данных готова для Cypress-тестов.", fg="green")
+
+@click.command('rebuild-product-progress')
+@with_appcontext
+def rebuild_product_progress_command():
+    """
+    Пересобирает с нуля сводку по изделиям (таблица ProductProgress),
+    которую использует панель мониторинга.
+    """
+    click.echo("Пересборка сводки по изделиям...")
+    count = progress_service.rebuild_product_progress()
+    click.secho(f"Готово. Изделий в сводке: {count}.", fg="green")
+
+@click.command('rebuild-part-closure')
+@with_appcontext
+def rebuild_part_closure_command():
+    """
+    Пересобирает с нуля таблицу замыкания иерархии деталей (PartClosure)
+    по ссылкам на родительские детали.
+    """
+    click.echo("Пересборка иерархии деталей...")
+    count = hierarchy_service.rebuild_part_closure()
+    click.secho(f"Готово. Строк в таблице замыкания: {count}.", fg="green")
+
+@click.group('partitions')
+def partitions_group():
+    """Обслуживание помесячных секций StatusHistory и AuditLogs (только PostgreSQL)."""
+
+def _partitioned_tables():
+    """Возвращает секционированные таблицы или сообщает, почему обслуживание невозможно."""
+    if not partition_service.is_supported():
+        click.secho("Секционирование поддерживается только на PostgreSQL. Таблицы не секционированы.", fg="yellow")
+        return []
+    tables = [t for t in partition_service.PARTITIONED_TABLES if partition_service.is_partitioned(t)]
+    if not tables:
+        click.secho("Таблицы не секционированы (включите HISTORY_PARTITIONING перед миграцией).", fg="yellow")
+    return tables
+
+@partitions_group.command('create')
+@click.option('--months-ahead', default=3, show_default=True, help="На сколько месяцев вперед создать секции.")
+@with_appcontext
+def create_partitions_command(months_ahead):
+    """Заранее создает секции на текущий и следующие месяцы."""
+    for table in _partitioned_tables():
+        created = partition_service.create_partitions(table, date.today(), months_ahead + 1)
+        click.echo(f"{table}: создано секций - {len(created)}" + (f" ({', '.join(created)})" if created else ""))
+
+@partitions_group.command('detach')
+@click.option('--older-than-months', type=int, required=True, help="Отсоединить секции старше указанного числа месяцев.")
+@click.option('--drop', is_flag=True, help="Удалить отсоединенные секции вместо сохранения их как отдельных таблиц.")
+@with_appcontext
+def detach_partitions_command(older_than_months, drop):
+    """Отсоединяет (или удаляет) секции со старыми записями."""
+    cutoff = partition_service.add_months(partition_service.month_start(date.today()), -older_than_months)
+    for table in _partitioned_tables():
+        detached = partition_service.detach_partitions_older_than(table, cutoff, drop=drop)
+        action = "удалено" if drop else "отсоединено"
+        click.echo(f"{table}: {action} секций - {len(detached)}" + (f" ({', '.join(detached)})" if detached else ""))
+
+@click.command('archive-audit')
+@click.option('--older-than', default='90d', show_default=True, help="Возраст записей для архивации, например 90d или 12w.")
+@click.option('--format', 'fmt', type=click.Choice(archive_service.ARCHIVE_FORMATS), default='jsonl', show_default=True,
+              help="Формат файлов архива: сжатый gzip JSONL или Parquet (требует pyarrow).")
+@click.option('--chunk-size', default=5000, show_default=True, help="Количество записей в одном файле архива.")
+@with_appcontext
+def archive_audit_command(older_than, fmt, chunk_size):
+    """
+    Переносит старые записи журнала аудита в сжатые файлы архива
+    и удаляет их из основной таблицы.
+    """
+    try:
+        age = archive_service.parse_age(older_than)
+        folder = current_app.config['AUDIT_ARCHIVE_FOLDER']
+        click.echo(f"Архивация записей журнала аудита старше {age.days} дн. в {folder}...")
+        rows, files = archive_service.archive_audit_logs(age, folder, chunk_size=chunk_size, fmt=fmt)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.secho(f"Готово. Перенесено записей: {rows}, файлов: {files}.", fg="green")
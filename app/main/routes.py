@@ -1,20 +1,26 @@
 # app/main/routes.py
 
 from flask import (Blueprint, render_template, jsonify, request, redirect,
-                   url_for, flash, current_app)
-from sqlalchemy import func
-from sqlalchemy.orm import joinedload 
+                   url_for, flash, current_app, session, make_response)
+from sqlalchemy.orm import joinedload
 
+import functools
+import hashlib
+import hmac
+import time
 from datetime import datetime, timezone
-from collections import Counter, defaultdict
+from urllib.parse import quote
 
-from app import db, socketio
+from app import csrf, db, socketio
 from flask_login import current_user, login_required
-from app.models.models import (Part, StatusHistory, AuditLog, RouteTemplate,
-                               RouteStage, Stage, PartNote, Permission)
+from flask_wtf.csrf import generate_csrf
+from app.models.models import (Part, StatusHistory, AuditLog,
+                               RouteStage, Stage, PartNote, Permission, ProductProgress)
 from app.admin.forms import ConfirmStageQuantityForm, AddNoteForm, AddChildPartForm
-from app.services import query_service
-from app.utils import to_safe_key
+from app.services import (query_service, progress_service, hierarchy_service, operator_service,
+                          cache_service, route_service, search_service, confirmation_service,
+                          idempotency_service)
+from app.utils import to_safe_key, json_response
 
 main = Blueprint('main', __name__)
 
@@ -27,103 +33,412 @@ def _send_websocket_notification(event_type: str, message: str, part_id: str = N
     socketio.emit('notification', data)
 
 
+def _idempotency_key():
+    """Ключ идемпотентности из заголовка Idempotency-Key или скрытого поля формы."""
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or ''
+    return key.strip() or None
+
+
+def _make_etag(*key_parts):
+    """Сильный ETag из версии данных и всего, от чего еще зависит ответ."""
+    return hashlib.sha1(repr(key_parts).encode('utf-8')).hexdigest()
+
+
+def _viewer_key():
+    """Пользователь и его права: от них зависят кнопки и меню в ответе."""
+    if not current_user.is_authenticated:
+        return None
+    return current_user.id, current_user.username, current_user.role.permissions if current_user.role else 0
+
+
+def _not_modified(etag):
+    """Ответ 304, если у клиента уже есть представление с этим ETag, иначе None."""
+    if not request.if_none_match.contains(etag):
+        return None
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+
+def _with_etag(response, etag):
+    response = make_response(response)
+    response.set_etag(etag)
+    # Браузер хранит ответ, но перед использованием всегда переспрашивает сервер
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _load_stage_wip(product_designations):
+    """
+    Незавершенное производство по этапам для изделий: {изделие: [[этап, штук], ...]}.
+    Кэшируется по версии каждого изделия, поэтому после изменения одного
+    изделия агрегирующий запрос пересчитывает только его.
+    """
+    cache = cache_service.get_cache()
+    versions = progress_service.get_product_versions()
+    # Версия читается до подсчета: данные под ключом не старше его версии
+    keys = {pd: cache_service.stage_wip_key(pd, versions.get(pd, 0)) for pd in product_designations}
+    wip_by_product = {}
+    for product_designation, key in keys.items():
+        wip = cache.get(key)
+        if wip is not None:
+            wip_by_product[product_designation] = wip
+
+    stale = [pd for pd in product_designations if pd not in wip_by_product]
+    if stale:
+        computed = progress_service.get_stage_wip(stale)
+        for product_designation in stale:
+            wip = [[stage_name, units] for stage_name, units in computed.get(product_designation, ())]
+            cache.set(keys[product_designation], wip)
+            wip_by_product[product_designation] = wip
+    return wip_by_product
+
+
+def _load_dashboard_products():
+    """Сводка по изделиям с количеством штук на каждом этапе маршрутов."""
+    # Сводка по "корневым" деталям поддерживается инкрементально в ProductProgress
+    product_progress_rows = ProductProgress.query.order_by(ProductProgress.product_designation).all()
+    wip_by_product = _load_stage_wip([row.product_designation for row in product_progress_rows])
+
+    return [{
+        'product_designation': row.product_designation,
+        'total_parts': row.total_parts,
+        'total_possible_stages': row.total_quantity or 0,
+        'total_completed_stages': row.completed_quantity or 0,
+        'stage_wip': wip_by_product[row.product_designation]
+    } for row in product_progress_rows]
+
+
 @main.route('/')
 def dashboard():
     """
     Главная страница (панель мониторинга).
     Отображает сводную информацию по всем изделиям.
+    Отвечает 304 по If-None-Match, пока не изменилось ни одно изделие.
     """
-    # Запрос выбирает только "корневые" детали (у которых нет родителя)
-    product_progress_query = db.session.query(
-        Part.product_designation,
-        func.count(Part.part_id).label('total_parts'),
-        func.sum(Part.quantity_total).label('total_quantity'),
-        func.sum(Part.quantity_completed).label('completed_quantity')
-    ).filter(Part.parent_id.is_(None)).group_by(Part.product_designation).all()
-
-    products = [{
-        'product_designation': row.product_designation,
-        'total_parts': row.total_parts,
-        'total_possible_stages': row.total_quantity or 0,
-        'total_completed_stages': row.completed_quantity or 0
-    } for row in product_progress_query]
+    # Страница содержит CSRF-токен с ограниченным сроком жизни, поэтому
+    # закэшированная копия переиспользуется не дольше половины этого срока
+    csrf_time_limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    csrf_period = int(time.time() // (csrf_time_limit / 2)) if csrf_time_limit else None
+    generate_csrf()  # создает секрет токена в сессии при первом обращении
+    dashboard_version = progress_service.get_dashboard_version()
+    etag = _make_etag(
+        'dashboard', dashboard_version, _viewer_key(),
+        session.get(current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')), csrf_period
+    )
+    # Отложенные flash-сообщения показываются только в свежеотрисованной странице
+    if '_flashes' not in session:
+        not_modified = _not_modified(etag)
+        if not_modified is not None:
+            return not_modified
+
+    # Сводка кэшируется по версии панели: любое изменение деталей дает новый
+    # ключ, а незавершенное производство пересчитывается только для измененных изделий
+    cache = cache_service.get_cache()
+    cache_key = cache_service.dashboard_key(dashboard_version)
+    products = cache.get(cache_key)
+    if products is None:
+        products = _load_dashboard_products()
+        cache.set(cache_key, products)
+
+    return _with_etag(render_template('dashboard.html', products=products), etag)
+
+
+# Поля, которые можно запросить у /api/parts через параметр fields=
+PART_FIELDS = (
+    'part_id', 'name', 'material', 'size', 'current_status', 'creation_date',
+    'quantity_completed', 'quantity_total', 'route_stages', 'responsible_user',
+    'history_url', 'delete_url', 'edit_url', 'qr_url'
+)
+# Размер страницы по умолчанию и максимальный
+PARTS_PAGE_SIZE = 200
+PARTS_MAX_PAGE_SIZE = 1000
+# Максимальная глубина поддерева, отдаваемого за один запрос
+CHILDREN_MAX_DEPTH = 10
+
+
+def _route_stages_data(part, completed_quantities):
+    """Статусы этапов маршрута детали по выполненным количествам."""
+    route_stages_data = []
+    for rs in route_service.get_route_stages(part.route_template_id):
+        qty_done = completed_quantities.get(rs.stage_id, 0)
+        status = 'pending' # По умолчанию - не начат
+
+        if qty_done >= part.quantity_total:
+            status = 'completed' # Выполнен, если сделано >= общего кол-ва
+        elif qty_done > 0:
+            status = 'in_progress' # В процессе, если сделано > 0, но < общего
+
+        route_stages_data.append({
+            'name': rs.stage_name,
+            'status': status,
+            'qty_done': qty_done
+        })
+    return route_stages_data
+
+
+# Значения полей детали, кроме адресов страниц: (деталь, выполненные количества) -> значение
+_PART_GETTERS = {
+    'part_id': lambda part, done: part.part_id,
+    'name': lambda part, done: part.name,
+    'material': lambda part, done: part.material,
+    'size': lambda part, done: part.size,
+    'current_status': lambda part, done: part.current_status,
+    'creation_date': lambda part, done: part.date_added.date().isoformat(),
+    'quantity_completed': lambda part, done: part.quantity_completed,
+    'quantity_total': lambda part, done: part.quantity_total,
+    'route_stages': lambda part, done: _route_stages_data(part, done),
+    'responsible_user': lambda part, done: part.responsible.username if part.responsible else 'Не назначен',
+}
+# Адреса страниц детали: поле ответа -> endpoint с параметром part_id
+PART_URL_ENDPOINTS = {
+    'history_url': 'main.history',
+    'delete_url': 'admin.part.delete_part',
+    'edit_url': 'admin.part.edit_part',
+    'qr_url': 'admin.part.generate_single_qr',
+}
+_PART_ID_PLACEHOLDER = 'PART-ID-PLACEHOLDER'
+
+
+def _quote_part_id(part_id):
+    # Тот же набор незакодированных символов, что у конвертера path в Werkzeug
+    return quote(part_id, safe="!$&'()*+,/:;=@")
+
+
+def _part_url_templates(fields):
+    """
+    Шаблоны адресов страниц детали для запрошенных полей: {поле: (префикс, суффикс)}.
+    url_for вызывается один раз на endpoint за запрос, адрес каждой детали
+    собирается конкатенацией с обозначением, закодированным так же, как в url_for.
+    """
+    templates = {}
+    for field in fields:
+        endpoint = PART_URL_ENDPOINTS.get(field)
+        if endpoint:
+            prefix, suffix = url_for(endpoint, part_id=_PART_ID_PLACEHOLDER).split(_PART_ID_PLACEHOLDER)
+            templates[field] = (prefix, suffix)
+    return templates
+
+
+def _serialize_part(part, fields, completed_quantities, url_templates):
+    """Собирает словарь только из запрошенных полей детали."""
+    data = {field: _PART_GETTERS[field](part, completed_quantities)
+            for field in fields if field in _PART_GETTERS}
+    if url_templates:
+        quoted_id = _quote_part_id(part.part_id)
+        for field, (prefix, suffix) in url_templates.items():
+            data[field] = prefix + quoted_id + suffix
+    return data
+
+
+def _parse_fields():
+    """Разбирает параметр fields=; возвращает (поля, ответ с ошибкой 400 или None)."""
+    if not request.args.get('fields'):
+        return PART_FIELDS, None
+    fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+    unknown = [f for f in fields if f not in PART_FIELDS]
+    if unknown:
+        return None, (jsonify({'status': 'error', 'message': f"Неизвестные поля: {', '.join(unknown)}"}), 400)
+    return fields, None
+
+
+def _current_permissions():
+    if not current_user.is_authenticated:
+        return None
+    return {
+        'can_delete': current_user.can(Permission.DELETE_PARTS),
+        'can_edit': current_user.can(Permission.EDIT_PARTS),
+        'can_generate_qr': current_user.can(Permission.GENERATE_QR)
+    }
+
+
+def _part_load_options(fields):
+    """Параметры загрузки связей, нужных только для запрошенных полей."""
+    # Этапы маршрутов берутся из кэша route_service, а не из связей ORM
+    options = []
+    if 'responsible_user' in fields:
+        options.append(joinedload(Part.responsible))
+    return options
+
+
+def _load_parts_page(product_designation, fields, limit, after):
+    """Одна страница корневых деталей изделия в виде готового к JSON словаря."""
+    parts_query = Part.query.options(*_part_load_options(fields)).filter(
+        Part.product_designation == product_designation,
+        Part.parent_pk.is_(None)
+    )
+    if after:
+        parts_query = parts_query.filter(Part.part_id > after)
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    parts = parts_query.order_by(Part.part_id.asc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(parts) > limit:
+        parts = parts[:limit]
+        next_cursor = parts[-1].part_id
+
+    progress_by_part = {}
+    if 'route_stages' in fields:
+        progress_by_part = progress_service.get_completed_quantities_for_parts(
+            [part.id for part in parts]
+        )
 
-    return render_template('dashboard.html', products=products)
+    url_templates = _part_url_templates(fields)
+    parts_list = [
+        _serialize_part(part, fields, progress_by_part.get(part.id, {}), url_templates) for part in parts
+    ]
+    return {'parts': parts_list, 'next_cursor': next_cursor}
 
 
 @main.route('/api/parts/<path:product_designation>')
 def api_parts_for_product(product_designation):
     """
     API-эндпоинт для динамической загрузки списка деталей для изделия.
+    Поддерживает постраничную выдачу по ключу: `after` - обозначение последней
+    детали предыдущей страницы, `limit` - размер страницы. Параметр `fields`
+    (через запятую) ограничивает набор полей в ответе. Ответ снабжается ETag
+    по версии изделия; на If-None-Match с той же версией возвращается 304.
     """
-    parts_query = Part.query.options(
-        joinedload(Part.route_template).joinedload(RouteTemplate.stages).joinedload(RouteStage.stage),
-        joinedload(Part.responsible)
-    ).filter(
-        Part.product_designation == product_designation,
-        Part.parent_id.is_(None)
-    ).order_by(Part.part_id.asc())
-
-    parts_list = []
-    for part in parts_query:
-        route_stages_data = []
-        if part.route_template:
-            # Суммируем фактическое количество выполненных изделий по каждому этапу
-            completed_quantities = defaultdict(int)
-            for h in part.history:
-                completed_quantities[h.status] += h.quantity
-
-            ordered_stages = sorted(part.route_template.stages, key=lambda s: s.order)
-            
-            for rs in ordered_stages:
-                stage_name = rs.stage.name
-                qty_done = completed_quantities.get(stage_name, 0)
-                status = 'pending' # По умолчанию - не начат
-
-                if qty_done >= part.quantity_total:
-                    status = 'completed' # Выполнен, если сделано >= общего кол-ва
-                elif qty_done > 0:
-                    status = 'in_progress' # В процессе, если сделано > 0, но < общего
-
-                route_stages_data.append({
-                    'name': stage_name, 
-                    'status': status,
-                    'qty_done': qty_done
-                })
-        
-        parts_list.append({
-            'part_id': part.part_id,
-            'name': part.name,
-            'material': part.material,
-            'size': part.size,
-            'current_status': part.current_status,
-            'creation_date': part.date_added.strftime('%Y-%m-%d'),
-            'quantity_completed': part.quantity_completed,
-            'quantity_total': part.quantity_total,
-            'history_url': url_for('main.history', part_id=part.part_id),
-            'route_stages': route_stages_data,
-            'delete_url': url_for('admin.part.delete_part', part_id=part.part_id),
-            'edit_url': url_for('admin.part.edit_part', part_id=part.part_id),
-            'qr_url': url_for('admin.part.generate_single_qr', part_id=part.part_id),
-            'responsible_user': part.responsible.username if part.responsible else 'Не назначен'
-        })
-
-    permissions = None
-    if current_user.is_authenticated:
-        permissions = {
-            'can_delete': current_user.can(Permission.DELETE_PARTS),
-            'can_edit': current_user.can(Permission.EDIT_PARTS),
-            'can_generate_qr': current_user.can(Permission.GENERATE_QR)
-        }
-
-    return jsonify({'parts': parts_list, 'permissions': permissions})
+    fields, error = _parse_fields()
+    if error:
+        return error
+    limit = min(max(request.args.get('limit', PARTS_PAGE_SIZE, type=int), 1), PARTS_MAX_PAGE_SIZE)
+    after = request.args.get('after')
+
+    # Версия изделия меняется при любом изменении его деталей: если клиент
+    # уже получал эту страницу той же версии, запрос деталей не выполняется
+    version = progress_service.get_product_version(product_designation)
+    etag = _make_etag('parts', product_designation, version, fields, limit, after, _viewer_key())
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    # Выдача не зависит от пользователя и кэшируется по версии изделия;
+    # права пользователя добавляются к ней при каждом запросе
+    cache = cache_service.get_cache()
+    cache_key = cache_service.parts_page_key(product_designation, version, (fields, limit, after))
+    page = cache.get(cache_key)
+    if page is None:
+        page = _load_parts_page(product_designation, fields, limit, after)
+        cache.set(cache_key, page)
+
+    return _with_etag(json_response({
+        'parts': page['parts'], 'permissions': _current_permissions(),
+        'next_cursor': page['next_cursor'], 'token': version
+    }), etag)
+
+
+@main.route('/api/parts/<path:product_designation>/changes')
+def api_part_changes(product_designation):
+    """
+    Изменения корневых деталей изделия после токена `since` (значение `token`
+    из предыдущего ответа /api/parts или этого эндпоинта). Возвращает
+    измененные и новые детали, обозначения удаленных деталей и новый токен.
+    """
+    since = request.args.get('since', type=int)
+    if since is None or since < 0:
+        return jsonify({'status': 'error', 'message': "Параметр since обязателен."}), 400
+    fields, error = _parse_fields()
+    if error:
+        return error
+
+    version, parts, deleted = progress_service.get_changes(product_designation, since, _part_load_options(fields))
+    if since > version:
+        # Токен из будущего: база пересоздана, клиенту нужна полная перезагрузка
+        return jsonify({'status': 'error', 'message': "Токен устарел, загрузите список заново."}), 410
+
+    progress_by_part = {}
+    if 'route_stages' in fields:
+        progress_by_part = progress_service.get_completed_quantities_for_parts([part.id for part in parts])
+    url_templates = _part_url_templates(fields)
+    return json_response({
+        'parts': [_serialize_part(part, fields, progress_by_part.get(part.id, {}), url_templates)
+                  for part in parts],
+        'deleted': deleted,
+        'permissions': _current_permissions(),
+        'token': version
+    })
+
+
+@main.route('/api/children/<path:part_id>')
+def api_part_children(part_id):
+    """
+    Компоненты детали до глубины `depth` (по умолчанию 1 - только
+    непосредственные) в виде дерева. Поддерево читается одним запросом
+    по таблице замыкания, флаг `has_children` - одним сгруппированным
+    подсчетом, поэтому узлы на границе глубины можно раскрыть следующим запросом.
+    """
+    part = Part.query.filter_by(part_id=part_id).first_or_404()
+    depth = min(max(request.args.get('depth', 1, type=int), 1), CHILDREN_MAX_DEPTH)
+    fields, error = _parse_fields()
+    if error:
+        return error
+
+    version = progress_service.get_product_version(part.product_designation)
+    etag = _make_etag('children', part.id, version, fields, depth, _viewer_key())
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+
+    nodes = hierarchy_service.get_subtree_nodes(part, depth, _part_load_options(fields))
+    pks = [node.id for node, _ in nodes]
+    children_counts = hierarchy_service.count_children(pks)
+    progress_by_part = {}
+    if 'route_stages' in fields:
+        progress_by_part = progress_service.get_completed_quantities_for_parts(pks)
+
+    # Узлы идут по возрастанию глубины, поэтому родитель собран раньше потомков
+    url_templates = _part_url_templates(fields)
+    serialized = {part.id: {'children': []}}
+    for node, node_depth in nodes:
+        data = _serialize_part(node, fields, progress_by_part.get(node.id, {}), url_templates)
+        data['has_children'] = children_counts.get(node.id, 0) > 0
+        if node_depth < depth:
+            data['children'] = []
+        serialized[node.id] = data
+        serialized[node.parent_pk]['children'].append(data)
+
+    return _with_etag(json_response({
+        'part_id': part.part_id,
+        'depth': depth,
+        'children': serialized[part.id]['children'],
+        'permissions': _current_permissions()
+    }), etag)
+
+
+@main.route('/api/search')
+def api_search():
+    """
+    Поиск деталей по обозначению, наименованию, материалу и изделию.
+    `q` - слова запроса (каждое должно встретиться), `page` и `limit` -
+    номер и размер страницы. Результаты упорядочены по релевантности.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'status': 'error', 'message': "Параметр q обязателен."}), 400
+    limit = min(max(request.args.get('limit', search_service.SEARCH_PAGE_SIZE, type=int), 1),
+                search_service.SEARCH_MAX_PAGE_SIZE)
+    page = max(request.args.get('page', 1, type=int), 1)
+
+    parts, has_next = search_service.search_parts(query, limit=limit, offset=(page - 1) * limit)
+    fields = ('part_id', 'name', 'material', 'current_status', 'history_url')
+    url_templates = _part_url_templates(fields)
+    results = []
+    for part in parts:
+        data = _serialize_part(part, fields, {}, url_templates)
+        data['product_designation'] = part.product_designation
+        results.append(data)
+    return json_response({'query': query, 'page': page, 'has_next': has_next, 'results': results})
 
 
 @main.route('/history/<path:part_id>')
 def history(part_id):
     """Страница с полной историей одной детали."""
-    part = db.get_or_404(Part, part_id)
-    combined_history = query_service.get_combined_history(part)
+    part = Part.query.filter_by(part_id=part_id).first_or_404()
+    include_archived = request.args.get('archived', type=int) == 1
+    combined_history = query_service.get_combined_history(part, include_archived=include_archived)
+    # Состав изделия строится из одного запроса к таблице замыкания
+    ancestors = hierarchy_service.get_ancestors(part)
+    children_map = hierarchy_service.build_children_map(hierarchy_service.get_subtree(part))
     note_form = AddNoteForm()
     child_form = AddChildPartForm()
 
@@ -136,6 +451,7 @@ def history(part_id):
 
     return render_template(
         'history.html', part=part, combined_history=combined_history,
+        ancestors=ancestors, children_map=children_map, include_archived=include_archived,
         note_form=note_form, child_form=child_form
     )
 
@@ -143,26 +459,17 @@ def history(part_id):
 @main.route('/scan/<path:part_id>')
 def select_stage(part_id):
     """Страница, открывающаяся после сканирования QR-кода."""
-    part = db.get_or_404(Part, part_id)
-    if not part.route_template:
+    part = Part.query.filter_by(part_id=part_id).first_or_404()
+    if part.route_template_id is None:
         flash('Ошибка: Этой детали не присвоен технологический маршрут.', 'error')
         return redirect(url_for('main.dashboard'))
 
-    completed_quantities = defaultdict(int)
-    for h in part.history:
-        completed_quantities[h.status] += h.quantity
-        
-    ordered_stages = sorted(part.route_template.stages, key=lambda s: s.order)
-    next_stage_obj = None
-    for rs in ordered_stages:
-        # Ищем первый этап, на котором выполнено меньше, чем общее количество
-        if completed_quantities.get(rs.stage.name, 0) < part.quantity_total:
-            next_stage_obj = rs.stage
-            break
+    completed_quantities = progress_service.get_completed_quantities(part)
+    next_stage_obj = progress_service.find_next_stage(part, completed_quantities)
 
     form = ConfirmStageQuantityForm()
     if next_stage_obj and form.quantity.data is None:
-        completed_on_this_stage = completed_quantities.get(next_stage_obj.name, 0)
+        completed_on_this_stage = completed_quantities.get(next_stage_obj.id, 0)
         remaining = part.quantity_total - completed_on_this_stage
         form.quantity.data = remaining if remaining > 0 else 1
 
@@ -171,64 +478,90 @@ def select_stage(part_id):
     )
 
 
+# Область ключей идемпотентности подтверждений этапа из формы
+CONFIRM_STAGE_SCOPE = 'confirm_stage'
+# Область ключей идемпотентности подтверждений со сканера (/api/scan)
+SCAN_CONFIRM_SCOPE = 'scan_confirm'
+
+
 @main.route('/confirm_stage/<path:part_id>/<int:stage_id>', methods=['POST'])
 def confirm_stage(part_id, stage_id):
     """Обрабатывает подтверждение завершения этапа."""
-    part = db.get_or_404(Part, part_id)
-    stage = db.get_or_404(Stage, stage_id)
+    part = Part.query.filter_by(part_id=part_id).first_or_404()
+    # Этап маршрута детали берется из кэша; этап вне маршрута - из справочника
+    stage = route_service.find_route_stage(part.route_template_id, stage_id)
+    if stage is None:
+        stage_obj = db.get_or_404(Stage, stage_id)
+        stage = route_service.RouteStageInfo(stage_obj.id, stage_obj.name)
     form = ConfirmStageQuantityForm()
 
     if form.validate_on_submit():
         quantity_done = form.quantity.data
-        
-        completed_on_this_stage = db.session.query(func.sum(StatusHistory.quantity)).filter_by(part_id=part.part_id, status=stage.name).scalar() or 0
-        remaining_on_stage = part.quantity_total - completed_on_this_stage
-        
-        if quantity_done > remaining_on_stage:
+        now = datetime.now(timezone.utc)
+
+        # Повторная отправка формы (двойное нажатие, повтор после обрыва связи)
+        # с тем же ключом не подтверждает этап второй раз, а повторяет ответ
+        idempotency_key = _idempotency_key()
+        if idempotency_key:
+            try:
+                stored = idempotency_service.begin(
+                    CONFIRM_STAGE_SCOPE, idempotency_key,
+                    idempotency_service.fingerprint(part.part_id, stage.stage_id, quantity_done,
+                                                    form.operator_name.data)
+                )
+            except idempotency_service.IdempotencyKeyError as e:
+                db.session.rollback()
+                flash(f'Ошибка: {e}', 'error')
+                return redirect(url_for('main.select_stage', part_id=part_id))
+            if stored is not None:
+                db.session.rollback()
+                flash(stored['body']['message'], stored['body']['category'])
+                return redirect(stored['body']['location'])
+
+        # Проверка остатка и увеличение счетчика - под блокировкой детали
+        # и одним условным UPDATE: параллельные сканеры не подтвердят лишнего
+        progress_service.lock_part(part)
+        if progress_service.claim_stage_progress(part, stage.stage_id, quantity_done, now) is None:
+            completed_on_this_stage = progress_service.get_completed_quantities(part).get(stage.stage_id, 0)
+            remaining_on_stage = part.quantity_total - completed_on_this_stage
+            db.session.rollback()
             flash(f'Ошибка: Нельзя выполнить {quantity_done} шт. '
                   f'На этом этапе осталось {remaining_on_stage} шт.', 'error')
-            return redirect(url_for('main.select_stage', part_id=part.part_id))
+            return redirect(url_for('main.select_stage', part_id=part_id))
 
         new_history = StatusHistory(
-            part_id=part_id,
-            status=stage.name,
+            part_pk=part.id,
+            stage_id=stage.stage_id,
+            status=stage.stage_name,
+            operator_id=operator_service.resolve_operator_id(form.operator_name.data),
             operator_name=form.operator_name.data,
-            quantity=quantity_done
+            quantity=quantity_done,
+            timestamp=now
         )
         db.session.add(new_history)
 
-        # === НАЧАЛО КЛЮЧЕВОГО ИСПРАВЛЕНИЯ ЛОГИКИ ПРОГРЕССА ===
-        
-        # Получаем все этапы маршрута
-        ordered_stages = sorted(part.route_template.stages, key=lambda s: s.order)
-        stage_names = [rs.stage.name for rs in ordered_stages]
+        # Узкое место считается по счетчикам этапов детали, а не по всей истории
+        completed_quantities = progress_service.get_completed_quantities(part)
 
-        # Получаем всю историю по этой детали
-        all_history = StatusHistory.query.filter_by(part_id=part.part_id).all()
-        
-        # Считаем, сколько сделано на каждом этапе
-        completed_quantities = defaultdict(int)
-        for h in all_history:
-            completed_quantities[h.status] += h.quantity
-        # Добавляем только что выполненное количество, чтобы учесть его в расчете
-        completed_quantities[stage.name] += quantity_done
-        
         # Находим "узкое место" - этап с минимальным количеством выполненных изделий
-        # Если этап еще не начат, считаем, что там 0.
-        min_completed = part.quantity_total
-        for stage_name in stage_names:
-            qty = completed_quantities.get(stage_name, 0)
-            if qty < min_completed:
-                min_completed = qty
-
-        part.quantity_completed = min_completed
-        # === КОНЕЦ КЛЮЧЕВОГО ИСПРАВЛЕНИЯ ===
-        
-        part.current_status = stage.name
-        part.last_update = datetime.now(timezone.utc)
+        progress_service.set_part_quantity_completed(
+            part, progress_service.calculate_bottleneck(part, completed_quantities)
+        )
         
+        part.current_status = stage.stage_name
+        part.last_update = now
+        progress_service.touch_parts([part])
+
+        message = (f"Статус для детали {part_id} обновлен на '{stage.stage_name}'! "
+                   f"Готово: {quantity_done} шт.")
+        if idempotency_key:
+            idempotency_service.complete(CONFIRM_STAGE_SCOPE, idempotency_key, {
+                'message': message, 'category': 'success', 'location': url_for('main.dashboard')
+            })
+
         db.session.commit()
 
+        cache_service.invalidate_product(part.product_designation)
         socketio.emit('update_dashboard', {
             'part_id': part.part_id,
             'new_status': part.current_status,
@@ -240,12 +573,11 @@ def confirm_stage(part_id, stage_id):
 
         _send_websocket_notification(
             'stage_completed',
-            f"Деталь {part_id} перешла на этап '{stage.name}'.",
+            f"Деталь {part_id} перешла на этап '{stage.stage_name}'.",
             part.part_id
         )
 
-        flash(f"Статус для детали {part_id} обновлен на '{stage.name}'! "
-              f"Готово: {quantity_done} шт.", "success")
+        flash(message, "success")
         return redirect(url_for('main.dashboard'))
 
     return render_template(
@@ -253,11 +585,215 @@ def confirm_stage(part_id, stage_id):
     )
 
 
+def _scanner_token_required(view):
+    """
+    Доступ к JSON API подтверждений для терминалов сбора данных: заголовок
+    Authorization: Bearer <токен> с одним из токенов SCANNER_API_TOKENS.
+    Терминал не хранит сессию браузера и не получает CSRF-токен, поэтому
+    такие эндпоинты исключаются из CSRF-проверки и защищены токеном.
+    """
+    @functools.wraps(view)
+    def decorated_view(*args, **kwargs):
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        token = token.strip().encode('utf-8')
+        if scheme.lower() != 'bearer' or not token or not any(
+            hmac.compare_digest(token, allowed.encode('utf-8'))
+            for allowed in current_app.config.get('SCANNER_API_TOKENS', ())
+        ):
+            response = jsonify({'status': 'error', 'message': "Требуется токен терминала сбора данных."})
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, 401
+        return view(*args, **kwargs)
+    return decorated_view
+
+
+def _json_operator_name(payload):
+    """ФИО оператора из тела JSON-запроса с нормализованными пробелами."""
+    return ' '.join(str(payload.get('operator_name') or '').split())
+
+
+def _reserve_idempotency_key(items, operator_name, replay, scope=confirmation_service.IDEMPOTENCY_SCOPE):
+    """
+    Занимает ключ идемпотентности JSON-подтверждения (заголовок Idempotency-Key)
+    в области scope.
+    Возвращает (ключ, ответ): ответ не None, если запрос выполнять не нужно -
+    ключ слишком длинный (400), занят другим запросом (422) или запрос уже выполнен
+    (тогда ответ строит replay по сохраненному результату).
+    """
+    idempotency_key = _idempotency_key()
+    if not idempotency_key:
+        return None, None
+    try:
+        stored = idempotency_service.begin(
+            scope, idempotency_key, confirmation_service.batch_fingerprint(items, operator_name)
+        )
+    except idempotency_service.IdempotencyKeyTooLong as e:
+        return idempotency_key, (jsonify({'status': 'error', 'message': str(e)}), 400)
+    except idempotency_service.IdempotencyKeyConflict as e:
+        db.session.rollback()
+        return idempotency_key, (jsonify({'status': 'error', 'message': str(e)}), 422)
+    if stored is not None:
+        db.session.rollback()
+        return idempotency_key, replay(stored)
+    return idempotency_key, None
+
+
+@main.route('/api/confirm_batch', methods=['POST'])
+@csrf.exempt
+@_scanner_token_required
+def api_confirm_batch():
+    """
+    Пакетное подтверждение этапов (палета, комплект) одним запросом.
+    Тело: {"operator_name": "...", "items": [{"part_id", "stage_id", "quantity"}, ...]};
+    quantity по умолчанию 1. Пакет применяется целиком или не применяется:
+    при ошибке в любой позиции возвращается 400 со списком ошибок.
+    Требует токен терминала сбора данных (Authorization: Bearer).
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'status': 'error', 'message': "Тело запроса должно быть JSON-объектом."}), 400
+    operator_name = _json_operator_name(payload)
+    raw_items = payload.get('items')
+    if not operator_name:
+        return jsonify({'status': 'error', 'message': "Не указано ФИО оператора."}), 400
+    if not isinstance(raw_items, list) or not raw_items:
+        return jsonify({'status': 'error', 'message': "Список items пуст или имеет неверный формат."}), 400
+    if len(raw_items) > confirmation_service.MAX_BATCH_SIZE:
+        return jsonify({'status': 'error', 'message':
+                        f"В пакете не более {confirmation_service.MAX_BATCH_SIZE} позиций."}), 400
+
+    items, errors = [], []
+    for index, raw in enumerate(raw_items):
+        try:
+            item = confirmation_service.BatchItem(
+                str(raw['part_id']), int(raw['stage_id']), int(raw.get('quantity', 1))
+            )
+        except (TypeError, KeyError, ValueError, AttributeError):
+            errors.append({'index': index, 'part_id': None,
+                           'message': "Позиция должна содержать part_id и stage_id."})
+            continue
+        if item.quantity < 1:
+            errors.append({'index': index, 'part_id': item.part_id,
+                           'message': "Количество должно быть не меньше 1."})
+        items.append(item)
+    if errors:
+        return jsonify({'status': 'error', 'errors': errors}), 400
+
+    # Повтор пакета с тем же ключом возвращает сохраненный ответ без записи
+    idempotency_key, early_response = _reserve_idempotency_key(
+        items, operator_name, lambda stored: (jsonify(stored['body']), stored['status_code'])
+    )
+    if early_response is not None:
+        return early_response
+
+    try:
+        parts = confirmation_service.confirm_batch(items, operator_name, idempotency_key)
+    except confirmation_service.BatchValidationError as e:
+        # Откат освобождает и ключ идемпотентности: исправленный пакет можно повторить
+        db.session.rollback()
+        return jsonify({'status': 'error', 'errors': e.errors}), 400
+
+    return jsonify(confirmation_service.batch_response(parts, len(items)))
+
+
+def _scan_state(part_id):
+    """
+    Состояние детали для сканера: деталь, следующий этап и остаток на нем.
+    Деталь и ее счетчики читаются одним запросом, этапы маршрута - из кэша.
+    Возвращает (тело ответа, код ответа).
+    """
+    part, completed_quantities = progress_service.get_part_with_progress(part_id)
+    if part is None:
+        return {'status': 'error', 'message': f"Деталь {part_id} не найдена."}, 404
+    if part.route_template_id is None:
+        return {'status': 'error', 'message': "Этой детали не присвоен технологический маршрут."}, 400
+
+    next_stage = progress_service.find_next_stage(part, completed_quantities)
+    if next_stage is not None:
+        completed = completed_quantities.get(next_stage.stage_id, 0)
+        next_stage = {'id': next_stage.stage_id, 'name': next_stage.stage_name,
+                      'completed': completed, 'remaining': part.quantity_total - completed}
+    return {
+        'status': 'success',
+        'part': {
+            'part_id': part.part_id,
+            'name': part.name,
+            'product_designation': part.product_designation,
+            'current_status': part.current_status,
+            'quantity_total': part.quantity_total,
+            'quantity_completed': part.quantity_completed,
+        },
+        'next_stage': next_stage,
+        'route_completed': next_stage is None,
+    }, 200
+
+
+@main.route('/api/scan/<path:part_id>', methods=['GET'])
+def api_scan(part_id):
+    """
+    JSON-аналог страницы сканирования для терминалов сбора данных: деталь,
+    следующий этап маршрута и остаток на нем. При прогретом кэше маршрутов -
+    два запроса к базе (деталь со счетчиками и счетчик поколения маршрутов).
+    """
+    body, status = _scan_state(part_id)
+    return json_response(body, status)
+
+
+@main.route('/api/scan/<path:part_id>', methods=['POST'])
+@csrf.exempt
+@_scanner_token_required
+def api_scan_confirm(part_id):
+    """
+    JSON-подтверждение этапа со сканера: {"operator_name", "stage_id", "quantity"};
+    quantity по умолчанию 1. Возвращает новое состояние детали в формате
+    GET /api/scan. Поддерживает заголовок Idempotency-Key: повтор не
+    подтверждает этап второй раз и возвращает сохраненный исходный ответ.
+    Требует токен терминала сбора данных (Authorization: Bearer).
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'status': 'error', 'message': "Тело запроса должно быть JSON-объектом."}), 400
+    operator_name = _json_operator_name(payload)
+    if not operator_name:
+        return jsonify({'status': 'error', 'message': "Не указано ФИО оператора."}), 400
+    try:
+        item = confirmation_service.BatchItem(part_id, int(payload['stage_id']), int(payload.get('quantity', 1)))
+    except (TypeError, KeyError, ValueError):
+        return jsonify({'status': 'error', 'message': "Не указан этап (stage_id) или неверное количество."}), 400
+    if item.quantity < 1:
+        return jsonify({'status': 'error', 'message': "Количество должно быть не меньше 1."}), 400
+
+    idempotency_key, early_response = _reserve_idempotency_key(
+        [item], operator_name, lambda stored: json_response(stored['body'], stored['status_code']),
+        SCAN_CONFIRM_SCOPE
+    )
+    if early_response is not None:
+        return early_response
+
+    try:
+        # Для повторов сохраняется состояние детали сразу после подтверждения
+        summary, = confirmation_service.confirm_batch(
+            [item], operator_name, idempotency_key, SCAN_CONFIRM_SCOPE,
+            build_response=lambda summary: _scan_state(part_id)[0]
+        )
+    except confirmation_service.BatchValidationError as e:
+        db.session.rollback()
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+
+    _send_websocket_notification(
+        'stage_completed',
+        f"Деталь {part_id} перешла на этап '{summary['current_status']}'.",
+        part_id
+    )
+    body, status = _scan_state(part_id)
+    return json_response(body, status)
+
+
 @main.route('/add_note/<path:part_id>', methods=['POST'])
 @login_required
 def add_note(part_id):
     """Обрабатывает добавление примечания к детали."""
-    part = db.get_or_404(Part, part_id)
+    part = Part.query.filter_by(part_id=part_id).first_or_404()
     form = AddNoteForm()
     # Динамически заполняем поле выбора этапов
     if part.route_template:
@@ -270,7 +806,7 @@ def add_note(part_id):
     if form.validate_on_submit():
         stage_obj = form.stage.data
         new_note = PartNote(
-            part_id=part.part_id,
+            part_pk=part.id,
             user_id=current_user.id,
             text=form.text.data,
             stage_id=stage_obj.id if stage_obj else None
@@ -303,10 +839,10 @@ def edit_note(note_id):
     new_text = request.form.get('text')
     if new_text and new_text.strip():
         note.text = new_text
-        log_details = f"В детали '{note.part_id}' изменено примечание (ID: {note.id})."
+        log_details = f"В детали '{note.part.part_id}' изменено примечание (ID: {note.id})."
         log_entry = AuditLog(
             user_id=current_user.id, action="Изменено примечание",
-            details=log_details, category='management', part_id=note.part_id
+            details=log_details, category='management', part_id=note.part.part_id
         )
         db.session.add(log_entry)
         db.session.commit()
@@ -322,9 +858,9 @@ def delete_note(note_id):
     note = db.get_or_404(PartNote, note_id)
     if note.user_id != current_user.id and not current_user.is_admin():
         flash('У вас нет прав для удаления этого примечания.', 'error')
-        return redirect(url_for('main.history', part_id=note.part_id))
+        return redirect(url_for('main.history', part_id=note.part.part_id))
 
-    part_id = note.part_id
+    part_id = note.part.part_id
     log_details = f"В детали '{part_id}' удалено примечание (ID: {note.id})."
     log_entry = AuditLog(
         user_id=current_user.id, action="Удалено примечание",
@@ -335,4 +871,4 @@ def delete_note(note_id):
     db.session.delete(note)
     db.session.commit()
     flash('Примечание удалено.', 'success')
-    return redirect(url_for('main.history', part_id=part.part_id))
\ No newline at end of file
+    return redirect(url_for('main.history', part_id=part_id))
\ No newline at end of file
@@ -2,6 +2,7 @@
 
 from app import db
 from datetime import datetime, timezone
+from sqlalchemy import DDL, event
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin, AnonymousUserMixin
 
@@ -10,6 +11,17 @@ class Stage(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), unique=True, nullable=False)
 
+class Operator(db.Model):
+    """
+    Справочник операторов, подтверждающих этапы. Имя, введенное при
+    сканировании, сопоставляется по нормализованной форме (без учета
+    регистра и лишних пробелов), поэтому один человек - одна запись.
+    """
+    __tablename__ = 'Operators'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String, nullable=False) # Имя в том виде, в каком оно введено впервые
+    normalized_name = db.Column(db.String, unique=True, nullable=False, index=True)
+
 class RouteStage(db.Model):
     __tablename__ = 'RouteStages'
     id = db.Column(db.Integer, primary_key=True)
@@ -127,8 +139,17 @@ class AnonymousUser(AnonymousUserMixin):
 
 class Part(db.Model):
     __tablename__ = 'Parts'
+    __table_args__ = (
+        # Список деталей изделия на панели мониторинга: product_designation = ? AND parent_pk IS NULL
+        # с постраничной выдачей по ключу part_id > ? ORDER BY part_id
+        db.Index('ix_Parts_product_designation_parent_pk_part_id', 'product_designation', 'parent_pk', 'part_id'),
+        # Выдача изменений изделия: product_designation = ? AND change_version > ?
+        db.Index('ix_Parts_product_designation_change_version', 'product_designation', 'change_version'),
+    )
     # Основные идентификаторы
-    part_id = db.Column(db.String, primary_key=True) # Обозначение
+    # Внутренний суррогатный ключ: на него ссылаются все внешние ключи
+    id = db.Column(db.Integer, primary_key=True)
+    part_id = db.Column(db.String, unique=True, nullable=False) # Обозначение (бизнес-ключ, используется в URL)
     product_designation = db.Column(db.String, nullable=False) # Изделие, к которому относится (например, "Наборка №3")
     
     # --- НОВЫЕ ПОЛЯ ---
@@ -140,6 +161,8 @@ class Part(db.Model):
     date_added = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     current_status = db.Column(db.String, default='На складе')
     last_update = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    # Версия изделия (ProductVersion), при которой деталь менялась последний раз
+    change_version = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
     
     # Количественные показатели
     quantity_total = db.Column(db.Integer, nullable=False, default=1, server_default='1')
@@ -156,10 +179,10 @@ class Part(db.Model):
     responsible = db.relationship('User', backref='responsible_parts', foreign_keys=[responsible_id])
     
     # Иерархия
-    parent_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=True, index=True)
+    parent_pk = db.Column(db.Integer, db.ForeignKey('Parts.id'), nullable=True, index=True)
     children = db.relationship(
         'Part', 
-        backref=db.backref('parent', remote_side=[part_id]),
+        backref=db.backref('parent', remote_side=[id]),
         cascade="all, delete-orphan",
         lazy='dynamic'
     )
@@ -167,18 +190,167 @@ class Part(db.Model):
     # История и примечания (каскадное удаление)
     history = db.relationship('StatusHistory', backref='part', lazy=True, cascade="all, delete-orphan")
     notes = db.relationship('PartNote', backref='part', lazy=True, cascade="all, delete-orphan")
+    stage_progress = db.relationship('PartStageProgress', backref='part', lazy=True, cascade="all, delete-orphan")
+    # Строки таблицы замыкания, в которых деталь - предок или потомок
+    closure_descendants = db.relationship('PartClosure', foreign_keys='PartClosure.ancestor_pk', lazy=True, cascade="all, delete-orphan")
+    closure_ancestors = db.relationship('PartClosure', foreign_keys='PartClosure.descendant_pk', lazy=True, cascade="all, delete-orphan")
+
+# Поисковый индекс деталей (search_service) по part_id, name, material и product_designation.
+# SQLite: внешняя таблица FTS5 с триграммным токенизатором, синхронизируемая триггерами.
+# PostgreSQL: GIN-индекс pg_trgm по тому же выражению, что строит search_service.search_document().
+# Для существующих баз те же объекты создает миграция 8d3f6b2a9e14.
+PART_SEARCH_TABLE = 'PartsSearch'
+_SEARCH_COLUMNS = 'part_id, name, material, product_designation'
+_SEARCH_VALUES = '{0}.id, {0}.part_id, {0}.name, {0}.material, {0}.product_designation'
+SQLITE_SEARCH_DDL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {PART_SEARCH_TABLE} USING fts5("
+    f"{_SEARCH_COLUMNS}, content='Parts', content_rowid='id', tokenize='trigram')",
+    f"CREATE TRIGGER IF NOT EXISTS Parts_search_insert AFTER INSERT ON Parts BEGIN "
+    f"INSERT INTO {PART_SEARCH_TABLE}(rowid, {_SEARCH_COLUMNS}) VALUES ({_SEARCH_VALUES.format('new')}); END",
+    f"CREATE TRIGGER IF NOT EXISTS Parts_search_delete AFTER DELETE ON Parts BEGIN "
+    f"INSERT INTO {PART_SEARCH_TABLE}({PART_SEARCH_TABLE}, rowid, {_SEARCH_COLUMNS}) "
+    f"VALUES ('delete', {_SEARCH_VALUES.format('old')}); END",
+    f"CREATE TRIGGER IF NOT EXISTS Parts_search_update AFTER UPDATE OF {_SEARCH_COLUMNS} ON Parts BEGIN "
+    f"INSERT INTO {PART_SEARCH_TABLE}({PART_SEARCH_TABLE}, rowid, {_SEARCH_COLUMNS}) "
+    f"VALUES ('delete', {_SEARCH_VALUES.format('old')}); "
+    f"INSERT INTO {PART_SEARCH_TABLE}(rowid, {_SEARCH_COLUMNS}) VALUES ({_SEARCH_VALUES.format('new')}); END",
+)
+POSTGRESQL_SEARCH_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """CREATE INDEX IF NOT EXISTS "ix_Parts_search_trgm" ON "Parts" USING gin ("""
+    """(part_id || ' ' || name || ' ' || material || ' ' || product_designation) gin_trgm_ops)""",
+)
+
+for _statement in SQLITE_SEARCH_DDL:
+    event.listen(Part.__table__, 'after_create', DDL(_statement).execute_if(dialect='sqlite'))
+for _statement in POSTGRESQL_SEARCH_DDL:
+    event.listen(Part.__table__, 'after_create', DDL(_statement).execute_if(dialect='postgresql'))
+# Триггеры удаляются вместе с таблицей Parts, таблица FTS5 - отдельно
+event.listen(Part.__table__, 'before_drop',
+                DDL(f'DROP TABLE IF EXISTS {PART_SEARCH_TABLE}').execute_if(dialect='sqlite'))
+
+class PartClosure(db.Model):
+    """
+    Таблица замыкания иерархии деталей: все пары (предок, потомок) с глубиной.
+    Каждая деталь ссылается сама на себя с глубиной 0. Позволяет получать
+    поддерево, путь к корню и количество потомков одним запросом.
+    """
+    __tablename__ = 'PartClosure'
+    __table_args__ = (
+        # Путь от детали к корню: descendant_pk = ? ORDER BY depth
+        db.Index('ix_PartClosure_descendant_pk_depth', 'descendant_pk', 'depth'),
+    )
+    ancestor_pk = db.Column(db.Integer, db.ForeignKey('Parts.id'), primary_key=True)
+    descendant_pk = db.Column(db.Integer, db.ForeignKey('Parts.id'), primary_key=True)
+    depth = db.Column(db.Integer, nullable=False)
 
 class StatusHistory(db.Model):
     __tablename__ = 'StatusHistory'
+    __table_args__ = (
+        # Суммы по этапам детали и история детали, отсортированная по времени
+        db.Index('ix_StatusHistory_part_pk_stage_id', 'part_pk', 'stage_id'),
+        db.Index('ix_StatusHistory_part_pk_timestamp', 'part_pk', 'timestamp'),
+    )
+    # При HISTORY_PARTITIONING на PostgreSQL миграция e6a3c1f9b528 заменяет
+    # PRIMARY KEY (id) обычным индексом ix_StatusHistory_id: первичный ключ
+    # секционированной таблицы обязан включать timestamp. Для ORM id остается
+    # ключом (значения уникальны по последовательности); autogenerate первичные
+    # ключи не сравнивает, а секции и индекс по id исключены в migrations/env.py.
     id = db.Column(db.Integer, primary_key=True)
-    part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=False)
+    part_pk = db.Column(db.Integer, db.ForeignKey('Parts.id'), nullable=False)
+    # Этап, по которому группируется прогресс. NULL - только у старых записей,
+    # название этапа которых не удалось сопоставить со справочником.
+    stage_id = db.Column(db.Integer, db.ForeignKey('Stages.id'), nullable=True)
+    # Название этапа на момент подтверждения (подпись для отображения)
     status = db.Column(db.String, nullable=False)
+    # Оператор из справочника (по нему группируются отчеты) и имя в том виде, как его ввели
+    operator_id = db.Column(db.Integer, db.ForeignKey('Operators.id'), nullable=True, index=True)
     operator_name = db.Column(db.String, nullable=False)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
     quantity = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    stage = db.relationship('Stage')
+    operator = db.relationship('Operator')
+
+class PartStageProgress(db.Model):
+    """
+    Материализованный прогресс детали по этапу: сколько штук выполнено.
+    Поддерживается при подтверждении и отмене этапа, чтобы не пересчитывать
+    сумму по всей истории StatusHistory при каждом обращении.
+    """
+    __tablename__ = 'PartStageProgress'
+    part_pk = db.Column(db.Integer, db.ForeignKey('Parts.id'), primary_key=True)
+    stage_id = db.Column(db.Integer, db.ForeignKey('Stages.id'), primary_key=True)
+    qty_done = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    last_timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+
+class ProductProgress(db.Model):
+    """
+    Сводка по изделию для панели мониторинга (только корневые детали).
+    Поддерживается инкрементально при создании, импорте, удалении деталей
+    и подтверждении этапов.
+    """
+    __tablename__ = 'ProductProgress'
+    product_designation = db.Column(db.String, primary_key=True)
+    total_parts = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_quantity = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    completed_quantity = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+class ProductVersion(db.Model):
+    """
+    Монотонно растущий номер версии данных изделия. Увеличивается в той же
+    транзакции, что и любое изменение деталей изделия, и служит ключом
+    для ETag. Строки не удаляются, чтобы номер никогда не повторялся.
+    """
+    __tablename__ = 'ProductVersions'
+    product_designation = db.Column(db.String, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=1, server_default='1')
+
+class CacheGeneration(db.Model):
+    """
+    Счетчики поколений кэшей процесса. Изменение данных увеличивает счетчик,
+    и все процессы сбрасывают соответствующий кэш при следующей проверке.
+    """
+    __tablename__ = 'CacheGenerations'
+    name = db.Column(db.String(50), primary_key=True)
+    generation = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+
+class IdempotencyKey(db.Model):
+    """
+    Результат запроса, выполненного с ключом идемпотентности клиента.
+    Повтор запроса с тем же ключом получает сохраненный результат и не
+    меняет данные повторно. Записи старше IDEMPOTENCY_KEY_TTL удаляются.
+    """
+    __tablename__ = 'IdempotencyKeys'
+    scope = db.Column(db.String(50), primary_key=True) # Операция, например "confirm_stage"
+    key = db.Column(db.String(64), primary_key=True)
+    fingerprint = db.Column(db.String(40), nullable=False) # Хэш параметров исходного запроса
+    status_code = db.Column(db.SmallInteger, nullable=False, default=200, server_default='200')
+    response = db.Column(db.Text, nullable=True) # Результат в JSON
+    created_at = db.Column(db.DateTime, nullable=False, index=True, default=lambda: datetime.now(timezone.utc))
+
+class PartTombstone(db.Model):
+    """
+    Отметка об удалении детали из изделия (удаление или перенос в другое
+    изделие) с версией изделия, при которой это произошло.
+    """
+    __tablename__ = 'PartTombstones'
+    __table_args__ = (
+        db.Index('ix_PartTombstones_product_designation_version', 'product_designation', 'version'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    product_designation = db.Column(db.String, nullable=False)
+    part_id = db.Column(db.String, nullable=False)
+    version = db.Column(db.BigInteger, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
 
 class AuditLog(db.Model):
     __tablename__ = 'AuditLogs'
+    __table_args__ = (
+        # История детали и журналы аудита по категориям, отсортированные по времени
+        db.Index('ix_AuditLogs_part_id_timestamp', 'part_id', 'timestamp'),
+        db.Index('ix_AuditLogs_category_timestamp', 'category', 'timestamp'),
+    )
+    # Как у StatusHistory: при секционировании вместо PRIMARY KEY (id) - индекс ix_AuditLogs_id
     id = db.Column(db.Integer, primary_key=True)
     part_id = db.Column(db.String, nullable=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
@@ -190,7 +362,7 @@ class AuditLog(db.Model):
 class PartNote(db.Model):
     __tablename__ = 'PartNotes'
     id = db.Column(db.Integer, primary_key=True)
-    part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=False, index=True)
+    part_pk = db.Column(db.Integer, db.ForeignKey('Parts.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
     stage_id = db.Column(db.Integer, db.ForeignKey('Stages.id'), nullable=True)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
@@ -202,7 +374,7 @@ class PartNote(db.Model):
 class ResponsibleHistory(db.Model):
     __tablename__ = 'ResponsibleHistory'
     id = db.Column(db.Integer, primary_key=True)
-    part_id = db.Column(db.String, db.ForeignKey('Parts.part_id'), nullable=False, index=True)
+    part_pk = db.Column(db.Integer, db.ForeignKey('Parts.id'), nullable=False, index=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=True, index=True)
     timestamp = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
 
@@ -0,0 +1,180 @@
+# app/services/archive_service.py
+
+import gzip
+import importlib.util
+import json
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+from sqlalchemy import select, delete
+
+from app import db
+from app.models.models import AuditLog, User
+
+# Оглавление архива: список файлов с диапазоном дат, категориями и деталями
+MANIFEST_FILENAME = 'manifest.json'
+
+ARCHIVE_FORMATS = ('jsonl', 'parquet')
+
+ARCHIVED_COLUMNS = ('id', 'part_id', 'user_id', 'timestamp', 'action', 'details', 'category')
+
+_AGE_RE = re.compile(r'^(?P<value>\d+)(?P<unit>[dw])$')
+
+
+def parse_age(value):
+    """Преобразует возраст записей вида "90d" или "12w" в timedelta."""
+    match = _AGE_RE.match(value.strip().lower())
+    if not match:
+        raise ValueError(f"Некорректный возраст '{value}'. Ожидается, например, 90d или 12w.")
+    days = int(match.group('value')) * (7 if match.group('unit') == 'w' else 1)
+    return timedelta(days=days)
+
+
+def is_parquet_available():
+    """Parquet требует необязательной зависимости pyarrow."""
+    return importlib.util.find_spec('pyarrow') is not None
+
+
+def load_manifest(folder):
+    path = os.path.join(folder, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _save_manifest(folder, entries):
+    # Запись через временный файл, чтобы оглавление не оказалось обрезанным
+    path = os.path.join(folder, MANIFEST_FILENAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(entries, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def _write_chunk(path, records, fmt):
+    if fmt == 'parquet':
+        import pandas as pd
+        pd.DataFrame.from_records(records, columns=ARCHIVED_COLUMNS).to_parquet(path, compression='gzip', index=False)
+        return
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False))
+            f.write('\n')
+
+
+def _read_chunk(path):
+    if path.endswith('.parquet'):
+        import pandas as pd
+        df = pd.read_parquet(path)
+        return df.astype(object).where(df.notna(), None).to_dict('records')
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def archive_audit_logs(older_than, folder, chunk_size=5000, fmt='jsonl'):
+    """
+    Переносит записи журнала аудита старше `older_than` в сжатые файлы архива.
+    Записи читаются порциями по первичному ключу. Каждая порция сначала
+    целиком записывается в свой файл и в оглавление, и только затем удаляется
+    из таблицы. Возвращает (количество записей, количество файлов).
+    """
+    if fmt not in ARCHIVE_FORMATS:
+        raise ValueError(f"Неизвестный формат архива '{fmt}'.")
+    if fmt == 'parquet' and not is_parquet_available():
+        raise ValueError("Для формата Parquet установите пакет pyarrow.")
+
+    os.makedirs(folder, exist_ok=True)
+    now = datetime.now(timezone.utc)
+    cutoff = now.replace(tzinfo=None) - older_than
+    manifest = load_manifest(folder)
+    extension = 'parquet' if fmt == 'parquet' else 'jsonl.gz'
+
+    total_rows, files_written, last_id = 0, 0, 0
+    while True:
+        rows = db.session.execute(
+            select(*(getattr(AuditLog, column) for column in ARCHIVED_COLUMNS))
+            .where(AuditLog.timestamp < cutoff, AuditLog.id > last_id)
+            .order_by(AuditLog.id)
+            .limit(chunk_size)
+        ).mappings().all()
+        if not rows:
+            break
+
+        records = [
+            dict(row, timestamp=row['timestamp'].isoformat() if row['timestamp'] else None)
+            for row in rows
+        ]
+        filename = f"audit_{now:%Y%m%d%H%M%S}_{files_written:04d}.{extension}"
+        _write_chunk(os.path.join(folder, filename), records, fmt)
+
+        timestamps = [r['timestamp'] for r in records if r['timestamp']]
+        manifest.append({
+            'file': filename,
+            'rows': len(records),
+            'min_timestamp': min(timestamps) if timestamps else None,
+            'max_timestamp': max(timestamps) if timestamps else None,
+            'categories': sorted({r['category'] for r in records}),
+            'part_ids': sorted({r['part_id'] for r in records if r['part_id']}),
+        })
+        _save_manifest(folder, manifest)
+
+        ids = [r['id'] for r in records]
+        db.session.execute(delete(AuditLog).where(AuditLog.id.in_(ids)))
+        db.session.commit()
+
+        last_id = ids[-1]
+        total_rows += len(records)
+        files_written += 1
+
+    return total_rows, files_written
+
+
+def read_archived_logs(folder, part_id=None, categories=None, start=None, end=None):
+    """
+    Читает записи из архива, открывая только файлы, которые по оглавлению
+    могут содержать нужную деталь, категорию и период [start, end).
+    Возвращает список словарей, отсортированный от новых к старым.
+    """
+    records = {}
+    for entry in load_manifest(folder):
+        if part_id is not None and part_id not in entry['part_ids']:
+            continue
+        if categories is not None and not set(categories) & set(entry['categories']):
+            continue
+        if start and entry['max_timestamp'] and datetime.fromisoformat(entry['max_timestamp']) < start:
+            continue
+        if end and entry['min_timestamp'] and datetime.fromisoformat(entry['min_timestamp']) >= end:
+            continue
+        for record in _read_chunk(os.path.join(folder, entry['file'])):
+            timestamp = datetime.fromisoformat(record['timestamp']) if record['timestamp'] else None
+            if part_id is not None and record['part_id'] != part_id:
+                continue
+            if categories is not None and record['category'] not in categories:
+                continue
+            if (start and (timestamp is None or timestamp < start)) or (end and (timestamp is None or timestamp >= end)):
+                continue
+            # Повторно заархивированная запись (сбой между записью файла и удалением) учитывается один раз
+            records[record['id']] = dict(record, timestamp=timestamp)
+    return sorted(records.values(), key=lambda r: r['timestamp'] or datetime.min, reverse=True)
+
+
+class ArchivePage:
+    """Страница архивных записей с тем же интерфейсом, что и пагинация Flask-SQLAlchemy."""
+
+    def __init__(self, records, page, per_page):
+        self.total = len(records)
+        self.per_page = per_page
+        self.pages = max((self.total + per_page - 1) // per_page, 1)
+        self.page = min(max(page, 1), self.pages)
+        offset = (self.page - 1) * per_page
+        page_records = records[offset:offset + per_page]
+        user_ids = {r['user_id'] for r in page_records}
+        users_map = {u.id: u for u in User.query.filter(User.id.in_(user_ids))} if user_ids else {}
+        self.items = [SimpleNamespace(**record, user=users_map.get(record['user_id'])) for record in page_records]
+        self.has_prev = self.page > 1
+        self.has_next = self.page < self.pages
+        self.prev_num = self.page - 1 if self.has_prev else None
+        self.next_num = self.page + 1 if self.has_next else None
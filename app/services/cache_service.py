@@ -0,0 +1,242 @@
+# app/services/cache_service.py
+
+import hashlib
+import importlib.util
+import json
+import threading
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import select, update
+
+from app import db
+from app.models.models import CacheGeneration
+
+# Ключ в app.extensions, под которым хранится кэш выдачи деталей
+EXTENSION_KEY = 'parts_cache'
+# Ключ в app.extensions для кэшей справочников с поколениями {имя счетчика: GenerationCache}
+GENERATION_CACHES_KEY = 'generation_caches'
+
+
+class LRUCache:
+    """Кэш в памяти процесса с ограничением по числу записей."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete_prefix(self, prefix):
+        with self._lock:
+            for key in [k for k in self._entries if k.startswith(prefix)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class RedisCache:
+    """
+    Общий для всех процессов кэш поверх Redis-совместимого клиента
+    (методы get, set, scan_iter, delete). Значения хранятся в JSON
+    и удаляются сервером по истечении `ttl` секунд.
+    """
+
+    def __init__(self, client, namespace='parts_cache:', ttl=3600):
+        self.client = client
+        self.namespace = namespace
+        self.ttl = ttl
+
+    def get(self, key):
+        raw = self.client.get(self.namespace + key)
+        return json.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self.client.set(self.namespace + key, json.dumps(value, ensure_ascii=False), ex=self.ttl)
+
+    def delete_prefix(self, prefix):
+        keys = list(self.client.scan_iter(match=self.namespace + prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+    def clear(self):
+        self.delete_prefix('')
+
+
+class TieredCache:
+    """Локальный LRU процесса перед общим кэшем: промах в LRU читается из общего."""
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self.local.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.local.set(key, value)
+        self.shared.set(key, value)
+
+    def delete_prefix(self, prefix):
+        self.local.delete_prefix(prefix)
+        self.shared.delete_prefix(prefix)
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+
+class GenerationCache(LRUCache):
+    """
+    Кэш справочника в памяти приложения, помеченный поколением из CacheGenerations.
+    Изменение справочника в любом процессе увеличивает счетчик (bump_generation),
+    и остальные процессы сбрасывают кэш при следующей проверке. Счетчики всех
+    кэшей читаются одним запросом, не чаще одного раза за запрос.
+    """
+
+    def __init__(self, name, max_entries=None):
+        super().__init__(max_entries if max_entries is not None else float('inf'))
+        self.name = name
+        self.generation = None
+
+    def _check_generation(self):
+        generation = current_generations().get(self.name, 0)
+        if generation != self.generation:
+            with self._lock:
+                self._entries.clear()
+            self.generation = generation
+
+    def get(self, key):
+        self._check_generation()
+        return super().get(key)
+
+    def clear(self):
+        super().clear()
+        self.generation = None
+
+
+def current_generations():
+    """Счетчики поколений {имя: поколение}; в пределах запроса читаются один раз."""
+    if has_app_context() and 'cache_generations' in g:
+        return g.cache_generations
+    generations = dict(db.session.execute(select(CacheGeneration.name, CacheGeneration.generation)).all())
+    if has_app_context():
+        g.cache_generations = generations
+    return generations
+
+
+def bump_generation(name):
+    """
+    Увеличивает счетчик поколения в текущей транзакции (коммит остается за
+    вызывающим кодом) и сбрасывает кэш этого приложения: остальные процессы
+    сбросят свои при следующей проверке.
+    """
+    result = db.session.execute(
+        update(CacheGeneration)
+        .where(CacheGeneration.name == name)
+        .values(generation=CacheGeneration.generation + 1)
+    )
+    if result.rowcount == 0:
+        db.session.add(CacheGeneration(name=name, generation=1))
+        db.session.flush()
+    get_generation_cache(name).clear()
+    if has_app_context():
+        g.pop('cache_generations', None)
+
+
+def get_generation_cache(name, max_entries=None):
+    """Кэш справочника текущего приложения под счетчиком поколения `name`."""
+    caches = current_app.extensions.setdefault(GENERATION_CACHES_KEY, {})
+    cache = caches.get(name)
+    if cache is None:
+        cache = caches.setdefault(name, GenerationCache(name, max_entries))
+    return cache
+
+
+def is_redis_available():
+    """Общий кэш требует необязательной зависимости redis."""
+    return importlib.util.find_spec('redis') is not None
+
+
+def create_cache(app):
+    """
+    Создает кэш по настройкам приложения: LRU на PARTS_CACHE_SIZE записей,
+    а при заданном PARTS_CACHE_URL - еще и общий кэш в Redis за ним.
+    """
+    config = app.config
+    local = LRUCache(config.get('PARTS_CACHE_SIZE', 256))
+    url = config.get('PARTS_CACHE_URL')
+    if not url:
+        return local
+    if not is_redis_available():
+        app.logger.warning("PARTS_CACHE_URL задан, но пакет redis не установлен; используется только кэш процесса.")
+        return local
+    import redis
+    return TieredCache(local, RedisCache(redis.Redis.from_url(url), ttl=config.get('PARTS_CACHE_TTL', 3600)))
+
+
+def init_app(app):
+    app.extensions[EXTENSION_KEY] = create_cache(app)
+
+
+def get_cache():
+    return current_app.extensions[EXTENSION_KEY]
+
+
+def _product_prefix(product_designation):
+    # Обозначение изделия может содержать символы шаблонов Redis (*, ?, [)
+    return hashlib.sha1(product_designation.encode('utf-8')).hexdigest() + ':'
+
+
+def parts_page_key(product_designation, version, page_params):
+    """Ключ страницы выдачи деталей: изделие, его версия и параметры страницы."""
+    page_hash = hashlib.sha1(repr(page_params).encode('utf-8')).hexdigest()
+    return f'{_product_prefix(product_designation)}{version}:{page_hash}'
+
+
+def stage_wip_key(product_designation, version):
+    """Ключ незавершенного производства изделия по этапам для его версии."""
+    return f'{_product_prefix(product_designation)}{version}:wip'
+
+
+def dashboard_key(dashboard_version):
+    """Ключ сводки панели мониторинга: меняется вместе с версией любого изделия."""
+    return f'dashboard:{dashboard_version}'
+
+
+def invalidate_products(product_designations):
+    """
+    Удаляет из кэша все страницы изделий. Ключ содержит версию изделия,
+    поэтому устаревшая запись и без удаления не будет выдана; удаление
+    освобождает место сразу после изменения.
+    """
+    cache = get_cache()
+    for product_designation in {pd for pd in product_designations if pd is not None}:
+        cache.delete_prefix(_product_prefix(product_designation))
+
+
+def invalidate_product(product_designation):
+    invalidate_products([product_designation])
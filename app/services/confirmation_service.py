@@ -0,0 +1,148 @@
+# app/services/confirmation_service.py
+
+from collections import defaultdict, namedtuple
+from datetime import datetime, timezone
+
+from sqlalchemy import insert, select
+
+from app import db, socketio
+from app.models.models import Part, Stage, StatusHistory
+from app.services import cache_service, idempotency_service, operator_service, progress_service, route_service
+from app.utils import to_safe_key
+
+# Наибольшее число позиций в одном пакете подтверждений
+MAX_BATCH_SIZE = 500
+
+# Область ключей идемпотентности пакетных подтверждений
+IDEMPOTENCY_SCOPE = 'confirm_batch'
+
+# Позиция пакета: деталь (обозначение), этап и выполненное количество
+BatchItem = namedtuple('BatchItem', ['part_id', 'stage_id', 'quantity'])
+
+
+class BatchValidationError(Exception):
+    """Пакет не прошел проверку: `errors` - список {'index', 'part_id', 'message'}."""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(error['message'] for error in errors))
+        self.errors = errors
+
+
+def _error(index, item, message):
+    return {'index': index, 'part_id': item.part_id, 'message': message}
+
+
+def batch_fingerprint(items, operator_name):
+    """Отпечаток пакета для проверки повторов с тем же ключом идемпотентности."""
+    return idempotency_service.fingerprint(operator_name, [list(item) for item in items])
+
+
+def batch_response(summary, confirmed):
+    """Тело успешного ответа на пакет; сохраняется и для повторов по ключу."""
+    return {'status': 'success', 'confirmed': confirmed, 'parts': summary}
+
+
+def confirm_batch(items, operator_name, idempotency_key=None, idempotency_scope=IDEMPOTENCY_SCOPE,
+                  build_response=None):
+    """
+    Подтверждает этапы для набора деталей (палета, комплект) от одного оператора.
+    Каждый этап должен входить в маршрут своей детали (маршруты - из кэша).
+    Детали, этапы и счетчики читаются по одному запросу на набор, остатки
+    проверяются под блокировкой деталей с учетом повторов детали в пакете.
+    Пакет применяется целиком в одной транзакции или не применяется вовсе
+    (BatchValidationError). После коммита отправляется одно событие
+    update_dashboard на весь пакет. Возвращает итог по затронутым деталям.
+    Если ключ идемпотентности занят через idempotency_service.begin(),
+    ответ сохраняется под ним в той же транзакции: build_response(summary),
+    вызванный до коммита, или по умолчанию batch_response.
+    """
+    parts = {part.part_id: part for part in Part.query.filter(
+        Part.part_id.in_({item.part_id for item in items})
+    )}
+    stage_names = dict(db.session.execute(
+        select(Stage.id, Stage.name).where(Stage.id.in_({item.stage_id for item in items}))
+    ).all())
+
+    errors = []
+    for index, item in enumerate(items):
+        if item.part_id not in parts:
+            errors.append(_error(index, item, f"Деталь {item.part_id} не найдена."))
+        elif item.stage_id not in stage_names:
+            errors.append(_error(index, item, f"Этап {item.stage_id} не найден."))
+        elif parts[item.part_id].route_template_id is None:
+            errors.append(_error(index, item, f"Детали {item.part_id} не присвоен технологический маршрут."))
+        elif route_service.find_route_stage(parts[item.part_id].route_template_id, item.stage_id) is None:
+            errors.append(_error(
+                index, item, f"Этап '{stage_names[item.stage_id]}' не входит в маршрут детали {item.part_id}."
+            ))
+    if errors:
+        raise BatchValidationError(errors)
+
+    # Остатки проверяются и списываются под блокировкой: параллельный пакет
+    # или одиночное подтверждение тех же деталей ждет конца транзакции
+    progress_service.lock_parts(parts.values())
+    completed = progress_service.get_completed_quantities_for_parts([part.id for part in parts.values()])
+    requested = defaultdict(int)
+    for index, item in enumerate(items):
+        part = parts[item.part_id]
+        key = (part.id, item.stage_id)
+        remaining = part.quantity_total - completed[part.id].get(item.stage_id, 0) - requested[key]
+        if item.quantity > remaining:
+            errors.append(_error(
+                index, item,
+                f"Нельзя выполнить {item.quantity} шт. детали {item.part_id} на этапе "
+                f"'{stage_names[item.stage_id]}': осталось {max(remaining, 0)} шт."
+            ))
+        requested[key] += item.quantity
+    if errors:
+        db.session.rollback()
+        raise BatchValidationError(errors)
+
+    now = datetime.now(timezone.utc)
+    operator_id = operator_service.resolve_operator_id(operator_name)
+    progress_service.add_stage_progress_batch(requested, now)
+    db.session.execute(insert(StatusHistory), [{
+        'part_pk': parts[item.part_id].id, 'stage_id': item.stage_id, 'status': stage_names[item.stage_id],
+        'operator_id': operator_id, 'operator_name': operator_name,
+        'quantity': item.quantity, 'timestamp': now
+    } for item in items])
+
+    for (part_pk, stage_id), quantity in requested.items():
+        completed[part_pk][stage_id] = completed[part_pk].get(stage_id, 0) + quantity
+    touched = [parts[part_id] for part_id in dict.fromkeys(item.part_id for item in items)]
+    completed_delta = defaultdict(int)
+    for part in touched:
+        quantity_completed = progress_service.calculate_bottleneck(part, completed[part.id])
+        if progress_service.is_root_part(part):
+            completed_delta[part.product_designation] += quantity_completed - (part.quantity_completed or 0)
+        part.quantity_completed = quantity_completed
+        part.last_update = now
+    # Статус детали - последний подтвержденный для нее этап пакета
+    for item in items:
+        parts[item.part_id].current_status = stage_names[item.stage_id]
+    for product_designation, delta in completed_delta.items():
+        progress_service.adjust_product_progress(product_designation, completed=delta)
+    progress_service.touch_parts(touched)
+    # Итог собирается до коммита: после него объекты деталей устаревают
+    # и чтение их полей стоило бы отдельного запроса на каждую деталь
+    summary = [{
+        'part_id': part.part_id,
+        'current_status': part.current_status,
+        'quantity_completed': part.quantity_completed,
+        'quantity_total': part.quantity_total,
+        'product_designation': part.product_designation
+    } for part in touched]
+    product_designations = sorted({part.product_designation for part in touched})
+    if idempotency_key:
+        body = build_response(summary) if build_response else batch_response(summary, len(items))
+        idempotency_service.complete(idempotency_scope, idempotency_key, body)
+
+    db.session.commit()
+
+    cache_service.invalidate_products(product_designations)
+    socketio.emit('update_dashboard', {
+        'product_designations': product_designations,
+        'safe_keys': [to_safe_key(pd) for pd in product_designations],
+        'parts': summary
+    })
+    return summary
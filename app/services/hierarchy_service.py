@@ -0,0 +1,135 @@
+# app/services/hierarchy_service.py
+
+from collections import defaultdict
+
+from sqlalchemy import select, insert, delete, func, literal
+
+from app import db
+from app.models.models import Part, PartClosure
+
+
+def add_parts_to_hierarchy(parts):
+    """
+    Добавляет новые детали в таблицу замыкания одной пакетной вставкой.
+    Родитель должен идти в списке раньше своих потомков (или уже быть
+    в таблице замыкания). Коммит остается за вызывающим кодом.
+    """
+    if not parts:
+        return
+    db.session.flush()
+
+    new_pks = {part.id for part in parts}
+    external_parent_pks = {part.parent_pk for part in parts if part.parent_pk and part.parent_pk not in new_pks}
+
+    # Пути к корню для уже существующих родителей: {descendant_pk: [(ancestor_pk, depth)]}
+    paths = defaultdict(list)
+    if external_parent_pks:
+        rows = db.session.query(
+            PartClosure.ancestor_pk, PartClosure.descendant_pk, PartClosure.depth
+        ).filter(PartClosure.descendant_pk.in_(external_parent_pks))
+        for ancestor_pk, descendant_pk, depth in rows:
+            paths[descendant_pk].append((ancestor_pk, depth))
+
+    values = []
+    for part in parts:
+        path = [(part.id, 0)]
+        if part.parent_pk:
+            path += [(ancestor_pk, depth + 1) for ancestor_pk, depth in paths[part.parent_pk]]
+        paths[part.id] = path
+        values.extend(
+            {'ancestor_pk': ancestor_pk, 'descendant_pk': part.id, 'depth': depth}
+            for ancestor_pk, depth in path
+        )
+    db.session.execute(insert(PartClosure), values)
+
+
+def add_part_to_hierarchy(part):
+    """Добавляет в таблицу замыкания одну новую деталь."""
+    add_parts_to_hierarchy([part])
+
+
+def get_subtree(part, max_depth=None):
+    """
+    Возвращает все компоненты детали (без нее самой) одним запросом
+    по таблице замыкания, отсортированные по наименованию.
+    `max_depth` ограничивает глубину (1 - только непосредственные потомки).
+    """
+    query = Part.query.join(PartClosure, PartClosure.descendant_pk == Part.id).filter(
+        PartClosure.ancestor_pk == part.id,
+        PartClosure.depth > 0
+    )
+    if max_depth is not None:
+        query = query.filter(PartClosure.depth <= max_depth)
+    return query.order_by(Part.name).all()
+
+
+def get_subtree_nodes(part, max_depth, options=()):
+    """
+    Компоненты детали до глубины `max_depth` одним запросом вместе с глубиной:
+    список пар (деталь, глубина), отсортированный по глубине и наименованию.
+    `options` - параметры загрузки связей деталей.
+    """
+    return db.session.query(Part, PartClosure.depth).options(*options).join(
+        PartClosure, PartClosure.descendant_pk == Part.id
+    ).filter(
+        PartClosure.ancestor_pk == part.id,
+        PartClosure.depth > 0,
+        PartClosure.depth <= max_depth
+    ).order_by(PartClosure.depth, Part.name).all()
+
+
+def count_children(part_pks):
+    """Количество непосредственных потомков для набора деталей одним сгруппированным запросом."""
+    if not part_pks:
+        return {}
+    rows = db.session.query(Part.parent_pk, func.count(Part.id)).filter(
+        Part.parent_pk.in_(part_pks)
+    ).group_by(Part.parent_pk)
+    return dict(rows.all())
+
+
+def build_children_map(parts):
+    """Группирует детали поддерева по родителю: {parent_pk: [дочерние детали]}."""
+    children_map = defaultdict(list)
+    for part in parts:
+        children_map[part.parent_pk].append(part)
+    return children_map
+
+
+def get_ancestors(part):
+    """Возвращает путь от корня изделия до непосредственного родителя детали."""
+    return Part.query.join(PartClosure, PartClosure.ancestor_pk == Part.id).filter(
+        PartClosure.descendant_pk == part.id,
+        PartClosure.depth > 0
+    ).order_by(PartClosure.depth.desc()).all()
+
+
+def count_descendants(part):
+    """Возвращает количество всех компонентов детали на любой глубине."""
+    return db.session.query(func.count()).select_from(PartClosure).filter(
+        PartClosure.ancestor_pk == part.id,
+        PartClosure.depth > 0
+    ).scalar()
+
+
+def rebuild_part_closure():
+    """
+    Полностью пересобирает таблицу замыкания из ссылок parent_pk
+    рекурсивным запросом. Возвращает количество строк в таблице.
+    """
+    db.session.execute(delete(PartClosure))
+
+    tree = select(
+        Part.id.label('ancestor_pk'), Part.id.label('descendant_pk'), literal(0).label('depth')
+    ).cte('tree', recursive=True)
+    tree = tree.union_all(
+        select(tree.c.ancestor_pk, Part.id, tree.c.depth + 1).join(Part, Part.parent_pk == tree.c.descendant_pk)
+    )
+    db.session.execute(
+        insert(PartClosure).from_select(
+            ['ancestor_pk', 'descendant_pk', 'depth'],
+            select(tree.c.ancestor_pk, tree.c.descendant_pk, tree.c.depth)
+        )
+    )
+    db.session.commit()
+    return db.session.query(func.count()).select_from(PartClosure).scalar()
@@ -0,0 +1,87 @@
+# app/services/idempotency_service.py
+
+import hashlib
+import json
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.models import IdempotencyKey
+
+# Наибольшая длина ключа, присланного клиентом
+KEY_MAX_LENGTH = 64
+
+
+class IdempotencyKeyError(Exception):
+    """Ключ идемпотентности нельзя использовать для этого запроса."""
+    pass
+
+
+class IdempotencyKeyConflict(IdempotencyKeyError):
+    """Ключ уже использован для запроса с другими параметрами."""
+    pass
+
+
+class IdempotencyKeyTooLong(IdempotencyKeyError):
+    """Ключ длиннее KEY_MAX_LENGTH и не помещается в столбец ключа."""
+    pass
+
+
+def fingerprint(*params):
+    """Хэш параметров запроса: повтор с тем же ключом должен их повторять."""
+    return hashlib.sha1(json.dumps(params, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _cutoff():
+    ttl = current_app.config.get('IDEMPOTENCY_KEY_TTL', 86400)
+    return datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=ttl)
+
+
+def _stored_result(scope, key, request_fingerprint):
+    record = db.session.execute(
+        select(IdempotencyKey).where(
+            IdempotencyKey.scope == scope, IdempotencyKey.key == key, IdempotencyKey.created_at >= _cutoff()
+        ).execution_options(populate_existing=True)
+    ).scalar()
+    if record is None:
+        return None
+    if record.fingerprint != request_fingerprint:
+        raise IdempotencyKeyConflict("Ключ идемпотентности уже использован для другого запроса.")
+    return {'status_code': record.status_code, 'body': json.loads(record.response) if record.response else None}
+
+
+def begin(scope, key, request_fingerprint):
+    """
+    Начинает запрос с ключом идемпотентности. Если запрос с этим ключом уже
+    выполнен, возвращает его результат {'status_code', 'body'} - данные при
+    этом не меняются. Иначе занимает ключ в текущей транзакции и возвращает
+    None; результат записывается через complete() до коммита. Откат транзакции
+    освобождает ключ, поэтому неудачный запрос можно повторить.
+    Параллельный повтор ждет завершения исходного запроса на уникальном ключе.
+    Ключ длиннее KEY_MAX_LENGTH отклоняется (IdempotencyKeyTooLong) до обращения к базе.
+    """
+    if len(key) > KEY_MAX_LENGTH:
+        raise IdempotencyKeyTooLong(f"Ключ идемпотентности длиннее {KEY_MAX_LENGTH} символов.")
+    stored = _stored_result(scope, key, request_fingerprint)
+    if stored is not None:
+        return stored
+
+    # Просроченные записи удаляются по индексу created_at при занятии новых ключей
+    db.session.execute(delete(IdempotencyKey).where(IdempotencyKey.created_at < _cutoff()))
+    try:
+        with db.session.begin_nested():
+            db.session.add(IdempotencyKey(scope=scope, key=key, fingerprint=request_fingerprint))
+    except IntegrityError:
+        # Ключ только что занял параллельный запрос, и он уже завершен
+        return _stored_result(scope, key, request_fingerprint)
+    return None
+
+
+def complete(scope, key, body, status_code=200):
+    """Сохраняет результат запроса, начатого через begin(), в текущей транзакции."""
+    record = db.session.get(IdempotencyKey, (scope, key))
+    record.status_code = status_code
+    record.response = json.dumps(body, ensure_ascii=False)
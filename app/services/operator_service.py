@@ -0,0 +1,64 @@
+# app/services/operator_service.py
+
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from app.models.models import Operator
+from app.services import cache_service
+
+# Кэш сопоставления {нормализованное имя: Operator.id} в пределах приложения.
+# Удаление операторов (invalidate) увеличивает счетчик поколения, и кэши
+# всех процессов сбрасываются при следующей проверке.
+GENERATION_NAME = 'operators'
+_CACHE_SIZE = 1024
+
+
+def _cache():
+    return cache_service.get_generation_cache(GENERATION_NAME, _CACHE_SIZE)
+
+
+def normalize_name(name):
+    """Нормализует имя оператора: без учета регистра и лишних пробелов."""
+    return ' '.join(name.split()).casefold()
+
+
+def clear_cache():
+    """Сбрасывает кэш приложения (после пересоздания базы)."""
+    _cache().clear()
+
+
+def invalidate():
+    """
+    Сбрасывает кэш операторов во всех процессах после удаления операторов:
+    увеличивает счетчик поколения в текущей транзакции.
+    """
+    cache_service.bump_generation(GENERATION_NAME)
+
+
+def resolve_operator_id(name):
+    """
+    Возвращает id оператора по введенному имени, при необходимости создавая
+    запись в справочнике. Повторные обращения обслуживаются из кэша без
+    запроса к базе. Одновременное создание одного и того же оператора
+    разными процессами разрешается через уникальный индекс.
+    """
+    normalized = normalize_name(name)
+    cache = _cache()
+    operator_id = cache.get(normalized)
+    if operator_id is not None:
+        return operator_id
+
+    operator_id = db.session.query(Operator.id).filter_by(normalized_name=normalized).scalar()
+    if operator_id is None:
+        try:
+            with db.session.begin_nested():
+                operator = Operator(name=' '.join(name.split()), normalized_name=normalized)
+                db.session.add(operator)
+            # Новую запись не кэшируем: транзакция вызывающего кода еще может откатиться
+            return operator.id
+        except IntegrityError:
+            # Оператора только что создал параллельный запрос
+            operator_id = db.session.query(Operator.id).filter_by(normalized_name=normalized).scalar()
+
+    cache.set(normalized, operator_id)
+    return operator_id
@@ -5,17 +5,24 @@ import io
 from datetime import datetime, timezone
 from werkzeug.utils import secure_filename
 from PIL import Image
+import numpy as np
 import pandas as pd
 from flask import current_app
+from sqlalchemy import insert, select
 
 from app import db, socketio
 from app.models.models import (Part, AuditLog, RouteTemplate, ResponsibleHistory,
                                User, StatusHistory, Stage, RouteStage)
 from app.utils import generate_qr_code_as_base64
+from app.services import progress_service, hierarchy_service, cache_service, route_service
 
 
-def _send_websocket_notification(event_type: str, message: str, part_id: str = None):
-    """Централизованная функция для отправки WebSocket-уведомлений."""
+def _send_websocket_notification(event_type: str, message: str, part_id: str = None, product_designations=()):
+    """
+    Централизованная функция для отправки WebSocket-уведомлений.
+    Вместе с уведомлением из кэша удаляются списки деталей затронутых изделий.
+    """
+    cache_service.invalidate_products(product_designations)
     data = {'event': event_type, 'message': message}
     if part_id:
         data['part_id'] = part_id
@@ -59,6 +66,9 @@ def create_single_part(form, user, config):
         quantity_total=form.quantity_total.data
     )
     db.session.add(new_part)
+    progress_service.track_part_in_product_progress(new_part)
+    progress_service.touch_parts([new_part])
+    hierarchy_service.add_part_to_hierarchy(new_part)
     
     log_entry = AuditLog(part_id=new_part.part_id, user_id=user.id, action="Создание", details="Деталь создана вручную.", category='part')
     db.session.add(log_entry)
@@ -67,171 +77,269 @@ def create_single_part(form, user, config):
     _send_websocket_notification(
         'part_created',
         f"Пользователь {user.username} создал деталь: {new_part.part_id}",
-        new_part.part_id
+        new_part.part_id,
+        product_designations=[new_part.product_designation]
     )
 
 
-def import_parts_from_excel(file_storage, user, config):
-    """
-    ФИНАЛЬНАЯ ВЕРСИЯ. Обрабатывает Excel (xlsx) или CSV файлы.
-    Использует двухпроходный алгоритм для корректной обработки иерархии.
-    """
+# Колонки файла импорта, которые читает сервис
+IMPORT_COLUMNS = {
+    'part_id': "Обозначение",
+    'name': "Наименование",
+    'quantity': "Кол-во",
+    'size': "Размер",
+    'operations': "Операции",
+    'material': "Прим.",
+}
+# Сколько обозначений проверяется на существование одним запросом (список IN)
+EXISTING_LOOKUP_CHUNK_SIZE = 500
+
+
+def _read_import_file(file_storage):
+    """Читает Excel (xlsx) или CSV как таблицу строк без заголовка, все ячейки - строки."""
     filename = file_storage.filename
-    
     try:
         if filename.endswith('.csv'):
-            df = pd.read_csv(file_storage, header=None, dtype=str, skip_blank_lines=True)
+            return pd.read_csv(file_storage, header=None, dtype=str, skip_blank_lines=True)
         elif filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_storage, header=None, engine='openpyxl', dtype=str)
+            return pd.read_excel(file_storage, header=None, engine='openpyxl', dtype=str)
         else:
             raise ValueError("Неподдерживаемый формат файла.")
     except Exception as e:
         current_app.logger.error(f"Failed to read file {filename}: {e}", exc_info=True)
         raise ValueError(f"Не удалось прочитать файл. Убедитесь, что он не поврежден.")
 
+
+def _clean_text(column):
+    """Строки колонки без пробелов по краям; пустые ячейки и 'nan' - пустая строка."""
+    column = column.fillna('').astype(str).str.strip()
+    return column.mask(column.str.lower() == 'nan', '')
+
+
+def _prepare_import_frame(df):
+    """
+    Разбирает таблицу файла импорта векторными операциями pandas.
+    Над строкой заголовков (с колонкой 'Обозначение') - название изделия,
+    под ней - строки сборок (обозначение без наименования) и деталей.
+    Возвращает (изделие, таблица с колонками part_id, name, quantity, size,
+    operations, material, is_parent, is_data, parent_id), где parent_id -
+    обозначение ближайшей сборки выше строки (пустая строка, если ее нет).
+    """
+    header_mask = df.fillna('').astype(str).apply(
+        lambda column: column.str.contains("Обозначение", regex=False)
+    ).any(axis=1).to_numpy()
+    if not header_mask.any():
+        raise ValueError("Не найдены заголовки: в файле нет строки с колонкой 'Обозначение'.")
+    # Позиция, а не метка строки: после dropna метки идут с пропусками
+    header_position = int(header_mask.argmax())
+
+    product_cells = _clean_text(pd.Series(df.iloc[:header_position].to_numpy().ravel()))
+    product_cells = product_cells[product_cells != '']
+    product_designation = product_cells.iloc[0] if not product_cells.empty else "Без названия"
+
+    body = df.iloc[header_position + 1:]
+    body.columns = [str(col).strip() if pd.notna(col) else f'unnamed_{i}'
+                    for i, col in enumerate(df.iloc[header_position].values)]
+    body = body.loc[:, ~body.columns.duplicated()]
+
+    def column(key):
+        title = IMPORT_COLUMNS[key]
+        if title not in body.columns:
+            return pd.Series('', index=body.index, dtype=object)
+        return _clean_text(body[title])
+
+    frame = pd.DataFrame({key: column(key) for key in IMPORT_COLUMNS})
+    frame['material'] = frame['material'].mask(frame['material'] == '', "Не указан")
+    # Нечисловое, пустое или бесконечное количество считается за 1, дробное - отбрасывается
+    quantity = pd.to_numeric(frame['quantity'], errors='coerce')
+    frame['quantity'] = np.trunc(quantity.where(np.isfinite(quantity), 1)).astype('int64')
+
+    has_id = frame['part_id'] != ''
+    frame['is_parent'] = has_id & (frame['name'] == '')
+    frame['is_data'] = has_id & (frame['name'] != '')
+    frame['parent_id'] = frame['part_id'].where(frame['is_parent']).ffill().fillna('')
+    return product_designation, frame.reset_index(drop=True)
+
+
+def _existing_part_pks(part_ids):
+    """
+    {обозначение: Part.id} для уже существующих деталей из набора обозначений.
+    Набор проверяется списками IN по EXISTING_LOOKUP_CHUNK_SIZE обозначений,
+    а не запросом на каждую строку файла.
+    """
+    part_ids = list(dict.fromkeys(part_ids))
+    existing = {}
+    for start in range(0, len(part_ids), EXISTING_LOOKUP_CHUNK_SIZE):
+        existing.update(db.session.execute(
+            select(Part.part_id, Part.id).where(
+                Part.part_id.in_(part_ids[start:start + EXISTING_LOOKUP_CHUNK_SIZE])
+            )
+        ).all())
+    return existing
+
+
+def _insert_parts(rows):
+    """
+    Пакетная вставка деталей; возвращает строки (id, part_id, parent_pk).
+    Порядок строк не гарантируется: без него вставка идет многострочными
+    INSERT, а не по одной строке.
+    """
+    if not rows:
+        return []
+    return db.session.execute(insert(Part).returning(Part.id, Part.part_id, Part.parent_pk), rows).all()
+
+
+def import_parts_from_excel(file_storage, user, config):
+    """
+    Импортирует сборки и детали из Excel (xlsx) или CSV файла.
+    Таблица разбирается векторными операциями pandas (_prepare_import_frame),
+    детали и записи журнала вставляются пакетами в одной транзакции:
+    сначала сборки, затем детали со ссылками на них.
+    Возвращает (добавлено, пропущено).
+    """
+    filename = file_storage.filename
+    df = _read_import_file(file_storage)
+
     df.dropna(how='all', inplace=True)
     if df.empty:
         return 0, 0
 
-    header_row_index = -1
-    for i, row in df.iterrows():
-        if any("Обозначение" in str(cell) for cell in row.values):
-            header_row_index = i
-            break
-    
-    if header_row_index == -1:
-        raise ValueError("В файле не найдена строка с заголовками (ожидается колонка 'Обозначение').")
-
-    product_df = df.iloc[:header_row_index]
-    product_name_values = [str(cell).strip() for _, row in product_df.iterrows() for cell in row.values if pd.notna(cell) and str(cell).strip()]
-    current_product_designation = product_name_values[0] if product_name_values else "Без названия"
-
-    header_list = [str(col).strip() if pd.notna(col) else f'unnamed_{i}' for i, col in enumerate(df.iloc[header_row_index].values)]
-    df.columns = header_list
-    df = df.iloc[header_row_index + 1:].reset_index(drop=True)
+    current_product_designation, frame = _prepare_import_frame(df)
 
-    added_count = 0
-    skipped_count = 0
-    
     default_route = RouteTemplate.query.filter_by(is_default=True).first()
     if not default_route:
         raise ValueError("Не найден маршрут по умолчанию. Пожалуйста, создайте его в 'Управлении маршрутами'.")
 
-    # --- ПЕРВЫЙ ПРОХОД: Добавляем родительские элементы (сборки) ---
-    for index, row in df.iterrows():
-        part_id = str(row.get("Обозначение", "")).strip()
-        name = str(row.get("Наименование", "")).strip()
-
-        is_parent_row = part_id and (not name or name.lower() == 'nan')
-        
-        if is_parent_row:
-            if not db.session.get(Part, part_id):
-                parent_part = Part(part_id=part_id, product_designation=current_product_designation, name=f"Сборка {part_id}", material="Сборка", quantity_total=1, route_template_id=default_route.id)
-                db.session.add(parent_part)
-                # Логируем добавление прямо здесь
-                log_entry = AuditLog(part_id=part_id, user_id=user.id, action="Создание", details=f"Сборка импортирована из файла {filename}.", category='part')
-                db.session.add(log_entry)
-                added_count += 1
-            else:
-                skipped_count += 1
-    
-    # Сохраняем всех родителей перед добавлением детей
+    parents = frame[frame['is_parent']]
+    data = frame[frame['is_data']]
+    # Строки без обозначения пропускаются; из повторов обозначения в файле
+    # остается первое, причем сборки идут раньше деталей
+    skipped_count = int((~(frame['is_parent'] | frame['is_data'])).sum())
+    duplicated = pd.concat([parents['part_id'], data['part_id']]).duplicated().to_numpy()
+    skipped_count += int(duplicated.sum())
+    parents, data = parents[~duplicated[:len(parents)]], data[~duplicated[len(parents):]]
+
+    versions = progress_service.bump_product_versions([current_product_designation])
+    common = {'product_designation': current_product_designation,
+              'change_version': versions[current_product_designation]}
+
+    # Уже существующие обозначения читаются один раз на весь файл,
+    # дальше повторы отсеиваются операциями над множеством в памяти
+    existing = _existing_part_pks(pd.concat([parents['part_id'], data['part_id']]))
+    existing_parents = parents['part_id'].isin(existing.keys())
+    existing_data = data['part_id'].isin(existing.keys())
+    skipped_count += int(existing_parents.sum()) + int(existing_data.sum())
+
+    # --- Сборки: новые вставляются, существующие только принимают детали ---
+    parent_pks = {part_id: existing[part_id] for part_id in parents.loc[existing_parents, 'part_id']}
+    parent_rows = [dict(common, part_id=part_id, name=f"Сборка {part_id}", material="Сборка",
+                        quantity_total=1, route_template_id=default_route.id)
+                   for part_id in parents.loc[~existing_parents, 'part_id']]
+    new_parents = _insert_parts(parent_rows)
+    parent_pks.update((row.part_id, row.id) for row in new_parents)
+
+    # --- Детали: маршруты разрешаются один раз на каждую различную строку операций ---
+    data = data[~existing_data]
+    route_ids = _resolve_operation_routes(data['operations'], default_route)
+    part_rows = [dict(
+        common, part_id=row.part_id, name=row.name, quantity_total=row.quantity, size=row.size,
+        material=row.material, route_template_id=route_ids[row.operations],
+        parent_pk=parent_pks.get(row.parent_id)
+    ) for row in data.itertuples(index=False)]
+    new_parts = _insert_parts(part_rows)
+
+    added_count = len(new_parents) + len(new_parts)
+    if added_count == 0:
+        db.session.rollback()
+        return 0, skipped_count
+
+    db.session.execute(insert(AuditLog), [
+        {'part_id': row['part_id'], 'user_id': user.id, 'action': "Создание", 'category': 'part',
+         'details': f"Сборка импортирована из файла {filename}."} for row in parent_rows
+    ] + [
+        {'part_id': row['part_id'], 'user_id': user.id, 'action': "Создание", 'category': 'part',
+         'details': f"Деталь импортирована из файла {filename}."} for row in part_rows
+    ])
+    hierarchy_service.add_parts_to_hierarchy(new_parents + new_parts)
+    # Сводка по изделию учитывает только корневые детали: все сборки и детали без сборки
+    roots = parent_rows + [row for row in part_rows if row['parent_pk'] is None]
+    progress_service.adjust_product_progress(
+        current_product_designation, parts=len(roots), quantity=sum(row['quantity_total'] for row in roots)
+    )
     db.session.commit()
 
-    # --- ВТОРОЙ ПРОХОД: Добавляем дочерние элементы (детали) ---
-    parent_part_id = None
-    for index, row in df.iterrows():
-        part_id = str(row.get("Обозначение", "")).strip()
-        name = str(row.get("Наименование", "")).strip()
-
-        is_parent_row = part_id and (not name or name.lower() == 'nan')
-        is_data_row = part_id and name and name.lower() != 'nan'
-
-        if is_parent_row:
-            parent_part_id = part_id
-            continue
-        
-        if not is_data_row:
-            skipped_count += 1
-            continue
-
-        if db.session.get(Part, part_id):
-            skipped_count += 1
-            continue
-            
-        material = str(row.get("Прим.", "Не указан")).strip()
-        if not material or material.lower() == 'nan': material = "Не указан"
-        
-        quantity_str = str(row.get("Кол-во", "1")).strip()
-        try:
-            quantity = int(float(quantity_str)) if quantity_str and quantity_str.lower() != 'nan' else 1
-        except (ValueError, TypeError):
-            quantity = 1
-
-        operations_str = str(row.get("Операции", "")).strip()
-        if operations_str.lower() == 'nan': operations_str = ""
-        route_template_id = _get_or_create_route_from_operations(operations_str).id
-
-        size = str(row.get("Размер", "")).strip()
-        if size.lower() == 'nan': size = ""
-
-        new_part = Part(part_id=part_id, product_designation=current_product_designation, name=name, quantity_total=quantity, size=size, material=material, route_template_id=route_template_id, parent_id=parent_part_id)
-        db.session.add(new_part)
-        
-        log_entry = AuditLog(part_id=part_id, user_id=user.id, action="Создание", details=f"Деталь импортирована из файла {filename}.", category='part')
-        db.session.add(log_entry)
-        added_count += 1
+    _send_websocket_notification('import_finished', f"Пользователь {user.username} импортировал {added_count} новых записей.",
+                                 product_designations=[current_product_designation])
 
-    db.session.commit()
-    
-    if added_count > 0:
-        _send_websocket_notification('import_finished', f"Пользователь {user.username} импортировал {added_count} новых записей.")
-    
     return added_count, skipped_count
 
 
-def _get_or_create_route_from_operations(operations_str: str) -> RouteTemplate:
-    """
-    Находит существующий маршрут по строке операций или создает новый.
-    Также создает недостающие этапы в справочнике.
-    """
-    if not operations_str or operations_str.lower() == 'nan':
-        default_route = RouteTemplate.query.filter_by(is_default=True).first()
-        if not default_route:
-            raise ValueError("Не найден маршрут по умолчанию для деталей без указания операций.")
-        return default_route
-
-    operations = [op.strip() for op in operations_str.split(',') if op.strip()]
-    if not operations:
-        return _get_or_create_route_from_operations("")
-
-    route_name = " -> ".join(operations)
-    
-    route = RouteTemplate.query.filter_by(name=route_name).first()
-    if route:
-        return route
+def _parse_operations(operations_str):
+    """Список операций из строки вида 'Ток, Фр' (пустые элементы отбрасываются)."""
+    return [op.strip() for op in operations_str.split(',') if op.strip()]
 
-    new_route = RouteTemplate(name=route_name, is_default=False)
-    db.session.add(new_route)
-    db.session.flush()
-    
-    for i, op_name in enumerate(operations):
-        stage = Stage.query.filter(Stage.name.ilike(op_name)).first()
-        if not stage:
-            stage = Stage(name=op_name)
-            db.session.add(stage)
-            db.session.flush()
 
-        route_stage = RouteStage(template_id=new_route.id, stage_id=stage.id, order=i)
-        db.session.add(route_stage)
+def _resolve_operation_routes(operations_strings, default_route):
+    """
+    Маршруты для набора строк операций одного импорта: {строка операций: id маршрута}.
+    Маршруты ищутся по имени одним запросом; если каких-то нет, справочник
+    этапов читается один раз и сравнивается без учета регистра, а недостающие
+    этапы, маршруты и этапы маршрутов создаются пакетными вставками.
+    Строке без операций соответствует маршрут по умолчанию.
+    """
+    route_names = {}
+    for operations_str in set(operations_strings):
+        operations = _parse_operations(operations_str)
+        if operations:
+            route_names[operations_str] = (" -> ".join(operations), operations)
+
+    route_ids = {}
+    if route_names:
+        route_ids = dict(db.session.execute(
+            select(RouteTemplate.name, RouteTemplate.id).where(
+                RouteTemplate.name.in_({name for name, _ in route_names.values()})
+            )
+        ).all())
+    missing_routes = {name: operations for name, operations in route_names.values() if name not in route_ids}
+
+    if missing_routes:
+        # Этап с тем же названием в другом регистре используется повторно
+        stage_ids = {}
+        for stage_id, stage_name in db.session.execute(select(Stage.id, Stage.name).order_by(Stage.id)):
+            stage_ids.setdefault(stage_name.casefold(), stage_id)
+        new_stages = {}
+        for operations in missing_routes.values():
+            for op_name in operations:
+                if op_name.casefold() not in stage_ids:
+                    new_stages.setdefault(op_name.casefold(), op_name)
+        if new_stages:
+            stage_ids.update((stage_name.casefold(), stage_id) for stage_id, stage_name in db.session.execute(
+                insert(Stage).returning(Stage.id, Stage.name),
+                [{'name': stage_name} for stage_name in new_stages.values()]
+            ))
+
+        route_ids.update((name, route_id) for route_id, name in db.session.execute(
+            insert(RouteTemplate).returning(RouteTemplate.id, RouteTemplate.name),
+            [{'name': name, 'is_default': False} for name in missing_routes]
+        ))
+        db.session.execute(insert(RouteStage), [
+            {'template_id': route_ids[name], 'stage_id': stage_ids[op_name.casefold()], 'order': i}
+            for name, operations in missing_routes.items() for i, op_name in enumerate(operations)
+        ])
+        route_service.invalidate()
+
+    return {operations_str: route_ids[route_names[operations_str][0]] if operations_str in route_names
+            else default_route.id for operations_str in set(operations_strings)}
 
-    return new_route
 
 def update_part_from_form(part, form, user, config):
     changes = []
+    old_product_designation = part.product_designation
     if part.product_designation != form.product_designation.data:
         changes.append(f"Изделие: '{part.product_designation}' -> '{form.product_designation.data}'")
+        progress_service.track_part_in_product_progress(part, sign=-1)
         part.product_designation = form.product_designation.data
+        progress_service.track_part_in_product_progress(part)
     if hasattr(form, 'name') and part.name != form.name.data:
         changes.append(f"Наименование: '{part.name}' -> '{form.name.data}'")
         part.name = form.name.data
@@ -248,32 +356,43 @@ def update_part_from_form(part, form, user, config):
         part.drawing_filename = save_part_drawing(form.drawing.data, config)
         changes.append("Обновлен чертеж.")
     if changes:
+        if old_product_designation != part.product_designation:
+            # Для старого изделия деталь выглядит удаленной
+            progress_service.record_removed_parts([part], product_designation=old_product_designation)
+        progress_service.touch_parts([part])
         log_details = "; ".join(changes)
         log_entry = AuditLog(part_id=part.part_id, user_id=user.id, action="Редактирование", details=log_details, category='part')
         db.session.add(log_entry)
         db.session.commit()
-        _send_websocket_notification('part_updated', f"Пользователь {user.username} обновил данные детали {part.part_id}", part.part_id)
+        _send_websocket_notification('part_updated', f"Пользователь {user.username} обновил данные детали {part.part_id}", part.part_id,
+                                     product_designations={old_product_designation, part.product_designation})
 
 def delete_single_part(part, user, config):
     part_id = part.part_id
+    product_designation = part.product_designation
     if part.drawing_filename:
         file_path = os.path.join(config['DRAWING_UPLOAD_FOLDER'], part.drawing_filename)
         if os.path.exists(file_path): os.remove(file_path)
     log_entry = AuditLog(part_id=part_id, user_id=user.id, action="Удаление", details=f"Деталь '{part_id}' и вся ее история были удалены.", category='part')
     db.session.add(log_entry)
+    progress_service.track_part_in_product_progress(part, sign=-1)
+    progress_service.record_removed_parts([part])
     db.session.delete(part)
     db.session.commit()
-    _send_websocket_notification('part_deleted', f"Пользователь {user.username} удалил деталь: {part_id}", part_id)
+    _send_websocket_notification('part_deleted', f"Пользователь {user.username} удалил деталь: {part_id}", part_id,
+                                 product_designations=[product_designation])
 
 def change_part_route(part, new_route, user):
     if part.route_template_id != new_route.id:
         old_route_name = part.route_template.name if part.route_template else "Не назначен"
         part.route_template_id = new_route.id
+        progress_service.touch_parts([part])
         log_details = f"Маршрут изменен с '{old_route_name}' на '{new_route.name}'."
         log_entry = AuditLog(part_id=part.part_id, user_id=user.id, action="Редактирование", details=log_details, category='part')
         db.session.add(log_entry)
         db.session.commit()
-        _send_websocket_notification('part_updated', f"Для детали {part.part_id} изменен маршрут.", part.part_id)
+        _send_websocket_notification('part_updated', f"Для детали {part.part_id} изменен маршрут.", part.part_id,
+                                     product_designations=[part.product_designation])
         return True
     return False
 
@@ -284,17 +403,19 @@ def change_responsible_user(part, new_user, current_user):
         old_user_name = part.responsible.username if part.responsible else "Не назначен"
         new_user_name = new_user.username if new_user else "Не назначен"
         part.responsible_id = new_responsible_id
-        db.session.add(ResponsibleHistory(part_id=part.part_id, user_id=new_responsible_id))
+        progress_service.touch_parts([part])
+        db.session.add(ResponsibleHistory(part_pk=part.id, user_id=new_responsible_id))
         log_details = f"Ответственный изменен с '{old_user_name}' на '{new_user_name}'."
         log_entry = AuditLog(part_id=part.part_id, user_id=current_user.id, action="Смена ответственного", details=log_details, category='management')
         db.session.add(log_entry)
         db.session.commit()
-        _send_websocket_notification('part_updated', f"Для детали {part.part_id} сменен ответственный.", part.part_id)
+        _send_websocket_notification('part_updated', f"Для детали {part.part_id} сменен ответственный.", part.part_id,
+                                     product_designations=[part.product_designation])
         return True
     return False
 
 def create_child_part(form, parent_part_id, user):
-    parent_part = db.session.get(Part, parent_part_id)
+    parent_part = Part.query.filter_by(part_id=parent_part_id).first()
     if not parent_part:
         raise ValueError(f"Родительская деталь с ID {parent_part_id} не найдена.")
     new_part = Part(
@@ -303,15 +424,18 @@ def create_child_part(form, parent_part_id, user):
         name=form.name.data,
         material=form.material.data,
         quantity_total=form.quantity_total.data,
-        parent_id=parent_part_id,
+        parent=parent_part,
         route_template_id=parent_part.route_template_id
     )
     db.session.add(new_part)
+    hierarchy_service.add_part_to_hierarchy(new_part)
+    progress_service.touch_parts([new_part])
     log_details = f"В состав '{parent_part.name}' добавлен узел '{new_part.name}'."
     log_entry = AuditLog(part_id=parent_part_id, user_id=user.id, action="Обновление состава", details=log_details, category='part')
     db.session.add(log_entry)
     db.session.commit()
-    _send_websocket_notification('part_updated', f"В состав изделия {parent_part.part_id} добавлен новый узел.", parent_part.part_id)
+    _send_websocket_notification('part_updated', f"В состав изделия {parent_part.part_id} добавлен новый узел.", parent_part.part_id,
+                                 product_designations=[parent_part.product_designation])
 
 def log_qr_generation(part_id, user):
     log_entry = AuditLog(part_id=part_id, user_id=user.id, action="Генерация QR", details=f"Создан QR-код для детали '{part_id}'.", category='part')
@@ -323,18 +447,36 @@ def get_parts_for_printing(part_ids):
     return [{'part': part, 'qr_image': generate_qr_code_as_base64(part.part_id)} for part in parts]
 
 def cancel_stage_by_history_id(history_id, user):
-    history_entry = db.get_or_404(StatusHistory, history_id)
+    history_entry = db.session.get(StatusHistory, history_id)
+    if history_entry is None:
+        raise ValueError("Запись уже отменена.")
     part = history_entry.part
-    part.quantity_completed -= history_entry.quantity
-    if part.quantity_completed < 0: part.quantity_completed = 0
+    # Деталь блокируется и перечитывается, как при подтверждении; параллельная
+    # отмена той же записи дождется блокировки и уже не найдет запись
+    progress_service.lock_part(part)
+    if db.session.get(StatusHistory, history_id, populate_existing=True) is None:
+        db.session.rollback()
+        raise ValueError("Запись уже отменена.")
     log_details = f"Отменен этап: '{history_entry.status}' ({history_entry.quantity} шт.)."
     db.session.add(AuditLog(part_id=part.part_id, user_id=user.id, action="Отмена этапа", details=log_details, category='part'))
-    stage_name = history_entry.status
+    stage_name = history_entry.stage.name if history_entry.stage else history_entry.status
+    if history_entry.stage_id:
+        # Откатываем материализованный прогресс в той же транзакции одним условным UPDATE
+        released = progress_service.release_stage_progress(part, history_entry.stage_id, history_entry.quantity)
+        if released is None:
+            db.session.rollback()
+            raise ValueError(f"На этапе '{stage_name}' выполнено меньше {history_entry.quantity} шт.: "
+                             f"счетчик прогресса не совпадает с историей.")
     db.session.delete(history_entry)
-    new_last_history = StatusHistory.query.filter_by(part_id=part.part_id).order_by(StatusHistory.timestamp.desc()).first()
+    progress_service.set_part_quantity_completed(
+        part, progress_service.calculate_bottleneck(part, progress_service.get_completed_quantities(part))
+    )
+    new_last_history = StatusHistory.query.filter_by(part_pk=part.id).order_by(StatusHistory.timestamp.desc()).first()
     part.current_status = new_last_history.status if new_last_history else 'На складе'
+    progress_service.touch_parts([part])
     db.session.commit()
-    _send_websocket_notification('part_updated', f"Для детали {part.part_id} отменен этап '{stage_name}'.", part.part_id)
+    _send_websocket_notification('part_updated', f"Для детали {part.part_id} отменен этап '{stage_name}'.", part.part_id,
+                                 product_designations=[part.product_designation])
     return part, stage_name
 
 def delete_multiple_parts(part_ids, user, config):
@@ -345,9 +487,13 @@ def delete_multiple_parts(part_ids, user, config):
             file_path = os.path.join(config['DRAWING_UPLOAD_FOLDER'], part.drawing_filename)
             if os.path.exists(file_path): os.remove(file_path)
         db.session.add(AuditLog(part_id=part.part_id, user_id=user.id, action="Массовое удаление", details=f"Деталь '{part.part_id}' удалена.", category='part'))
+        progress_service.track_part_in_product_progress(part, sign=-1)
         db.session.delete(part)
         deleted_count += 1
+    product_designations = {part.product_designation for part in parts_to_delete}
+    progress_service.record_removed_parts(parts_to_delete)
     db.session.commit()
     if deleted_count > 0:
-        _send_websocket_notification('bulk_delete', f"Пользователь {user.username} удалил {deleted_count} деталей.")
+        _send_websocket_notification('bulk_delete', f"Пользователь {user.username} удалил {deleted_count} деталей.",
+                                     product_designations=product_designations)
     return deleted_count
\ No newline at end of file
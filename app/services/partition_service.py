@@ -0,0 +1,134 @@
+# app/services/partition_service.py
+
+import re
+from datetime import date
+
+from sqlalchemy import text
+
+from app import db
+
+# Таблицы, которые в режиме секционирования PostgreSQL разбиты по месяцам на timestamp
+PARTITIONED_TABLES = ('StatusHistory', 'AuditLogs')
+
+# Имя секции: "<таблица>_<ГГГГ>_<ММ>", например "AuditLogs_2025_09"
+_PARTITION_NAME_RE = re.compile(r'^(?P<table>.+)_(?P<year>\d{4})_(?P<month>\d{2})$')
+
+
+def month_start(day):
+    """Первое число месяца для указанной даты."""
+    return date(day.year, day.month, 1)
+
+
+def add_months(day, months):
+    """Сдвигает первое число месяца на `months` месяцев (в том числе назад)."""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table, month):
+    return f'{table}_{month:%Y_%m}'
+
+
+def is_supported():
+    """Секционирование доступно только на PostgreSQL; SQLite работает с одной таблицей."""
+    return db.session.get_bind().dialect.name == 'postgresql'
+
+
+def is_partitioned(table):
+    """Проверяет, что таблица создана как секционированная (PARTITION BY RANGE)."""
+    if not is_supported():
+        return False
+    return db.session.execute(text(
+        'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+        'WHERE c.relname = :table'
+    ), {'table': table}).first() is not None
+
+
+def list_partitions(table):
+    """Возвращает помесячные секции таблицы: [(имя секции, первое число месяца)], по возрастанию."""
+    rows = db.session.execute(text(
+        'SELECT c.relname FROM pg_inherits i '
+        'JOIN pg_class c ON c.oid = i.inhrelid '
+        'JOIN pg_class p ON p.oid = i.inhparent '
+        'WHERE p.relname = :table'
+    ), {'table': table}).scalars()
+    partitions = []
+    for name in rows:
+        match = _PARTITION_NAME_RE.match(name)
+        # Секция по умолчанию и посторонние таблицы в список не попадают
+        if match and match.group('table') == table:
+            partitions.append((name, date(int(match.group('year')), int(match.group('month')), 1)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def default_partition(table):
+    """Имя секции по умолчанию (PARTITION ... DEFAULT) таблицы или None."""
+    return db.session.execute(text(
+        'SELECT d.relname FROM pg_partitioned_table pt '
+        'JOIN pg_class c ON c.oid = pt.partrelid '
+        'JOIN pg_class d ON d.oid = pt.partdefid '
+        'WHERE c.relname = :table'
+    ), {'table': table}).scalar()
+
+
+def _create_partition(table, name, month, default):
+    bounds = {'start': month, 'end': add_months(month, 1)}
+    in_month = '"timestamp" >= :start AND "timestamp" < :end'
+    create = text(
+        f'CREATE TABLE "{name}" PARTITION OF "{table}" '
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+    if default is None or db.session.execute(
+        text(f'SELECT 1 FROM "{default}" WHERE {in_month} LIMIT 1'), bounds
+    ).first() is None:
+        db.session.execute(create)
+        return
+
+    # Обслуживание запущено с опозданием: строки месяца уже попали в секцию по умолчанию,
+    # и PostgreSQL не создаст секцию, пересекающуюся с ее содержимым. Секция по умолчанию
+    # отсоединяется, строки месяца переносятся в новую секцию, и она присоединяется
+    # обратно; все в одной транзакции, на это время запись в таблицу блокируется.
+    db.session.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{default}"'))
+    db.session.execute(create)
+    db.session.execute(text(f'INSERT INTO "{name}" SELECT * FROM "{default}" WHERE {in_month}'), bounds)
+    db.session.execute(text(f'DELETE FROM "{default}" WHERE {in_month}'), bounds)
+    db.session.execute(text(f'ALTER TABLE "{table}" ATTACH PARTITION "{default}" DEFAULT'))
+
+
+def create_partitions(table, first_month, months):
+    """
+    Создает помесячные секции начиная с `first_month` (включительно) на `months` месяцев вперед.
+    Уже существующие секции пропускаются. Строки этих месяцев, попавшие в секцию
+    по умолчанию, переносятся в новые секции. Возвращает имена созданных секций.
+    """
+    existing = {name for name, _ in list_partitions(table)}
+    default = default_partition(table)
+    created = []
+    month = month_start(first_month)
+    for _ in range(months):
+        name = partition_name(table, month)
+        if name not in existing:
+            _create_partition(table, name, month, default)
+            created.append(name)
+        month = add_months(month, 1)
+    db.session.commit()
+    return created
+
+
+def detach_partitions_older_than(table, cutoff_month, drop=False):
+    """
+    Отсоединяет секции, все строки которых старше `cutoff_month`.
+    Отсоединенная секция остается обычной таблицей (для архива),
+    при `drop=True` она удаляется. Возвращает имена обработанных секций.
+    """
+    cutoff_month = month_start(cutoff_month)
+    detached = []
+    for name, month in list_partitions(table):
+        if add_months(month, 1) > cutoff_month:
+            break
+        db.session.execute(text(f'ALTER TABLE "{table}" DETACH PARTITION "{name}"'))
+        if drop:
+            db.session.execute(text(f'DROP TABLE "{name}"'))
+        detached.append(name)
+    db.session.commit()
+    return detached
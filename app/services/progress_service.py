@@ -0,0 +1,434 @@
+# app/services/progress_service.py
+
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, bindparam, case, func, select, update, delete
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import aliased
+
+from app import db
+from app.services import route_service
+from app.models.models import (Part, PartStageProgress, ProductProgress, ProductVersion, PartTombstone,
+                               RouteStage, Stage)
+
+
+def _dialect_insert():
+    """INSERT с поддержкой ON CONFLICT для диалекта текущей базы."""
+    return postgresql_insert if db.session.get_bind().dialect.name == 'postgresql' else sqlite_insert
+
+
+def get_completed_quantities(part):
+    """
+    Возвращает словарь {stage_id: выполненное количество} для одной детали.
+    Читает материализованную таблицу прогресса одним запросом.
+    """
+    rows = db.session.query(PartStageProgress.stage_id, PartStageProgress.qty_done).filter(
+        PartStageProgress.part_pk == part.id
+    )
+    return {stage_id: qty_done for stage_id, qty_done in rows}
+
+
+def get_completed_quantities_for_parts(part_pks):
+    """
+    Возвращает словарь {Part.id: {stage_id: количество}} для набора деталей
+    одним запросом (используется при построении списков деталей).
+    """
+    result = defaultdict(dict)
+    if not part_pks:
+        return result
+    rows = db.session.query(
+        PartStageProgress.part_pk, PartStageProgress.stage_id, PartStageProgress.qty_done
+    ).filter(PartStageProgress.part_pk.in_(part_pks))
+    for part_pk, stage_id, qty_done in rows:
+        result[part_pk][stage_id] = qty_done
+    return result
+
+
+def get_part_with_progress(part_id):
+    """
+    Деталь по обозначению и ее словарь {stage_id: количество} одним запросом
+    (внешнее соединение по уникальному индексу обозначения и ключу прогресса).
+    Возвращает (None, {}), если детали нет.
+    """
+    rows = db.session.execute(
+        select(Part, PartStageProgress.stage_id, PartStageProgress.qty_done)
+        .outerjoin(PartStageProgress, PartStageProgress.part_pk == Part.id)
+        .where(Part.part_id == part_id)
+    ).all()
+    if not rows:
+        return None, {}
+    return rows[0][0], {stage_id: qty_done for _, stage_id, qty_done in rows if stage_id is not None}
+
+
+def find_next_stage(part, completed_quantities):
+    """Первый этап маршрута, на котором выполнено меньше общего количества, или None."""
+    for rs in route_service.get_route_stages(part.route_template_id):
+        if completed_quantities.get(rs.stage_id, 0) < part.quantity_total:
+            return rs
+    return None
+
+
+def lock_parts(parts):
+    """
+    Блокирует строки деталей до конца текущей транзакции и перечитывает их.
+    PostgreSQL: SELECT ... FOR UPDATE в порядке id (без взаимных блокировок).
+    SQLite не блокирует отдельные строки: пустое обновление деталей берет
+    блокировку записи базы, и параллельные подтверждения выполняются по очереди.
+    """
+    pks = sorted({part.id for part in parts})
+    if not pks:
+        return
+    reload = select(Part).where(Part.id.in_(pks)).order_by(Part.id).execution_options(populate_existing=True)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        db.session.execute(reload.with_for_update()).scalars().all()
+        return
+    db.session.execute(
+        update(Part).where(Part.id.in_(pks)).values(id=Part.id)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(reload).scalars().all()
+
+
+def lock_part(part):
+    lock_parts([part])
+
+
+def claim_stage_progress(part, stage_id, quantity, timestamp=None):
+    """
+    Атомарно увеличивает счетчик детали на этапе на `quantity`, если итог
+    не превысит общее количество детали. Проверка и увеличение выполняются
+    одним UPDATE, поэтому параллельные подтверждения не дают перерасхода.
+    Возвращает новое выполненное количество или None, если столько не осталось.
+    """
+    db.session.execute(
+        _dialect_insert()(PartStageProgress)
+        .values(part_pk=part.id, stage_id=stage_id, qty_done=0)
+        .on_conflict_do_nothing()
+    )
+    return db.session.execute(
+        update(PartStageProgress)
+        .where(
+            PartStageProgress.part_pk == part.id,
+            PartStageProgress.stage_id == stage_id,
+            PartStageProgress.qty_done + quantity <= part.quantity_total
+        )
+        .values(
+            qty_done=PartStageProgress.qty_done + quantity,
+            last_timestamp=timestamp or datetime.now(timezone.utc)
+        )
+        .returning(PartStageProgress.qty_done)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def release_stage_progress(part, stage_id, quantity, timestamp=None):
+    """
+    Атомарно уменьшает счетчик детали на этапе на `quantity` (отмена этапа),
+    если на этапе выполнено не меньше. Вызывается под блокировкой детали (lock_part).
+    Возвращает новое выполненное количество или None, если столько не выполнено.
+    """
+    return db.session.execute(
+        update(PartStageProgress)
+        .where(
+            PartStageProgress.part_pk == part.id,
+            PartStageProgress.stage_id == stage_id,
+            PartStageProgress.qty_done >= quantity
+        )
+        .values(
+            qty_done=PartStageProgress.qty_done - quantity,
+            last_timestamp=timestamp or datetime.now(timezone.utc)
+        )
+        .returning(PartStageProgress.qty_done)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+
+def add_stage_progress_batch(quantities, timestamp=None):
+    """
+    Увеличивает счетчики {(Part.id, stage_id): количество} двумя запросами:
+    недостающие строки создаются одной вставкой, затем все счетчики
+    обновляются одним пакетным UPDATE. Остатки проверяет вызывающий код
+    под блокировкой деталей (lock_parts); коммит остается за ним.
+    """
+    if not quantities:
+        return
+    timestamp = timestamp or datetime.now(timezone.utc)
+    db.session.execute(
+        _dialect_insert()(PartStageProgress)
+        .values([{'part_pk': part_pk, 'stage_id': stage_id, 'qty_done': 0} for part_pk, stage_id in quantities])
+        .on_conflict_do_nothing()
+    )
+    table = PartStageProgress.__table__
+    db.session.execute(
+        update(table)
+        .where(table.c.part_pk == bindparam('b_part_pk'), table.c.stage_id == bindparam('b_stage_id'))
+        .values(qty_done=table.c.qty_done + bindparam('b_quantity'), last_timestamp=timestamp),
+        [{'b_part_pk': part_pk, 'b_stage_id': stage_id, 'b_quantity': quantity}
+         for (part_pk, stage_id), quantity in quantities.items()]
+    )
+
+
+def calculate_bottleneck(part, completed_quantities):
+    """
+    Находит "узкое место" маршрута - минимальное количество, выполненное
+    на каком-либо этапе. Не начатый этап считается как 0.
+    """
+    if part.route_template_id is None:
+        return part.quantity_completed
+    min_completed = part.quantity_total
+    for rs in route_service.get_route_stages(part.route_template_id):
+        qty = completed_quantities.get(rs.stage_id, 0)
+        if qty < min_completed:
+            min_completed = qty
+    return min_completed
+
+
+def adjust_product_progress(product_designation, parts=0, quantity=0, completed=0):
+    """
+    Инкрементально изменяет сводку по изделию на заданные приращения.
+    Выполняется одним INSERT ... ON CONFLICT DO UPDATE в текущей транзакции:
+    первые изменения изделия из параллельных транзакций не конфликтуют
+    на вставке строки. Строка удаляется, когда в изделии не остается деталей.
+    """
+    if not (parts or quantity or completed):
+        return
+    stmt = _dialect_insert()(ProductProgress).values(
+        product_designation=product_designation,
+        total_parts=max(parts, 0),
+        total_quantity=max(quantity, 0),
+        completed_quantity=max(completed, 0)
+    )
+    db.session.scalars(
+        stmt.on_conflict_do_update(
+            index_elements=[ProductProgress.product_designation],
+            set_={
+                'total_parts': ProductProgress.total_parts + parts,
+                'total_quantity': ProductProgress.total_quantity + quantity,
+                'completed_quantity': ProductProgress.completed_quantity + completed,
+            }
+        ).returning(ProductProgress),
+        execution_options={'populate_existing': True}
+    ).all()
+    if parts < 0:
+        db.session.execute(
+            delete(ProductProgress).where(
+                ProductProgress.product_designation == product_designation,
+                ProductProgress.total_parts <= 0
+            )
+        )
+
+
+def is_root_part(part):
+    """Проверяет, что деталь корневая (в том числе для еще не сохраненной детали)."""
+    return part.parent_pk is None and part.parent is None
+
+
+def track_part_in_product_progress(part, sign=1):
+    """
+    Добавляет (sign=1) или вычитает (sign=-1) корневую деталь из сводки
+    по изделию. Дочерние узлы в сводке панели мониторинга не учитываются.
+    """
+    if not is_root_part(part):
+        return
+    adjust_product_progress(
+        part.product_designation,
+        parts=sign,
+        quantity=sign * (part.quantity_total or 0),
+        completed=sign * (part.quantity_completed or 0)
+    )
+
+
+def set_part_quantity_completed(part, quantity_completed):
+    """
+    Устанавливает выполненное количество детали и переносит разницу
+    в сводку по изделию.
+    """
+    delta = quantity_completed - (part.quantity_completed or 0)
+    part.quantity_completed = quantity_completed
+    if delta and is_root_part(part):
+        adjust_product_progress(part.product_designation, completed=delta)
+
+
+def bump_product_versions(product_designations):
+    """
+    Увеличивает номер версии изделий на 1 в текущей транзакции
+    (строка создается при первом изменении изделия тем же upsert).
+    Возвращает словарь {изделие: новая версия}.
+    """
+    product_designations = {pd for pd in product_designations if pd is not None}
+    if not product_designations:
+        return {}
+    # Один upsert на все изделия; строки в порядке ключа, чтобы параллельные
+    # транзакции на PostgreSQL блокировали их в одном порядке
+    stmt = _dialect_insert()(ProductVersion).values(
+        [{'product_designation': pd, 'version': 1} for pd in sorted(product_designations)]
+    )
+    rows = db.session.scalars(
+        stmt.on_conflict_do_update(
+            index_elements=[ProductVersion.product_designation],
+            set_={'version': ProductVersion.version + 1}
+        ).returning(ProductVersion),
+        execution_options={'populate_existing': True}
+    ).all()
+    return {row.product_designation: row.version for row in rows}
+
+
+def bump_product_version(product_designation):
+    return bump_product_versions([product_designation])[product_designation]
+
+
+def touch_parts(parts):
+    """
+    Увеличивает версию изделий и отмечает детали этой версией:
+    по ней выдача изменений находит детали, изменившиеся после токена клиента.
+    """
+    versions = bump_product_versions({part.product_designation for part in parts})
+    for part in parts:
+        part.change_version = versions[part.product_designation]
+
+
+def record_removed_parts(parts, product_designation=None):
+    """
+    Увеличивает версию изделий и сохраняет отметки об удалении деталей.
+    `product_designation` - изделие, из которого деталь переносится в другое.
+    """
+    parts = [(product_designation or part.product_designation, part.part_id) for part in parts]
+    versions = bump_product_versions({pd for pd, _ in parts})
+    db.session.add_all([
+        PartTombstone(product_designation=pd, part_id=part_id, version=versions[pd])
+        for pd, part_id in parts
+    ])
+
+
+def bump_product_versions_for_parts(*criteria):
+    """Увеличивает версию изделий, в которых есть детали под условием, и отмечает эти детали."""
+    versions = bump_product_versions(db.session.execute(
+        select(Part.product_designation).where(*criteria).distinct()
+    ).scalars())
+    for product_designation, version in versions.items():
+        db.session.execute(
+            update(Part)
+            .where(*criteria, Part.product_designation == product_designation)
+            .values(change_version=version)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def get_changes(product_designation, since, options=()):
+    """
+    Изменения корневых деталей изделия после версии `since`
+    (`options` - параметры загрузки связей деталей).
+    Возвращает (текущая версия, измененные детали, обозначения удаленных деталей).
+    Версия читается до деталей: изменение, зафиксированное между запросами,
+    в худшем случае придет клиенту повторно со следующим токеном.
+    """
+    version = get_product_version(product_designation)
+    parts = Part.query.options(*options).filter(
+        Part.product_designation == product_designation,
+        Part.change_version > since,
+        Part.parent_pk.is_(None)
+    ).order_by(Part.part_id).all()
+    present = {part.part_id for part in parts}
+    deleted = db.session.execute(
+        select(PartTombstone.part_id).where(
+            PartTombstone.product_designation == product_designation,
+            PartTombstone.version > since
+        ).distinct()
+    ).scalars()
+    # Деталь, удаленная и созданная заново после токена, передается как измененная
+    return version, parts, sorted(set(deleted) - present)
+
+
+def get_product_version(product_designation):
+    """Текущий номер версии изделия (0 - изделие еще не менялось)."""
+    return db.session.execute(
+        select(ProductVersion.version).where(ProductVersion.product_designation == product_designation)
+    ).scalar() or 0
+
+
+def get_product_versions():
+    """Текущие номера версий всех изменявшихся изделий: {изделие: версия}."""
+    return dict(db.session.execute(select(ProductVersion.product_designation, ProductVersion.version)).all())
+
+
+def get_dashboard_version():
+    """
+    Версия панели мониторинга - сумма версий всех изделий. Строки версий
+    не удаляются, поэтому сумма растет при любом изменении любого изделия.
+    """
+    return db.session.execute(select(func.coalesce(func.sum(ProductVersion.version), 0))).scalar()
+
+
+def get_stage_wip(product_designations=None):
+    """
+    Незавершенное производство по этапам одним запросом для перечисленных
+    изделий (по умолчанию - для всех):
+    {изделие: [(этап, штук), ...]} в порядке этапов маршрутов. На этапе
+    "находятся" штуки, выполненные на предыдущем этапе маршрута (для первого
+    этапа - все количество детали), но еще не выполненные на этом.
+    Учитываются все детали изделия, включая компоненты сборок.
+    """
+    done = aliased(PartStageProgress)
+    prev_stage = aliased(RouteStage)
+    prev_done = aliased(PartStageProgress)
+    arrived = case(
+        (prev_stage.stage_id.is_(None), Part.quantity_total),
+        else_=func.coalesce(prev_done.qty_done, 0)
+    )
+    waiting = arrived - func.coalesce(done.qty_done, 0)
+    query = (
+        select(
+            Part.product_designation, Stage.name,
+            func.sum(case((waiting > 0, waiting), else_=0)).label('units'),
+            func.min(RouteStage.order).label('stage_order')
+        )
+        .join(RouteStage, RouteStage.template_id == Part.route_template_id)
+        .join(Stage, Stage.id == RouteStage.stage_id)
+        .outerjoin(done, and_(done.part_pk == Part.id, done.stage_id == RouteStage.stage_id))
+        .outerjoin(prev_stage, and_(prev_stage.template_id == RouteStage.template_id,
+                                    prev_stage.order == RouteStage.order - 1))
+        .outerjoin(prev_done, and_(prev_done.part_pk == Part.id, prev_done.stage_id == prev_stage.stage_id))
+        .group_by(Part.product_designation, Stage.id, Stage.name)
+        .order_by(Part.product_designation, 'stage_order', Stage.name)
+    )
+    if product_designations is not None:
+        query = query.where(Part.product_designation.in_(product_designations))
+    rows = db.session.execute(query).all()
+
+    result = defaultdict(list)
+    for product_designation, stage_name, units, _ in rows:
+        if units:
+            result[product_designation].append((stage_name, int(units)))
+    return dict(result)
+
+
+def rebuild_product_progress():
+    """
+    Полностью пересобирает сводку по изделиям из таблицы деталей.
+    Возвращает количество изделий в сводке.
+    """
+    db.session.execute(delete(ProductProgress))
+    rows = db.session.query(
+        Part.product_designation,
+        func.count(Part.id),
+        func.sum(Part.quantity_total),
+        func.sum(Part.quantity_completed)
+    ).filter(Part.parent_pk.is_(None)).group_by(Part.product_designation).all()
+
+    db.session.add_all([
+        ProductProgress(
+            product_designation=product_designation,
+            total_parts=total_parts,
+            total_quantity=total_quantity or 0,
+            completed_quantity=completed_quantity or 0
+        ) for product_designation, total_parts, total_quantity, completed_quantity in rows
+    ])
+    # Сводка могла измениться у любого изделия
+    bump_product_versions(
+        set(db.session.execute(select(ProductVersion.product_designation)).scalars())
+        | {row[0] for row in rows}
+    )
+    db.session.commit()
+    return len(rows)
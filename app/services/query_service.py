@@ -1,12 +1,18 @@
 # app/services/query_service.py (ФИНАЛЬНАЯ ПОЛНАЯ ВЕРСИЯ С ЯВНЫМИ ИМЕНАМИ КОЛОНОК)
 
-from sqlalchemy import union_all, literal_column, cast, String
+from flask import current_app
+from sqlalchemy import union_all, literal_column, cast, String, func
 from app.models.models import db, Part, StatusHistory, AuditLog, PartNote, User, Stage, ResponsibleHistory
+from app.services import archive_service
 
-def get_combined_history(part):
+# Служебные действия с примечаниями не показываются в ленте (примечания выводятся отдельно)
+NOTE_ACTIONS = ['Добавлено примечание', 'Изменено примечание', 'Удалено примечание']
+
+def get_combined_history(part, include_archived=False):
     """
     Получает объединенную и отсортированную историю для одной детали
     единым эффективным запросом с использованием UNION ALL.
+    Записи журнала аудита из архива читаются только при include_archived=True.
     """
     
     # Запрос 1: История статусов
@@ -14,11 +20,12 @@ def get_combined_history(part):
         StatusHistory.id.label("id"),
         StatusHistory.timestamp.label("timestamp"),
         literal_column("'status'").label("type"),
-        StatusHistory.status.label("col1"),
+        # Актуальное название этапа из справочника; для несопоставленных записей - сохраненная подпись
+        func.coalesce(Stage.name, StatusHistory.status).label("col1"),
         StatusHistory.operator_name.label("col2"),
         cast(StatusHistory.quantity, String).label("col3"),
         literal_column("NULL", type_=db.Integer).label("user_id")
-    ).filter(StatusHistory.part_id == part.part_id)
+    ).outerjoin(Stage, Stage.id == StatusHistory.stage_id).filter(StatusHistory.part_pk == part.id)
 
     # Запрос 2: Логи аудита
     audit_query = db.session.query(
@@ -31,7 +38,7 @@ def get_combined_history(part):
         AuditLog.user_id
     ).filter(
         AuditLog.part_id == part.part_id,
-        AuditLog.action.notin_(['Добавлено примечание', 'Изменено примечание', 'Удалено примечание'])
+        AuditLog.action.notin_(NOTE_ACTIONS)
     )
 
     # Запрос 3: Примечания
@@ -43,7 +50,7 @@ def get_combined_history(part):
         cast(PartNote.stage_id, String).label("col2"),
         literal_column("NULL").label("col3"),
         PartNote.user_id
-    ).filter(PartNote.part_id == part.part_id)
+    ).filter(PartNote.part_pk == part.id)
     
     # Запрос 4: История смены ответственных
     resp_query = db.session.query(
@@ -54,7 +61,7 @@ def get_combined_history(part):
         literal_column("NULL").label("col2"),
         literal_column("NULL").label("col3"),
         ResponsibleHistory.user_id
-    ).filter(ResponsibleHistory.part_id == part.part_id)
+    ).filter(ResponsibleHistory.part_pk == part.id)
     
     # Объединяем все четыре запроса
     combined_query = union_all(status_query, audit_query, notes_query, resp_query).alias("combined_history")
@@ -63,7 +70,14 @@ def get_combined_history(part):
     final_query = db.session.query(combined_query).order_by(combined_query.c.timestamp.desc())
 
     results = final_query.all()
-    user_ids = {row.user_id for row in results if row.user_id}
+    archived = []
+    if include_archived:
+        archived = [
+            record for record in archive_service.read_archived_logs(
+                current_app.config['AUDIT_ARCHIVE_FOLDER'], part_id=part.part_id
+            ) if record['action'] not in NOTE_ACTIONS
+        ]
+    user_ids = {row.user_id for row in results if row.user_id} | {record['user_id'] for record in archived}
     stage_ids_from_notes = {int(row.col2) for row in results if row.type == 'note' and row.col2}
 
     users_map = {u.id: u for u in db.session.query(User).filter(User.id.in_(user_ids))}
@@ -95,5 +109,19 @@ def get_combined_history(part):
             entry['user'] = users_map.get(row.user_id)
         
         history_list.append(entry)
-        
+
+    if archived:
+        history_list.extend(
+            {
+                'id': record['id'],
+                'timestamp': record['timestamp'],
+                'type': 'audit',
+                'action': record['action'],
+                'details': record['details'],
+                'user': users_map.get(record['user_id']),
+                'archived': True
+            } for record in archived
+        )
+        history_list.sort(key=lambda entry: entry['timestamp'], reverse=True)
+
     return history_list
\ No newline at end of file
@@ -0,0 +1,72 @@
+# app/services/route_service.py
+
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from app import db
+from app.models.models import RouteStage, Stage
+from app.services import cache_service
+
+class RouteStageInfo(namedtuple('RouteStageInfo', ['stage_id', 'stage_name'])):
+    """Этап маршрута в кэше: неизменяемая пара (id этапа, название этапа)."""
+    __slots__ = ()
+
+    # Шаблоны обращаются к этапу как к объекту Stage
+    @property
+    def id(self):
+        return self.stage_id
+
+    @property
+    def name(self):
+        return self.stage_name
+
+# Имя счетчика поколений в таблице CacheGenerations
+GENERATION_NAME = 'route_templates'
+
+
+def _cache():
+    # Кэш приложения {template_id: (RouteStageInfo, ...)} в порядке этапов маршрута.
+    # Изменение маршрутов в любом процессе увеличивает счетчик поколения в базе,
+    # и остальные процессы сбрасывают кэш при следующей проверке.
+    return cache_service.get_generation_cache(GENERATION_NAME)
+
+
+def clear_cache():
+    """Сбрасывает кэш маршрутов приложения (после очистки таблиц маршрутов)."""
+    _cache().clear()
+
+
+def invalidate():
+    """
+    Сбрасывает кэш маршрутов во всех процессах: увеличивает счетчик поколения
+    в текущей транзакции и очищает кэш этого процесса. Вызывается при любом
+    изменении маршрутов или справочника этапов; коммит остается за вызывающим кодом.
+    """
+    cache_service.bump_generation(GENERATION_NAME)
+
+
+def get_route_stages(template_id):
+    """
+    Возвращает этапы маршрута по порядку в виде кортежа RouteStageInfo.
+    Для детали без маршрута (template_id = None) - пустой кортеж.
+    """
+    if template_id is None:
+        return ()
+    cache = _cache()
+    stages = cache.get(template_id)
+    if stages is None:
+        rows = db.session.execute(
+            select(RouteStage.stage_id, Stage.name)
+            .join(Stage, Stage.id == RouteStage.stage_id)
+            .where(RouteStage.template_id == template_id)
+            .order_by(RouteStage.order)
+        ).all()
+        stages = tuple(RouteStageInfo(stage_id, stage_name) for stage_id, stage_name in rows)
+        cache.set(template_id, stages)
+    return stages
+
+
+def find_route_stage(template_id, stage_id):
+    """Этап маршрута по id этапа или None, если этапа в маршруте нет."""
+    return next((rs for rs in get_route_stages(template_id) if rs.stage_id == stage_id), None)
@@ -0,0 +1,90 @@
+# app/services/search_service.py
+
+from sqlalchemy import String, case, column, func, literal_column, select, table, text
+
+from app import db
+from app.models.models import Part, PART_SEARCH_TABLE
+
+# Размер страницы результатов по умолчанию и максимальный
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+# Триграммный индекс находит только слова не короче трех символов
+TRIGRAM_LENGTH = 3
+
+_search_table = table(PART_SEARCH_TABLE, column('rowid'), column('rank'))
+
+
+def search_document():
+    """
+    Поисковый документ детали: обозначение, наименование, материал и изделие
+    через пробел. Выражение совпадает с выражением GIN-индекса PostgreSQL,
+    разделитель подставляется литералом, иначе планировщик не узнает индекс.
+    """
+    separator = literal_column("' '", String)
+    return (Part.part_id + separator + Part.name + separator
+            + Part.material + separator + Part.product_designation)
+
+
+def parse_terms(query):
+    """Разбивает строку поиска на слова; регистр не учитывается при поиске."""
+    return [term for term in query.split() if term]
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _fts_phrase(term):
+    # Каждое слово - отдельная фраза FTS5: кавычки внутри удваиваются
+    return '"' + term.replace('"', '""') + '"'
+
+
+def search_parts(query, limit=SEARCH_PAGE_SIZE, offset=0):
+    """
+    Ищет детали, у которых каждое слово запроса входит в обозначение,
+    наименование, материал или изделие. Сначала идет точное совпадение
+    обозначения, затем совпадение по началу обозначения, затем остальные
+    по релевантности. Возвращает (детали, есть ли следующая страница).
+    """
+    terms = parse_terms(query)
+    if not terms:
+        return [], False
+
+    document = search_document()
+    stmt = select(Part)
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # ILIKE по выражению индекса выполняется через GIN-индекс pg_trgm
+        relevance = func.word_similarity(query, document).desc()
+        for term in terms:
+            stmt = stmt.where(document.ilike(f'%{_escape_like(term)}%', escape='\\'))
+    else:
+        # SQLite: триграммы FTS5 выбирают кандидатов, короткие слова проверяются по документу
+        long_terms = [term for term in terms if len(term) >= TRIGRAM_LENGTH]
+        if long_terms:
+            stmt = stmt.join(_search_table, _search_table.c.rowid == Part.id).where(
+                text(f'{PART_SEARCH_TABLE} MATCH :match').bindparams(
+                    match=' '.join(_fts_phrase(term) for term in long_terms)
+                )
+            )
+            relevance = _search_table.c.rank
+        else:
+            relevance = None
+        for term in terms:
+            if len(term) < TRIGRAM_LENGTH:
+                stmt = stmt.where(document.ilike(f'%{_escape_like(term)}%', escape='\\'))
+
+    part_id_rank = case(
+        (Part.part_id == query.strip(), 0),
+        (Part.part_id.startswith(query.strip(), autoescape=True), 1),
+        else_=2
+    )
+    order_by = [part_id_rank]
+    if relevance is not None:
+        order_by.append(relevance)
+    order_by.append(Part.part_id)
+
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    parts = db.session.execute(
+        stmt.order_by(*order_by).offset(offset).limit(limit + 1)
+    ).scalars().all()
+    return parts[:limit], len(parts) > limit
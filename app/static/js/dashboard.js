@@ -4,6 +4,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
     // Кэш для хранения уже загруженных данных о деталях
     const detailsCache = {};
+    // Токен изменений (версия изделия) для каждой загруженной таблицы деталей
+    const detailsTokens = {};
     
     // Основные элементы DOM, с которыми будем работать
     const mainTable = document.getElementById('main-dashboard-table');
@@ -19,21 +21,14 @@ document.addEventListener('DOMContentLoaded', function() {
 
     socket.on('update_dashboard', function(data) {
         console.log('Dashboard update received:', data);
+        // Пакетное подтверждение присылает одно событие на все изделия пакета
+        (data.product_designations || [data.product_designation]).forEach(syncProductChanges);
+    });
 
-        // Обновляем конкретную деталь, если она видна на экране
-        const detailsRowContainer = document.getElementById(`details-for-${data.safe_key}`);
-        if (detailsRowContainer && !detailsRowContainer.classList.contains('hidden')) {
-            // Чтобы не перезагружать все, найдем и обновим только нужные элементы
-            const partRow = detailsRowContainer.querySelector(`input[value="${data.part_id}"]`)?.closest('tr');
-            if (partRow) {
-                const progressBar = partRow.querySelector('.bg-blue-600');
-                const progressText = partRow.querySelector('small');
-                const progress = (data.quantity_completed / data.quantity_total) * 100;
-
-                if(progressBar) progressBar.style.width = `${progress}%`;
-                if(progressText) progressText.textContent = `${data.quantity_completed} из ${data.quantity_total}`;
-            }
-        }
+    // Остальные изменения деталей приходят без изделия: дозапрашиваем
+    // изменения для всех уже загруженных таблиц (обычно ответ пустой)
+    socket.on('notification', function() {
+        Object.keys(detailsTokens).forEach(syncProductChanges);
     });
     // === КОНЕЦ: НОВОГО БЛОКА ===
 
@@ -106,6 +101,90 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Поля, которые таблица деталей запрашивает у /api/parts
+    const PARTS_FIELDS = 'part_id,name,size,material,route_stages,quantity_completed,quantity_total,responsible_user,history_url,delete_url,edit_url,qr_url';
+    const PARTS_PAGE_SIZE = 200;
+
+    function renderPartRow(part, permissions, csrfToken) {
+        const progress = (part.quantity_completed / part.quantity_total) * 100;
+        const progressText = `${part.quantity_completed} из ${part.quantity_total}`;
+        
+        const routeHtml = part.route_stages.map(stage => {
+            let classes = 'text-gray-500';
+            let title = `Ожидание (${stage.qty_done}/${part.quantity_total})`;
+            if (stage.status === 'completed') {
+                classes = 'text-green-500 line-through';
+                title = `Выполнено (${stage.qty_done}/${part.quantity_total})`;
+            } else if (stage.status === 'in_progress') {
+                classes = 'text-blue-600 font-bold';
+                title = `В процессе (${stage.qty_done}/${part.quantity_total})`;
+            }
+            return `<span class="${classes}" title="${title}">${stage.name}</span>`;
+        }).join(' <span class="text-gray-300">→</span> ') || '<span class="text-gray-400 italic">Маршрут не назначен</span>';
+
+        const deleteBtn = permissions?.can_delete ? `<form action="${part.delete_url}" method="post" class="inline form-confirm" data-text="Удалить деталь ${part.part_id}?"><input type="hidden" name="csrf_token" value="${csrfToken}"><button type="submit" class="text-red-600 hover:text-red-900" title="Удалить">✖</button></form>` : '';
+        const editBtn = permissions?.can_edit ? `<a href="${part.edit_url}" class="text-blue-600 hover:text-blue-900" title="Редактировать">✎</a>` : '';
+        const qrBtn = permissions?.can_generate_qr ? `<form action="${part.qr_url}" method="post" class="inline"><input type="hidden" name="csrf_token" value="${csrfToken}"><button type="submit" class="text-green-600 hover:text-green-900" title="Скачать QR-код"></button></form>` : '';
+        
+        const progressBarHtml = `
+            <div class="w-full bg-gray-200 rounded-full h-2.5">
+                <div class="bg-blue-600 h-2.5 rounded-full" style="width: ${progress}%"></div>
+            </div>
+            <small>${progressText}</small>
+        `;
+
+        return `
+            <tr class="hover:bg-gray-100">
+                <td class="px-6 py-4"><input type="checkbox" value="${part.part_id}" class="part-checkbox rounded border-gray-300"></td>
+                <td class="px-6 py-4"><a href="${part.history_url}" class="text-blue-600 hover:underline font-medium">${part.part_id}</a></td>
+                <td class="px-6 py-4 text-sm text-gray-900">${part.name}</td>
+                <td class="px-6 py-4 text-sm text-gray-500">${part.size || ''}</td>
+                <td class="px-6 py-4 text-sm text-gray-500">${part.material}</td>
+                <td class="px-6 py-4 text-xs">${routeHtml}</td>
+                <td class="px-6 py-4">${progressBarHtml}</td>
+                <td class="px-6 py-4 text-sm text-gray-500">${part.responsible_user}</td>
+                <td class="px-6 py-4 flex items-center justify-end gap-x-4">${editBtn} ${qrBtn} ${deleteBtn}</td>
+            </tr>`;
+    }
+
+    // Дописывает в загруженную таблицу изменения деталей после сохраненного токена:
+    // измененные строки заменяются, удаленные убираются, новые добавляются в конец
+    async function syncProductChanges(productDesignation) {
+        const token = detailsTokens[productDesignation];
+        if (token === undefined) return;
+        const productRow = [...document.querySelectorAll('.product-row')]
+            .find(row => row.dataset.productDesignation === productDesignation);
+        const tbody = productRow && document.getElementById(`details-for-${productRow.dataset.safeKey}`)?.querySelector('.details-placeholder tbody');
+        try {
+            if (!tbody) throw new Error('Таблица деталей не загружена');
+            const params = new URLSearchParams({ since: token, fields: PARTS_FIELDS });
+            const response = await fetch(`/api/parts/${encodeURIComponent(productDesignation)}/changes?${params}`);
+            if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+
+            const { parts, deleted, permissions, token: newToken } = await response.json();
+            const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+            const findRow = partId => tbody.querySelector(`input.part-checkbox[value="${CSS.escape(partId)}"]`)?.closest('tr');
+
+            deleted.forEach(partId => findRow(partId)?.remove());
+            parts.forEach(part => {
+                const html = renderPartRow(part, permissions, csrfToken);
+                const existingRow = findRow(part.part_id);
+                if (existingRow) {
+                    existingRow.outerHTML = html;
+                } else {
+                    tbody.insertAdjacentHTML('beforeend', html);
+                }
+            });
+            detailsTokens[productDesignation] = newToken;
+            detailsCache[productDesignation] = tbody.closest('.details-placeholder').innerHTML;
+        } catch (error) {
+            // Не удалось применить изменения: при следующем раскрытии список загрузится заново
+            console.error('Ошибка синхронизации деталей:', error);
+            delete detailsTokens[productDesignation];
+            delete detailsCache[productDesignation];
+        }
+    }
+
     if (mainTable) {
         mainTable.addEventListener('click', async function(event) {
             const productToggle = event.target.closest('.product-toggle');
@@ -129,77 +208,53 @@ document.addEventListener('DOMContentLoaded', function() {
                 contentCell.innerHTML = `<div class="p-8 text-center text-gray-500">Загрузка...</div>`;
                 
                 try {
-                    const response = await fetch(`/api/parts/${encodeURIComponent(productDesignation)}`);
-                    if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
-                    
-                    const data = await response.json();
-                    const { parts, permissions } = data;
                     const csrfToken = document.querySelector('meta[name="csrf-token"]').getAttribute('content');
+                    let cursor = null;
+                    let tbody = null;
+                    let firstToken = null;
+
+                    // Детали приходят страницами по PARTS_PAGE_SIZE: первая страница
+                    // показывается сразу, остальные дописываются в таблицу по мере загрузки
+                    do {
+                        const params = new URLSearchParams({ fields: PARTS_FIELDS, limit: PARTS_PAGE_SIZE });
+                        if (cursor) params.set('after', cursor);
+                        const response = await fetch(`/api/parts/${encodeURIComponent(productDesignation)}?${params}`);
+                        if (!response.ok) throw new Error(`HTTP error! status: ${response.status}`);
+
+                        const { parts, permissions, next_cursor, token } = await response.json();
+                        // Изменения синхронизируются от версии первой страницы
+                        if (firstToken === null) firstToken = token;
+
+                        if (!tbody) {
+                            if (parts.length === 0) {
+                                contentCell.innerHTML = '<div class="p-8 text-center text-gray-500">Детали не найдены.</div>';
+                                break;
+                            }
+                            contentCell.innerHTML = `
+                                <table class="min-w-full details-table">
+                                    <thead class="bg-gray-100">
+                                        <tr>
+                                            <th class="px-6 py-3 w-12"><input type="checkbox" class="select-all-parts rounded border-gray-300" title="Выбрать все"></th>
+                                            <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Обозначение</th>
+                                            <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Наименование</th>
+                                            <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Размер</th>
+                                            <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Материал</th>
+                                            <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Маршрут</th>
+                                            <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Прогресс (шт.)</th>
+                                            <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Ответственный</th>
+                                            <th class="px-6 py-3"></th>
+                                        </tr>
+                                    </thead>
+                                    <tbody class="bg-white divide-y divide-gray-200"></tbody>
+                                </table>`;
+                            tbody = contentCell.querySelector('tbody');
+                        }
+                        tbody.insertAdjacentHTML('beforeend', parts.map(part => renderPartRow(part, permissions, csrfToken)).join(''));
+                        cursor = next_cursor;
+                    } while (cursor);
 
-                    if (parts.length === 0) {
-                        contentCell.innerHTML = '<div class="p-8 text-center text-gray-500">Детали не найдены.</div>';
-                    } else {
-                        const rowsHtml = parts.map(part => {
-                            const progress = (part.quantity_completed / part.quantity_total) * 100;
-                            const progressText = `${part.quantity_completed} из ${part.quantity_total}`;
-                            
-                            const routeHtml = part.route_stages.map(stage => {
-                                let classes = 'text-gray-500';
-                                let title = `Ожидание (${stage.qty_done}/${part.quantity_total})`;
-                                if (stage.status === 'completed') {
-                                    classes = 'text-green-500 line-through';
-                                    title = `Выполнено (${stage.qty_done}/${part.quantity_total})`;
-                                } else if (stage.status === 'in_progress') {
-                                    classes = 'text-blue-600 font-bold';
-                                    title = `В процессе (${stage.qty_done}/${part.quantity_total})`;
-                                }
-                                return `<span class="${classes}" title="${title}">${stage.name}</span>`;
-                            }).join(' <span class="text-gray-300">→</span> ') || '<span class="text-gray-400 italic">Маршрут не назначен</span>';
-
-                            const deleteBtn = permissions?.can_delete ? `<form action="${part.delete_url}" method="post" class="inline form-confirm" data-text="Удалить деталь ${part.part_id}?"><input type="hidden" name="csrf_token" value="${csrfToken}"><button type="submit" class="text-red-600 hover:text-red-900" title="Удалить">✖</button></form>` : '';
-                            const editBtn = permissions?.can_edit ? `<a href="${part.edit_url}" class="text-blue-600 hover:text-blue-900" title="Редактировать">✎</a>` : '';
-                            const qrBtn = permissions?.can_generate_qr ? `<form action="${part.qr_url}" method="post" class="inline"><input type="hidden" name="csrf_token" value="${csrfToken}"><button type="submit" class="text-green-600 hover:text-green-900" title="Скачать QR-код"></button></form>` : '';
-                            
-                            const progressBarHtml = `
-                                <div class="w-full bg-gray-200 rounded-full h-2.5">
-                                    <div class="bg-blue-600 h-2.5 rounded-full" style="width: ${progress}%"></div>
-                                </div>
-                                <small>${progressText}</small>
-                            `;
-
-                            return `
-                                <tr class="hover:bg-gray-100">
-                                    <td class="px-6 py-4"><input type="checkbox" value="${part.part_id}" class="part-checkbox rounded border-gray-300"></td>
-                                    <td class="px-6 py-4"><a href="${part.history_url}" class="text-blue-600 hover:underline font-medium">${part.part_id}</a></td>
-                                    <td class="px-6 py-4 text-sm text-gray-900">${part.name}</td>
-                                    <td class="px-6 py-4 text-sm text-gray-500">${part.size || ''}</td>
-                                    <td class="px-6 py-4 text-sm text-gray-500">${part.material}</td>
-                                    <td class="px-6 py-4 text-xs">${routeHtml}</td>
-                                    <td class="px-6 py-4">${progressBarHtml}</td>
-                                    <td class="px-6 py-4 text-sm text-gray-500">${part.responsible_user}</td>
-                                    <td class="px-6 py-4 flex items-center justify-end gap-x-4">${editBtn} ${qrBtn} ${deleteBtn}</td>
-                                </tr>`;
-                        }).join('');
-                        
-                        contentCell.innerHTML = `
-                            <table class="min-w-full details-table">
-                                <thead class="bg-gray-100">
-                                    <tr>
-                                        <th class="px-6 py-3 w-12"><input type="checkbox" class="select-all-parts rounded border-gray-300" title="Выбрать все"></th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Обозначение</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Наименование</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Размер</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Материал</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Маршрут</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Прогресс (шт.)</th>
-                                        <th class="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase">Ответственный</th>
-                                        <th class="px-6 py-3"></th>
-                                    </tr>
-                                </thead>
-                                <tbody class="bg-white divide-y divide-gray-200">${rowsHtml}</tbody>
-                            </table>`;
-                    }
                     detailsCache[productDesignation] = contentCell.innerHTML;
+                    if (tbody) detailsTokens[productDesignation] = firstToken;
                 } catch (error) {
                     console.error('Ошибка загрузки деталей:', error);
                     contentCell.innerHTML = '<div class="p-8 text-center text-red-500">Ошибка загрузки. Попробуйте обновить страницу.</div>';
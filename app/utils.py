@@ -1,3 +1,4 @@
+import importlib.util
 import os
 import re
 import qrcode
@@ -5,6 +6,8 @@ from io import BytesIO
 import base64
 import urllib.parse
 
+from flask import current_app, jsonify
+
 def create_safe_file_name(name):
     """
     Создает безопасное имя файла, заменяя недопустимые для Windows/Linux символы.
@@ -67,4 +70,23 @@ def to_safe_key(text):
     }
     for char, repl in translit.items():
         text = text.replace(char, repl)
-    return re.sub(r'[^a-z0-9]+', '_', text).strip('_')
\ No newline at end of file
+    return re.sub(r'[^a-z0-9]+', '_', text).strip('_')
+
+
+# Быстрая сериализация JSON требует необязательной зависимости orjson;
+# наличие пакета проверяется один раз при импорте модуля
+ORJSON_AVAILABLE = importlib.util.find_spec('orjson') is not None
+
+
+def json_response(payload, status=200):
+    """
+    JSON-ответ для больших списков. При установленном orjson и включенном
+    FAST_JSON сериализует через orjson (в несколько раз быстрее стандартного
+    json), иначе - через jsonify.
+    """
+    if not (ORJSON_AVAILABLE and current_app.config.get('FAST_JSON', True)):
+        response = jsonify(payload)
+        response.status_code = status
+        return response
+    import orjson
+    return current_app.response_class(orjson.dumps(payload), status=status, mimetype='application/json')
@@ -21,6 +21,26 @@ class Config:
     # --- Статические настройки приложения ---
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+    # Помесячное секционирование StatusHistory и AuditLogs (только PostgreSQL).
+    # Учитывается миграцией при создании схемы; SQLite всегда работает с одной таблицей.
+    HISTORY_PARTITIONING = os.environ.get('HISTORY_PARTITIONING', '').lower() in ('1', 'true', 'yes')
+
+    # Кэш сериализованных списков деталей: число страниц в памяти процесса
+    # и необязательный общий кэш Redis (например, redis://localhost:6379/0)
+    PARTS_CACHE_SIZE = int(os.environ.get('PARTS_CACHE_SIZE', 256))
+    PARTS_CACHE_URL = os.environ.get('PARTS_CACHE_URL')
+
+    # Сериализация больших JSON-списков через orjson, если пакет установлен
+    FAST_JSON = os.environ.get('FAST_JSON', '1').lower() in ('1', 'true', 'yes')
+
+    # Сколько секунд хранится результат запроса с ключом идемпотентности
+    IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', 86400))
+
+    # Токены терминалов сбора данных для JSON API подтверждений (через запятую).
+    # Терминал передает токен в заголовке Authorization: Bearer <токен>
+    SCANNER_API_TOKENS = [token.strip() for token in os.environ.get('SCANNER_API_TOKENS', '').split(',')
+                          if token.strip()]
+
 
 class DevelopmentConfig(Config):
     """
@@ -44,6 +64,7 @@ class TestingConfig(Config):
     SERVER_NAME = 'localhost.localdomain' # Для корректной генерации URL в тестах
     WTF_CSRF_ENABLED = False # Отключаем CSRF-защиту для упрощения тестов
     SECRET_KEY = 'a-secret-key-for-testing-purposes' # Используем постоянный ключ
+    SCANNER_API_TOKENS = ['test-scanner-token'] # Токен тестового терминала сбора данных
 
 
 class ProductionConfig(Config):
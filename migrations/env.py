@@ -1,4 +1,5 @@
 import logging
+import re
 from logging.config import fileConfig
 
 from flask import current_app
@@ -51,6 +52,25 @@ def get_metadata():
     return target_db.metadata
 
 
+# Секции StatusHistory и AuditLogs (миграция e6a3c1f9b528, `flask partitions`)
+# и индексы по id, заменяющие на секционированных таблицах первичный ключ
+PARTITION_TABLE_RE = re.compile(r'^(StatusHistory|AuditLogs)_(\d{4}_\d{2}|default)$')
+PARTITION_ID_INDEXES = {'ix_StatusHistory_id', 'ix_AuditLogs_id'}
+
+
+def include_name(name, type_, parent_names):
+    """
+    Поисковый индекс деталей (таблица FTS5 со служебными таблицами и
+    GIN-индекс pg_trgm) создается вручную и не сравнивается с моделями.
+    Секции истории и их индексы по id тоже создаются вне моделей.
+    """
+    if type_ == 'table':
+        return not name.startswith('PartsSearch') and not PARTITION_TABLE_RE.match(name)
+    if type_ == 'index':
+        return name != 'ix_Parts_search_trgm' and name not in PARTITION_ID_INDEXES
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -93,6 +113,8 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    if conf_args.get("include_name") is None:
+        conf_args["include_name"] = include_name
 
     connectable = get_engine()
 
@@ -0,0 +1,28 @@
+"""Extend the dashboard index on Parts with part_id for keyset pagination.
+
+Revision ID: 0a9e2b6c4d71
+Revises: f1c8d4a7e302
+Create Date: 2025-09-22 09:12:04.557813
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a9e2b6c4d71'
+down_revision = 'f1c8d4a7e302'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.drop_index('ix_Parts_product_designation_parent_pk')
+        batch_op.create_index('ix_Parts_product_designation_parent_pk_part_id', ['product_designation', 'parent_pk', 'part_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.drop_index('ix_Parts_product_designation_parent_pk_part_id')
+        batch_op.create_index('ix_Parts_product_designation_parent_pk', ['product_designation', 'parent_pk'], unique=False)
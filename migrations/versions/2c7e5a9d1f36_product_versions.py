@@ -0,0 +1,33 @@
+"""Per-product version counters for conditional GET.
+
+Revision ID: 2c7e5a9d1f36
+Revises: 0a9e2b6c4d71
+Create Date: 2025-09-23 14:05:51.902364
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2c7e5a9d1f36'
+down_revision = '0a9e2b6c4d71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ProductVersions',
+    sa.Column('product_designation', sa.String(), nullable=False),
+    sa.Column('version', sa.BigInteger(), server_default='1', nullable=False),
+    sa.PrimaryKeyConstraint('product_designation')
+    )
+    # Начальная версия для всех уже существующих изделий
+    op.execute(
+        'INSERT INTO "ProductVersions" (product_designation, version) '
+        'SELECT DISTINCT product_designation, 1 FROM "Parts"'
+    )
+
+
+def downgrade():
+    op.drop_table('ProductVersions')
@@ -0,0 +1,40 @@
+"""Add PartStageProgress table.
+
+Revision ID: 3c9e1f2a7b10
+Revises: 1a7614da432d
+Create Date: 2025-09-10 10:12:41.512309
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c9e1f2a7b10'
+down_revision = '1a7614da432d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('PartStageProgress',
+    sa.Column('part_id', sa.String(), nullable=False),
+    sa.Column('stage_id', sa.Integer(), nullable=False),
+    sa.Column('qty_done', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('last_timestamp', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['part_id'], ['Parts.part_id'], ),
+    sa.ForeignKeyConstraint(['stage_id'], ['Stages.id'], ),
+    sa.PrimaryKeyConstraint('part_id', 'stage_id')
+    )
+
+    # Заполняем прогресс из существующей истории (этапы сопоставляются по названию)
+    op.execute(
+        'INSERT INTO "PartStageProgress" (part_id, stage_id, qty_done, last_timestamp) '
+        'SELECT h.part_id, s.id, SUM(h.quantity), MAX(h.timestamp) '
+        'FROM "StatusHistory" h JOIN "Stages" s ON s.name = h.status '
+        'GROUP BY h.part_id, s.id'
+    )
+
+
+def downgrade():
+    op.drop_table('PartStageProgress')
@@ -0,0 +1,48 @@
+"""Part change versions and tombstones for the delta sync endpoint.
+
+Revision ID: 4e8b1d6a3c59
+Revises: 2c7e5a9d1f36
+Create Date: 2025-09-24 10:31:17.648203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4e8b1d6a3c59'
+down_revision = '2c7e5a9d1f36'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('change_version', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.create_index('ix_Parts_product_designation_change_version', ['product_designation', 'change_version'], unique=False)
+    # Существующие детали относятся к текущей версии своего изделия
+    op.execute(
+        'UPDATE "Parts" SET change_version = COALESCE((SELECT v.version FROM "ProductVersions" v '
+        'WHERE v.product_designation = "Parts".product_designation), 0)'
+    )
+
+    op.create_table('PartTombstones',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('product_designation', sa.String(), nullable=False),
+    sa.Column('part_id', sa.String(), nullable=False),
+    sa.Column('version', sa.BigInteger(), nullable=False),
+    sa.Column('deleted_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('PartTombstones', schema=None) as batch_op:
+        batch_op.create_index('ix_PartTombstones_product_designation_version', ['product_designation', 'version'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('PartTombstones', schema=None) as batch_op:
+        batch_op.drop_index('ix_PartTombstones_product_designation_version')
+    op.drop_table('PartTombstones')
+
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.drop_index('ix_Parts_product_designation_change_version')
+        batch_op.drop_column('change_version')
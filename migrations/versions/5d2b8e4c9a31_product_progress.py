@@ -0,0 +1,38 @@
+"""Add ProductProgress rollup table.
+
+Revision ID: 5d2b8e4c9a31
+Revises: 3c9e1f2a7b10
+Create Date: 2025-09-11 09:03:17.204518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2b8e4c9a31'
+down_revision = '3c9e1f2a7b10'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ProductProgress',
+    sa.Column('product_designation', sa.String(), nullable=False),
+    sa.Column('total_parts', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('total_quantity', sa.Integer(), server_default='0', nullable=False),
+    sa.Column('completed_quantity', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('product_designation')
+    )
+
+    # Заполняем сводку по существующим корневым деталям
+    op.execute(
+        'INSERT INTO "ProductProgress" (product_designation, total_parts, total_quantity, completed_quantity) '
+        'SELECT product_designation, COUNT(part_id), COALESCE(SUM(quantity_total), 0), '
+        'COALESCE(SUM(quantity_completed), 0) '
+        'FROM "Parts" WHERE parent_id IS NULL GROUP BY product_designation'
+    )
+
+
+def downgrade():
+    op.drop_table('ProductProgress')
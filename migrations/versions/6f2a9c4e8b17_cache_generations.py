@@ -0,0 +1,28 @@
+"""Generation counters for process-level caches.
+
+Revision ID: 6f2a9c4e8b17
+Revises: 4e8b1d6a3c59
+Create Date: 2025-09-25 13:22:40.118592
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f2a9c4e8b17'
+down_revision = '4e8b1d6a3c59'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('CacheGenerations',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('generation', sa.BigInteger(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('CacheGenerations')
@@ -0,0 +1,42 @@
+"""Add composite indexes for hot-path queries.
+
+Revision ID: 7a4f0c6d2e85
+Revises: 5d2b8e4c9a31
+Create Date: 2025-09-12 14:27:55.830146
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7a4f0c6d2e85'
+down_revision = '5d2b8e4c9a31'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.create_index('ix_StatusHistory_part_id_status', ['part_id', 'status'], unique=False)
+        batch_op.create_index('ix_StatusHistory_part_id_timestamp', ['part_id', 'timestamp'], unique=False)
+
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.create_index('ix_Parts_product_designation_parent_id', ['product_designation', 'parent_id'], unique=False)
+
+    with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+        batch_op.create_index('ix_AuditLogs_part_id_timestamp', ['part_id', 'timestamp'], unique=False)
+        batch_op.create_index('ix_AuditLogs_category_timestamp', ['category', 'timestamp'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('AuditLogs', schema=None) as batch_op:
+        batch_op.drop_index('ix_AuditLogs_category_timestamp')
+        batch_op.drop_index('ix_AuditLogs_part_id_timestamp')
+
+    with op.batch_alter_table('Parts', schema=None) as batch_op:
+        batch_op.drop_index('ix_Parts_product_designation_parent_id')
+
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.drop_index('ix_StatusHistory_part_id_timestamp')
+        batch_op.drop_index('ix_StatusHistory_part_id_status')
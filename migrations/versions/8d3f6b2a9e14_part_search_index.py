@@ -0,0 +1,69 @@
+"""Search index over Parts (FTS5 trigram on SQLite, pg_trgm GIN on PostgreSQL).
+
+Revision ID: 8d3f6b2a9e14
+Revises: 6f2a9c4e8b17
+Create Date: 2025-09-26 10:41:17.508263
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '8d3f6b2a9e14'
+down_revision = '6f2a9c4e8b17'
+branch_labels = None
+depends_on = None
+
+
+COLUMNS = 'part_id, name, material, product_designation'
+
+
+def _values(row):
+    return f'{row}.id, {row}.part_id, {row}.name, {row}.material, {row}.product_designation'
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        op.execute(
+            """CREATE INDEX IF NOT EXISTS "ix_Parts_search_trgm" ON "Parts" USING gin ("""
+            """(part_id || ' ' || name || ' ' || material || ' ' || product_designation) gin_trgm_ops)"""
+        )
+        return
+    if dialect != 'sqlite':
+        return
+
+    op.execute(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS PartsSearch USING fts5("
+        f"{COLUMNS}, content='Parts', content_rowid='id', tokenize='trigram')"
+    )
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS Parts_search_insert AFTER INSERT ON Parts BEGIN "
+        f"INSERT INTO PartsSearch(rowid, {COLUMNS}) VALUES ({_values('new')}); END"
+    )
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS Parts_search_delete AFTER DELETE ON Parts BEGIN "
+        f"INSERT INTO PartsSearch(PartsSearch, rowid, {COLUMNS}) VALUES ('delete', {_values('old')}); END"
+    )
+    op.execute(
+        f"CREATE TRIGGER IF NOT EXISTS Parts_search_update AFTER UPDATE OF {COLUMNS} ON Parts BEGIN "
+        f"INSERT INTO PartsSearch(PartsSearch, rowid, {COLUMNS}) VALUES ('delete', {_values('old')}); "
+        f"INSERT INTO PartsSearch(rowid, {COLUMNS}) VALUES ({_values('new')}); END"
+    )
+    # Индекс внешней таблицы строится по уже существующим деталям
+    op.execute("INSERT INTO PartsSearch(PartsSearch) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # Расширение pg_trgm может использоваться другими объектами и не удаляется
+        op.execute('DROP INDEX IF EXISTS "ix_Parts_search_trgm"')
+        return
+    if dialect != 'sqlite':
+        return
+
+    for trigger in ('Parts_search_insert', 'Parts_search_delete', 'Parts_search_update'):
+        op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+    op.execute('DROP TABLE IF EXISTS PartsSearch')
@@ -0,0 +1,162 @@
+"""Integer surrogate primary key for Parts.
+
+Revision ID: 9b1d3e5f7a20
+Revises: 7a4f0c6d2e85
+Create Date: 2025-09-15 11:40:08.371925
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9b1d3e5f7a20'
+down_revision = '7a4f0c6d2e85'
+branch_labels = None
+depends_on = None
+
+
+# Таблицы, ссылающиеся на деталь, и индексы по старому строковому ключу
+CHILD_TABLES = {
+    'StatusHistory': ['ix_StatusHistory_part_id_status', 'ix_StatusHistory_part_id_timestamp'],
+    'PartNotes': ['ix_PartNotes_part_id'],
+    'ResponsibleHistory': ['ix_ResponsibleHistory_part_id'],
+    'PartStageProgress': [],
+}
+
+
+# Имена безымянных ограничений из начальной миграции совпадают с именами,
+# которые по умолчанию дает PostgreSQL. Для SQLite (batch-режим) те же имена
+# назначаются отраженным ограничениям через naming_convention.
+NAMING_CONVENTION = {
+    'pk': '%(table_name)s_pkey',
+    'fk': '%(table_name)s_%(column_0_name)s_fkey',
+}
+
+
+def _is_postgresql():
+    return op.get_bind().dialect.name == 'postgresql'
+
+
+def upgrade():
+    postgresql = _is_postgresql()
+
+    # 1. Новый суррогатный ключ Parts.id, заполненный для существующих строк
+    if postgresql:
+        op.execute('ALTER TABLE "Parts" ADD COLUMN id SERIAL')
+    else:
+        with op.batch_alter_table('Parts', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.add_column(sa.Column('id', sa.Integer(), nullable=True))
+        op.execute('UPDATE "Parts" SET id = rowid')
+
+    # 2. Новые целочисленные внешние ключи, заполненные по бизнес-ключу
+    with op.batch_alter_table('Parts', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.add_column(sa.Column('parent_pk', sa.Integer(), nullable=True))
+    op.execute(
+        'UPDATE "Parts" SET parent_pk = '
+        '(SELECT p.id FROM "Parts" p WHERE p.part_id = "Parts".parent_id)'
+    )
+    for table in CHILD_TABLES:
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.add_column(sa.Column('part_pk', sa.Integer(), nullable=True))
+        op.execute(
+            f'UPDATE "{table}" SET part_pk = '
+            f'(SELECT p.id FROM "Parts" p WHERE p.part_id = "{table}".part_id)'
+        )
+
+    # 3. Удаляем старые строковые внешние ключи и индексы
+    for table, indexes in CHILD_TABLES.items():
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            for index_name in indexes:
+                batch_op.drop_index(index_name)
+            batch_op.drop_constraint(f'{table}_part_id_fkey', type_='foreignkey')
+            if table == 'PartStageProgress':
+                batch_op.drop_constraint('PartStageProgress_pkey', type_='primary')
+            batch_op.drop_column('part_id')
+            batch_op.alter_column('part_pk', existing_type=sa.Integer(), nullable=False)
+
+    with op.batch_alter_table('Parts', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_index('ix_Parts_product_designation_parent_id')
+        batch_op.drop_index('ix_Parts_parent_id')
+        batch_op.drop_constraint('Parts_parent_id_fkey', type_='foreignkey')
+        batch_op.drop_constraint('Parts_pkey', type_='primary')
+        batch_op.drop_column('parent_id')
+        batch_op.alter_column('id', existing_type=sa.Integer(), nullable=False)
+        batch_op.create_primary_key('Parts_pkey', ['id'])
+        batch_op.create_unique_constraint('uq_Parts_part_id', ['part_id'])
+        batch_op.create_foreign_key('Parts_parent_pk_fkey', 'Parts', ['parent_pk'], ['id'])
+        batch_op.create_index(batch_op.f('ix_Parts_parent_pk'), ['parent_pk'], unique=False)
+        batch_op.create_index('ix_Parts_product_designation_parent_pk', ['product_designation', 'parent_pk'], unique=False)
+
+    # 4. Новые внешние ключи на Parts.id и индексы по ним
+    for table in CHILD_TABLES:
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.create_foreign_key(f'{table}_part_pk_fkey', 'Parts', ['part_pk'], ['id'])
+    with op.batch_alter_table('PartStageProgress', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_primary_key('PartStageProgress_pkey', ['part_pk', 'stage_id'])
+    with op.batch_alter_table('StatusHistory', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_index('ix_StatusHistory_part_pk_status', ['part_pk', 'status'], unique=False)
+        batch_op.create_index('ix_StatusHistory_part_pk_timestamp', ['part_pk', 'timestamp'], unique=False)
+    with op.batch_alter_table('PartNotes', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_index(batch_op.f('ix_PartNotes_part_pk'), ['part_pk'], unique=False)
+    with op.batch_alter_table('ResponsibleHistory', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ResponsibleHistory_part_pk'), ['part_pk'], unique=False)
+
+
+def downgrade():
+    # 1. Возвращаем строковые ключи и заполняем их по Parts.id
+    with op.batch_alter_table('Parts', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.add_column(sa.Column('parent_id', sa.String(), nullable=True))
+    op.execute(
+        'UPDATE "Parts" SET parent_id = '
+        '(SELECT p.part_id FROM "Parts" p WHERE p.id = "Parts".parent_pk)'
+    )
+    for table in CHILD_TABLES:
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.add_column(sa.Column('part_id', sa.String(), nullable=True))
+        op.execute(
+            f'UPDATE "{table}" SET part_id = '
+            f'(SELECT p.part_id FROM "Parts" p WHERE p.id = "{table}".part_pk)'
+        )
+
+    # 2. Удаляем ссылки на суррогатный ключ
+    for table in CHILD_TABLES:
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            if table == 'StatusHistory':
+                batch_op.drop_index('ix_StatusHistory_part_pk_status')
+                batch_op.drop_index('ix_StatusHistory_part_pk_timestamp')
+            elif table != 'PartStageProgress':
+                batch_op.drop_index(batch_op.f(f'ix_{table}_part_pk'))
+            else:
+                batch_op.drop_constraint('PartStageProgress_pkey', type_='primary')
+            batch_op.drop_constraint(f'{table}_part_pk_fkey', type_='foreignkey')
+            batch_op.drop_column('part_pk')
+            batch_op.alter_column('part_id', existing_type=sa.String(), nullable=False)
+
+    # 3. Строковый первичный ключ Parts.part_id
+    with op.batch_alter_table('Parts', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.drop_index('ix_Parts_product_designation_parent_pk')
+        batch_op.drop_index(batch_op.f('ix_Parts_parent_pk'))
+        batch_op.drop_constraint('Parts_parent_pk_fkey', type_='foreignkey')
+        batch_op.drop_constraint('uq_Parts_part_id', type_='unique')
+        batch_op.drop_constraint('Parts_pkey', type_='primary')
+        batch_op.drop_column('parent_pk')
+        batch_op.drop_column('id')
+        batch_op.create_primary_key('Parts_pkey', ['part_id'])
+        batch_op.create_foreign_key('Parts_parent_id_fkey', 'Parts', ['parent_id'], ['part_id'])
+        batch_op.create_index(batch_op.f('ix_Parts_parent_id'), ['parent_id'], unique=False)
+        batch_op.create_index('ix_Parts_product_designation_parent_id', ['product_designation', 'parent_id'], unique=False)
+
+    # 4. Строковые внешние ключи и индексы дочерних таблиц
+    for table in CHILD_TABLES:
+        with op.batch_alter_table(table, schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+            batch_op.create_foreign_key(f'{table}_part_id_fkey', 'Parts', ['part_id'], ['part_id'])
+    with op.batch_alter_table('PartStageProgress', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_primary_key('PartStageProgress_pkey', ['part_id', 'stage_id'])
+    with op.batch_alter_table('StatusHistory', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_index('ix_StatusHistory_part_id_status', ['part_id', 'status'], unique=False)
+        batch_op.create_index('ix_StatusHistory_part_id_timestamp', ['part_id', 'timestamp'], unique=False)
+    with op.batch_alter_table('PartNotes', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_index(batch_op.f('ix_PartNotes_part_id'), ['part_id'], unique=False)
+    with op.batch_alter_table('ResponsibleHistory', schema=None, naming_convention=NAMING_CONVENTION) as batch_op:
+        batch_op.create_index(batch_op.f('ix_ResponsibleHistory_part_id'), ['part_id'], unique=False)
@@ -0,0 +1,37 @@
+"""Idempotency keys for stage confirmations.
+
+Revision ID: a5c7e9f1b3d8
+Revises: 8d3f6b2a9e14
+Create Date: 2025-09-29 09:12:55.371046
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5c7e9f1b3d8'
+down_revision = '8d3f6b2a9e14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('IdempotencyKeys',
+    sa.Column('scope', sa.String(length=50), nullable=False),
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('fingerprint', sa.String(length=40), nullable=False),
+    sa.Column('status_code', sa.SmallInteger(), server_default='200', nullable=False),
+    sa.Column('response', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('scope', 'key')
+    )
+    with op.batch_alter_table('IdempotencyKeys', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_IdempotencyKeys_created_at'), ['created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('IdempotencyKeys', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_IdempotencyKeys_created_at'))
+
+    op.drop_table('IdempotencyKeys')
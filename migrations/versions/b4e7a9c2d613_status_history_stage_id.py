@@ -0,0 +1,41 @@
+"""Add StatusHistory.stage_id.
+
+Revision ID: b4e7a9c2d613
+Revises: 9b1d3e5f7a20
+Create Date: 2025-09-16 09:25:47.602118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e7a9c2d613'
+down_revision = '9b1d3e5f7a20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stage_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('StatusHistory_stage_id_fkey', 'Stages', ['stage_id'], ['id'])
+
+    # Сопоставляем существующие записи со справочником этапов по названию.
+    # Записи с названиями, которых уже нет в справочнике, остаются с NULL.
+    op.execute(
+        'UPDATE "StatusHistory" SET stage_id = '
+        '(SELECT s.id FROM "Stages" s WHERE s.name = "StatusHistory".status)'
+    )
+
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.drop_index('ix_StatusHistory_part_pk_status')
+        batch_op.create_index('ix_StatusHistory_part_pk_stage_id', ['part_pk', 'stage_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.drop_index('ix_StatusHistory_part_pk_stage_id')
+        batch_op.create_index('ix_StatusHistory_part_pk_status', ['part_pk', 'status'], unique=False)
+        batch_op.drop_constraint('StatusHistory_stage_id_fkey', type_='foreignkey')
+        batch_op.drop_column('stage_id')
@@ -0,0 +1,46 @@
+"""Add PartClosure table.
+
+Revision ID: d2f5b8e1c947
+Revises: b4e7a9c2d613
+Create Date: 2025-09-17 14:03:12.884150
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2f5b8e1c947'
+down_revision = 'b4e7a9c2d613'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('PartClosure',
+    sa.Column('ancestor_pk', sa.Integer(), nullable=False),
+    sa.Column('descendant_pk', sa.Integer(), nullable=False),
+    sa.Column('depth', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['ancestor_pk'], ['Parts.id'], ),
+    sa.ForeignKeyConstraint(['descendant_pk'], ['Parts.id'], ),
+    sa.PrimaryKeyConstraint('ancestor_pk', 'descendant_pk')
+    )
+    with op.batch_alter_table('PartClosure', schema=None) as batch_op:
+        batch_op.create_index('ix_PartClosure_descendant_pk_depth', ['descendant_pk', 'depth'], unique=False)
+
+    # Заполняем замыкание из существующих ссылок parent_pk рекурсивным запросом
+    op.execute(
+        'INSERT INTO "PartClosure" (ancestor_pk, descendant_pk, depth) '
+        'WITH RECURSIVE tree(ancestor_pk, descendant_pk, depth) AS ('
+        'SELECT id, id, 0 FROM "Parts" '
+        'UNION ALL '
+        'SELECT t.ancestor_pk, p.id, t.depth + 1 FROM tree t JOIN "Parts" p ON p.parent_pk = t.descendant_pk'
+        ') SELECT ancestor_pk, descendant_pk, depth FROM tree'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('PartClosure', schema=None) as batch_op:
+        batch_op.drop_index('ix_PartClosure_descendant_pk_depth')
+
+    op.drop_table('PartClosure')
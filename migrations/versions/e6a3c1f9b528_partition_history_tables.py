@@ -0,0 +1,130 @@
+"""Monthly range partitioning of StatusHistory and AuditLogs (PostgreSQL).
+
+Revision ID: e6a3c1f9b528
+Revises: d2f5b8e1c947
+Create Date: 2025-09-18 16:47:30.215634
+
+"""
+from datetime import date
+
+from alembic import op
+import sqlalchemy as sa
+from flask import current_app
+
+
+# revision identifiers, used by Alembic.
+revision = 'e6a3c1f9b528'
+down_revision = 'd2f5b8e1c947'
+branch_labels = None
+depends_on = None
+
+
+# Индексы и внешние ключи, которые пересоздаются на секционированной таблице
+TABLES = {
+    'StatusHistory': {
+        'indexes': {
+            'ix_StatusHistory_timestamp': '"timestamp"',
+            'ix_StatusHistory_part_pk_stage_id': 'part_pk, stage_id',
+            'ix_StatusHistory_part_pk_timestamp': 'part_pk, "timestamp"',
+        },
+        'foreign_keys': {
+            'StatusHistory_part_pk_fkey': ('part_pk', '"Parts" (id)'),
+            'StatusHistory_stage_id_fkey': ('stage_id', '"Stages" (id)'),
+        },
+    },
+    'AuditLogs': {
+        'indexes': {
+            'ix_AuditLogs_timestamp': '"timestamp"',
+            'ix_AuditLogs_part_id_timestamp': 'part_id, "timestamp"',
+            'ix_AuditLogs_category_timestamp': 'category, "timestamp"',
+        },
+        'foreign_keys': {
+            'AuditLogs_user_id_fkey': ('user_id', '"Users" (id)'),
+        },
+    },
+}
+
+# Сколько месяцев вперед создаются секции при миграции (далее - `flask partitions create`)
+MONTHS_AHEAD = 3
+
+
+def _add_months(day, months):
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def _is_partitioned(table):
+    return op.get_bind().execute(sa.text(
+        'SELECT 1 FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid '
+        'WHERE c.relname = :table'
+    ), {'table': table}).first() is not None
+
+
+def _create_indexes_and_foreign_keys(table, spec):
+    for name, columns in spec['indexes'].items():
+        op.execute(f'CREATE INDEX "{name}" ON "{table}" ({columns})')
+    for name, (column, target) in spec['foreign_keys'].items():
+        op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" FOREIGN KEY ({column}) REFERENCES {target}')
+
+
+def upgrade():
+    # Режим включается явно; SQLite и PostgreSQL без HISTORY_PARTITIONING не затрагиваются
+    if op.get_bind().dialect.name != 'postgresql' or not current_app.config.get('HISTORY_PARTITIONING'):
+        return
+
+    today = date.today()
+    for table, spec in TABLES.items():
+        old_table = f'{table}_unpartitioned'
+        op.execute(f'ALTER TABLE "{table}" RENAME TO "{old_table}"')
+        for name in spec['indexes']:
+            op.execute(f'DROP INDEX "{name}"')
+
+        # PostgreSQL требует включать ключ секционирования в первичный ключ,
+        # поэтому вместо PRIMARY KEY (id) на секциях строится обычный индекс по id
+        op.execute(
+            f'CREATE TABLE "{table}" (LIKE "{old_table}" INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE ("timestamp")'
+        )
+        op.execute(f'ALTER SEQUENCE "{table}_id_seq" OWNED BY "{table}".id')
+        op.execute(f'CREATE INDEX "ix_{table}_id" ON "{table}" (id)')
+        _create_indexes_and_foreign_keys(table, spec)
+
+        # Секции от самого старого месяца с данными до MONTHS_AHEAD месяцев вперед.
+        # Секция по умолчанию принимает строки без даты и за пределами диапазона.
+        oldest = op.get_bind().execute(sa.text(f'SELECT MIN("timestamp") FROM "{old_table}"')).scalar()
+        month = date(oldest.year, oldest.month, 1) if oldest else date(today.year, today.month, 1)
+        last_month = _add_months(date(today.year, today.month, 1), MONTHS_AHEAD)
+        while month <= last_month:
+            op.execute(
+                f'CREATE TABLE "{table}_{month:%Y_%m}" PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_add_months(month, 1).isoformat()}')"
+            )
+            month = _add_months(month, 1)
+        op.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+
+        op.execute(f'INSERT INTO "{table}" SELECT * FROM "{old_table}"')
+        op.execute(f'DROP TABLE "{old_table}"')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table, spec in TABLES.items():
+        if not _is_partitioned(table):
+            continue
+        partitioned_table = f'{table}_partitioned'
+        op.execute(f'ALTER TABLE "{table}" RENAME TO "{partitioned_table}"')
+        op.execute(f'DROP INDEX "ix_{table}_id"')
+        for name in spec['indexes']:
+            op.execute(f'DROP INDEX "{name}"')
+
+        op.execute(f'CREATE TABLE "{table}" (LIKE "{partitioned_table}" INCLUDING DEFAULTS)')
+        op.execute(f'ALTER SEQUENCE "{table}_id_seq" OWNED BY "{table}".id')
+        op.execute(f'INSERT INTO "{table}" SELECT * FROM "{partitioned_table}"')
+        op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY (id)')
+        _create_indexes_and_foreign_keys(table, spec)
+
+        # Вместе с родительской таблицей удаляются присоединенные секции;
+        # ранее отсоединенные (архивные) секции остаются отдельными таблицами
+        op.execute(f'DROP TABLE "{partitioned_table}"')
@@ -0,0 +1,70 @@
+"""Add Operators table and StatusHistory.operator_id.
+
+Revision ID: f1c8d4a7e302
+Revises: e6a3c1f9b528
+Create Date: 2025-09-19 10:31:55.410672
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1c8d4a7e302'
+down_revision = 'e6a3c1f9b528'
+branch_labels = None
+depends_on = None
+
+
+def _normalize_name(name):
+    # Совпадает с operator_service.normalize_name. Нормализация выполняется
+    # в Python: lower() в SQLite не работает с кириллицей.
+    return ' '.join(name.split()).casefold()
+
+
+def upgrade():
+    op.create_table('Operators',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('normalized_name', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('Operators', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_Operators_normalized_name'), ['normalized_name'], unique=True)
+
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('operator_id', sa.Integer(), nullable=True))
+        batch_op.create_foreign_key('StatusHistory_operator_id_fkey', 'Operators', ['operator_id'], ['id'])
+        batch_op.create_index(batch_op.f('ix_StatusHistory_operator_id'), ['operator_id'], unique=False)
+
+    # Справочник из уже введенных имен: варианты написания одного имени
+    # (регистр, пробелы) сводятся к одному оператору
+    bind = op.get_bind()
+    operators = sa.table('Operators', sa.column('id', sa.Integer), sa.column('name', sa.String),
+                         sa.column('normalized_name', sa.String))
+    history = sa.table('StatusHistory', sa.column('operator_id', sa.Integer), sa.column('operator_name', sa.String))
+
+    names = bind.execute(sa.select(history.c.operator_name).distinct()).scalars().all()
+    operator_ids = {}
+    for name in sorted(names):
+        normalized = _normalize_name(name)
+        if normalized not in operator_ids:
+            operator_ids[normalized] = bind.execute(
+                operators.insert().values(name=' '.join(name.split()), normalized_name=normalized)
+                .returning(operators.c.id)
+            ).scalar()
+        bind.execute(
+            history.update().where(history.c.operator_name == name).values(operator_id=operator_ids[normalized])
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('StatusHistory', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_StatusHistory_operator_id'))
+        batch_op.drop_constraint('StatusHistory_operator_id_fkey', type_='foreignkey')
+        batch_op.drop_column('operator_id')
+
+    with op.batch_alter_table('Operators', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_Operators_normalized_name'))
+
+    op.drop_table('Operators')
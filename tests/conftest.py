@@ -4,7 +4,9 @@
 import pytest
 import sys
 import os
+from contextlib import contextmanager
 from flask import url_for
+from sqlalchemy import event
 
 # Добавляем корневую папку проекта в путь Python, чтобы импорты работали
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -12,6 +14,26 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 from app import create_app, db
 from config import TestingConfig
 from app.models.models import User, Stage, RouteTemplate, RouteStage, Part, Role
+from app.services import progress_service, hierarchy_service, operator_service, cache_service, route_service
+
+
+def pytest_addoption(parser):
+    parser.addoption('--benchmark', action='store_true', default=False,
+                     help="запускать замеры скорости (тесты с меткой benchmark)")
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', "benchmark: замер скорости без проверок, запускается с --benchmark")
+
+
+def pytest_collection_modifyitems(config, items):
+    """Замеры скорости зависят от машины и ничего не проверяют, поэтому по умолчанию пропускаются."""
+    if config.getoption('--benchmark'):
+        return
+    skip = pytest.mark.skip(reason="замер скорости, запуск с --benchmark")
+    for item in items:
+        if 'benchmark' in item.keywords:
+            item.add_marker(skip)
 
 
 @pytest.fixture(scope='module')
@@ -29,6 +51,14 @@ def client(app):
     return app.test_client()
 
 
+@pytest.fixture(scope='module')
+def scanner_client(app):
+    """Тестовый клиент терминала сбора данных с токеном JSON API подтверждений."""
+    scanner = app.test_client()
+    scanner.environ_base['HTTP_AUTHORIZATION'] = f"Bearer {TestingConfig.SCANNER_API_TOKENS[0]}"
+    return scanner
+
+
 @pytest.fixture(scope='function')
 def database(app):
     """
@@ -80,11 +110,39 @@ def database(app):
 
         db.session.add_all([rs1, rs2, rs3, part1])
         db.session.commit()
+        progress_service.rebuild_product_progress()
+        hierarchy_service.rebuild_part_closure()
         
         yield db
         
         db.session.remove()
         db.drop_all()
+        operator_service.clear_cache()
+        route_service.clear_cache()
+        cache_service.get_cache().clear()
+
+
+@pytest.fixture
+def sql_statements(app):
+    """
+    Перехват SQL-запросов к базе: `with sql_statements() as statements:`
+    собирает тексты всех запросов, выполненных внутри блока. С параметром
+    with_parameters=True собираются пары (запрос, параметры).
+    """
+    @contextmanager
+    def capture(with_parameters=False):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters) if with_parameters else statement)
+
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+
+    return capture
 
 
 @pytest.fixture(scope='function')
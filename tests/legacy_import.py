@@ -0,0 +1,91 @@
+# tests/legacy_import.py
+
+"""
+Прежний построчный импорт деталей из файла. Используется только для замера
+скорости в tests/test_performance.py: два прохода iterrows, ORM-объект,
+запрос существования и запись AuditLog на каждую строку.
+"""
+
+import pandas as pd
+
+from app import db
+from app.models.models import AuditLog, Part, RouteStage, RouteTemplate, Stage
+from app.services import hierarchy_service, progress_service, route_service
+
+
+def _route_from_operations(operations_str):
+    """Запрос маршрута на строку и ILIKE на каждую операцию нового маршрута."""
+    operations = [op.strip() for op in operations_str.split(',') if op.strip()]
+    if not operations:
+        return RouteTemplate.query.filter_by(is_default=True).first()
+    route_name = " -> ".join(operations)
+    route = RouteTemplate.query.filter_by(name=route_name).first()
+    if route:
+        return route
+    route = RouteTemplate(name=route_name, is_default=False)
+    db.session.add(route)
+    db.session.flush()
+    for i, op_name in enumerate(operations):
+        stage = Stage.query.filter(Stage.name.ilike(op_name)).first()
+        if not stage:
+            stage = Stage(name=op_name)
+            db.session.add(stage)
+            db.session.flush()
+        db.session.add(RouteStage(template_id=route.id, stage_id=stage.id, order=i))
+    route_service.invalidate()
+    return route
+
+
+def import_parts_row_by_row(file_storage, user):
+    """Импортирует спецификацию CSV построчно и возвращает число добавленных деталей."""
+    df = pd.read_csv(file_storage, header=None, dtype=str, skip_blank_lines=True)
+    df.dropna(how='all', inplace=True)
+    header_row_index = next(i for i, row in df.iterrows() if any("Обозначение" in str(cell) for cell in row.values))
+    product = str(df.iloc[0, 0]).strip()
+    df.columns = [str(col).strip() for col in df.iloc[header_row_index].values]
+    df = df.iloc[header_row_index + 1:].reset_index(drop=True)
+    default_route = RouteTemplate.query.filter_by(is_default=True).first()
+    added = 0
+
+    new_parents = []
+    for _, row in df.iterrows():
+        part_id, name = str(row.get("Обозначение", "")).strip(), str(row.get("Наименование", "")).strip()
+        if part_id and (not name or name.lower() == 'nan') and not Part.query.filter_by(part_id=part_id).first():
+            parent = Part(part_id=part_id, product_designation=product, name=f"Сборка {part_id}", material="Сборка",
+                          quantity_total=1, route_template_id=default_route.id)
+            db.session.add(parent)
+            new_parents.append(parent)
+            progress_service.track_part_in_product_progress(parent)
+            db.session.add(AuditLog(part_id=part_id, user_id=user.id, action="Создание", details="", category='part'))
+            added += 1
+    hierarchy_service.add_parts_to_hierarchy(new_parents)
+    progress_service.touch_parts(new_parents)
+    db.session.commit()
+
+    parent, new_parts = None, []
+    for _, row in df.iterrows():
+        part_id, name = str(row.get("Обозначение", "")).strip(), str(row.get("Наименование", "")).strip()
+        if part_id and (not name or name.lower() == 'nan'):
+            parent = Part.query.filter_by(part_id=part_id).first()
+            continue
+        if Part.query.filter_by(part_id=part_id).first():
+            continue
+        quantity_str = str(row.get("Кол-во", "1")).strip()
+        try:
+            quantity = int(float(quantity_str)) if quantity_str and quantity_str.lower() != 'nan' else 1
+        except (ValueError, TypeError):
+            quantity = 1
+        operations = str(row.get("Операции", "")).strip()
+        part = Part(part_id=part_id, product_designation=product, name=name, quantity_total=quantity,
+                    size=str(row.get("Размер", "")).strip(), material=str(row.get("Прим.", "")).strip(),
+                    route_template_id=_route_from_operations(operations).id,
+                    parent=parent)
+        db.session.add(part)
+        new_parts.append(part)
+        progress_service.track_part_in_product_progress(part)
+        db.session.add(AuditLog(part_id=part_id, user_id=user.id, action="Создание", details="", category='part'))
+        added += 1
+    hierarchy_service.add_parts_to_hierarchy(new_parts)
+    progress_service.touch_parts(new_parts)
+    db.session.commit()
+    return added
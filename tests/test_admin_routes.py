@@ -6,7 +6,8 @@ from flask import url_for
 from io import BytesIO
 
 from app import db
-from app.models.models import Part, User, Stage, RouteTemplate, Role, Permission
+from app.models.models import Part, User, Stage, RouteTemplate, Role, Permission, StatusHistory
+from app.services import route_service
 
 
 class TestAdminCRUD:
@@ -67,6 +68,21 @@ class TestAdminCRUD:
         assert route_stages[0].stage_id == stage1.id
         assert route_stages[1].stage_id == stage2.id
 
+    def test_edit_route_invalidates_route_cache(self, auth_client, database):
+        """Тест: Изменение маршрута сразу видно в кэше этапов маршрутов."""
+        client = auth_client('admin')
+        route = RouteTemplate.query.filter_by(name='Стандартный маршрут').first()
+        stage1 = Stage.query.filter_by(name='Test Stage 1').first()
+        assert len(route_service.get_route_stages(route.id)) == 3
+
+        response = client.post(
+            url_for('admin.management.edit_route', route_id=route.id),
+            data={'name': route.name, 'is_default': 'y', 'stages': [stage1.id], 'csrf_token': 'fake-token'},
+            follow_redirects=True
+        )
+        assert response.status_code == 200
+        assert [rs.stage_id for rs in route_service.get_route_stages(route.id)] == [stage1.id]
+
     def test_create_part_with_quantity_and_drawing(self, auth_client, app, database):
         """Тест: Администратор может создать деталь с количеством и чертежом."""
         client = auth_client('admin')
@@ -93,7 +109,7 @@ class TestAdminCRUD:
         assert response.status_code == 200
         assert "Успешно добавлена деталь: DRAW-001" in response.data.decode('utf-8')
 
-        new_part = db.session.get(Part, 'DRAW-001')
+        new_part = Part.query.filter_by(part_id='DRAW-001').first()
         assert new_part is not None
         assert new_part.quantity_total == 50
         assert 'test_drawing.jpg' in new_part.drawing_filename
@@ -238,6 +254,26 @@ class TestAdminCRUD:
         assert 'Нельзя удалить этап, так как он используется' in response.data.decode('utf-8')
         assert Stage.query.count() == initial_stage_count
 
+    def test_delete_stage_present_in_history_fails(self, auth_client, database):
+        """Тест: Нельзя удалить этап, на который ссылается история детали."""
+        client = auth_client('admin')
+        stage = Stage(name='Этап из истории')
+        db.session.add(stage)
+        db.session.flush()
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        db.session.add(StatusHistory(part_pk=part.id, stage_id=stage.id, status=stage.name,
+                                     operator_name='Оператор', quantity=1))
+        db.session.commit()
+
+        response = client.post(
+            url_for('admin.management.delete_stage', stage_id=stage.id),
+            data={'csrf_token': 'fake-token'},
+            follow_redirects=True
+        )
+
+        assert 'Нельзя удалить этап, так как он присутствует в истории' in response.data.decode('utf-8')
+        assert db.session.get(Stage, stage.id) is not None
+
     def test_delete_route_used_by_part_fails(self, auth_client, database):
         """Тест: Нельзя удалить маршрут, который присвоен детали."""
         client = auth_client('admin')
@@ -271,6 +307,55 @@ class TestAdvancedFeatures:
         assert response_dur.status_code == 200
         assert response_dur.is_json
 
+    def test_report_date_range_includes_whole_last_day(self, auth_client, database):
+        """Тест: Граница "по" в отчетах и журнале аудита включает весь указанный день."""
+        from datetime import datetime
+        from app.models.models import AuditLog
+        from app.services import operator_service
+        client = auth_client('admin')
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        admin = User.query.filter_by(username='admin').first()
+        db.session.add_all([
+            StatusHistory(part_pk=part.id, status='Резка', operator_name='Вечерний оператор',
+                          operator_id=operator_service.resolve_operator_id('Вечерний оператор'),
+                          quantity=1, timestamp=datetime(2025, 9, 10, 18, 30)),
+            StatusHistory(part_pk=part.id, status='Резка', operator_name='Ранний оператор',
+                          operator_id=operator_service.resolve_operator_id('Ранний оператор'),
+                          quantity=1, timestamp=datetime(2025, 9, 9, 8, 0)),
+            AuditLog(part_id='TEST-001', user_id=admin.id, action='Генерация QR', details='В периоде',
+                     category='part', timestamp=datetime(2025, 9, 10, 23, 59)),
+            AuditLog(part_id='TEST-001', user_id=admin.id, action='Генерация QR', details='Вне периода',
+                     category='part', timestamp=datetime(2025, 9, 11, 0, 1)),
+        ])
+        db.session.commit()
+
+        response = client.get(url_for('admin.report.api_report_operator_performance',
+                                      date_from='2025-09-10', date_to='2025-09-10'))
+        assert response.get_json()['labels'] == ['Вечерний оператор']
+
+        response = client.get(url_for('admin.user.audit_log', date_from='2025-09-10', date_to='2025-09-10'))
+        page = response.data.decode('utf-8')
+        assert 'В периоде' in page
+        assert 'Вне периода' not in page
+
+    def test_audit_log_archive_view(self, app, auth_client, database, tmp_path, monkeypatch):
+        """Тест: Архивные записи журнала аудита показываются только в режиме архива."""
+        from datetime import datetime, timedelta
+        from app.models.models import AuditLog
+        from app.services import archive_service
+        monkeypatch.setitem(app.config, 'AUDIT_ARCHIVE_FOLDER', str(tmp_path))
+        client = auth_client('admin')
+        admin = User.query.filter_by(username='admin').first()
+        db.session.add(AuditLog(part_id='TEST-001', user_id=admin.id, action='Генерация QR', details='Давняя запись',
+                                category='part', timestamp=datetime.now() - timedelta(days=365)))
+        db.session.commit()
+        archive_service.archive_audit_logs(timedelta(days=90), str(tmp_path))
+
+        assert 'Давняя запись' not in client.get(url_for('admin.user.audit_log')).data.decode('utf-8')
+        page = client.get(url_for('admin.user.audit_log', archived=1)).data.decode('utf-8')
+        assert 'Давняя запись' in page
+        assert 'admin' in page
+
     def test_bulk_delete_action(self, auth_client, database):
         """Тест: Массовое удаление деталей работает корректно."""
         client = auth_client('admin')
@@ -297,8 +382,8 @@ class TestAdvancedFeatures:
         assert response.status_code == 200
         assert 'Успешно удалено 2 деталей.' in response.data.decode('utf-8')
 
-        assert db.session.get(Part, 'BULK-001') is None
-        assert db.session.get(Part, 'BULK-002') is None
+        assert Part.query.filter_by(part_id='BULK-001').first() is None
+        assert Part.query.filter_by(part_id='BULK-002').first() is None
 
 
 class TestHierarchyFeatures:
@@ -325,12 +410,12 @@ class TestHierarchyFeatures:
         assert response.status_code == 200
         assert 'Новый узел успешно добавлен' in response.data.decode('utf-8')
 
-        child_part = db.session.get(Part, 'CHILD-001')
+        child_part = Part.query.filter_by(part_id='CHILD-001').first()
         assert child_part is not None
         assert child_part.name == 'Дочерний узел'
         assert child_part.material == 'Алюминий'
         assert child_part.quantity_total == 2
-        assert child_part.parent_id == 'TEST-001'
+        assert child_part.parent.part_id == 'TEST-001'
 
     def test_delete_parent_part_cascades_to_children(self, auth_client, database):
         """Тест: Удаление родительской детали должно автоматически удалять все дочерние."""
@@ -339,13 +424,13 @@ class TestHierarchyFeatures:
         parent = Part(part_id='PARENT-CASCADE', product_designation='Родитель для удаления',
                       name='Родитель', material='Чугун')
         child = Part(part_id='CHILD-CASCADE', product_designation='Родитель для удаления',
-                     name='Дочерний', material='Чугун', parent_id='PARENT-CASCADE')
+                     name='Дочерний', material='Чугун', parent=parent)
 
         db.session.add_all([parent, child])
         db.session.commit()
 
-        assert db.session.get(Part, 'PARENT-CASCADE') is not None
-        assert db.session.get(Part, 'CHILD-CASCADE') is not None
+        assert Part.query.filter_by(part_id='PARENT-CASCADE').first() is not None
+        assert Part.query.filter_by(part_id='CHILD-CASCADE').first() is not None
 
         response = client.post(
             url_for('admin.part.delete_part', part_id='PARENT-CASCADE'),
@@ -355,5 +440,5 @@ class TestHierarchyFeatures:
         assert response.status_code == 200
         assert 'Деталь PARENT-CASCADE и вся ее история удалены' in response.data.decode('utf-8')
 
-        assert db.session.get(Part, 'PARENT-CASCADE') is None
-        assert db.session.get(Part, 'CHILD-CASCADE') is None
\ No newline at end of file
+        assert Part.query.filter_by(part_id='PARENT-CASCADE').first() is None
+        assert Part.query.filter_by(part_id='CHILD-CASCADE').first() is None
\ No newline at end of file
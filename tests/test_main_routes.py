@@ -1,6 +1,12 @@
+import re
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
 import pytest
 from flask import url_for
 from app.models.models import Part, User, Stage, RouteTemplate, StatusHistory, AuditLog, Role, Permission
+from app.models.models import IdempotencyKey, Operator, PartStageProgress
+from app.services import part_service, progress_service
 from app import db
 
 class TestCoreWorkflow:
@@ -8,7 +14,7 @@ class TestCoreWorkflow:
 
     def test_scan_and_confirm_stage_workflow(self, client, database):
         """Тест: Проверяет подтверждение этапа для детали."""
-        part = db.session.get(Part, 'TEST-001')
+        part = Part.query.filter_by(part_id='TEST-001').first()
         assert part.current_status == 'На складе'
         assert part.quantity_completed == 0
 
@@ -30,12 +36,12 @@ class TestCoreWorkflow:
         assert 'Статус для детали TEST-001 обновлен' in response.data.decode('utf-8')
 
         # Проверяем изменения в базе данных
-        part_after_stage1 = db.session.get(Part, 'TEST-001')
+        part_after_stage1 = Part.query.filter_by(part_id='TEST-001').first()
         assert part_after_stage1.current_status == 'Резка'
         # В нашей новой логике количество должно прибавляться, а не перезаписываться
         assert part_after_stage1.quantity_completed == 1
         
-        history_entry = StatusHistory.query.filter_by(part_id='TEST-001').first()
+        history_entry = StatusHistory.query.filter_by(part_pk=part.id).first()
         assert history_entry is not None
         assert history_entry.status == 'Резка'
         assert history_entry.operator_name == 'Тестовый Оператор'
@@ -50,4 +56,637 @@ class TestCoreWorkflow:
         assert 'Резка' in response_text # Проверяем, что предложен правильный следующий этап
         assert 'name="quantity"' in response_text
         assert 'name="operator_name"' in response_text
-        assert 'Все этапы завершены' not in response_text
\ No newline at end of file
+        assert 'Все этапы завершены' not in response_text
+
+    def test_confirm_stage_interns_operator(self, client, database):
+        """Тест: Варианты написания имени оператора сводятся к одной записи справочника."""
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        part.quantity_total = 5
+        db.session.commit()
+        stage = Stage.query.filter_by(name='Резка').first()
+        for operator_name in ('Иван  Петров', ' иван петров ', 'ИВАН ПЕТРОВ'):
+            client.post(
+                url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+                data={'operator_name': operator_name, 'quantity': 1, 'csrf_token': 'fake-token'}
+            )
+
+        operator = Operator.query.one()
+        assert operator.name == 'Иван Петров'
+        history = StatusHistory.query.filter_by(part_pk=part.id).all()
+        assert len(history) == 3
+        assert {h.operator_id for h in history} == {operator.id}
+
+    def test_confirm_and_cancel_update_stage_progress(self, client, database):
+        """Тест: Подтверждение и отмена этапа поддерживают таблицу PartStageProgress."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        for qty in (1, 2):
+            client.post(
+                url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+                data={'operator_name': 'Оператор', 'quantity': qty, 'csrf_token': 'fake-token'}
+            )
+        # Нельзя выполнить больше, чем осталось в партии (quantity_total = 1)
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        progress = db.session.get(PartStageProgress, (part.id, stage.id))
+        assert progress.qty_done == 1
+
+        history_entry = StatusHistory.query.filter_by(part_pk=part.id).first()
+        assert history_entry.stage_id == stage.id
+
+        # Переименование этапа не должно ломать отмену и откат прогресса
+        stage.name = 'Резка (лазер)'
+        db.session.commit()
+        admin = User.query.filter_by(username='admin').first()
+        _, cancelled_stage_name = part_service.cancel_stage_by_history_id(history_entry.id, admin)
+        assert cancelled_stage_name == 'Резка (лазер)'
+
+        progress = db.session.get(PartStageProgress, (part.id, stage.id))
+        assert progress.qty_done == 0
+        assert Part.query.filter_by(part_id='TEST-001').first().current_status == 'На складе'
+
+    def test_cancel_stage_locks_part_and_releases_once(self, client, auth_client, database, sql_statements):
+        """Тест: Отмена блокирует деталь, уменьшает счетчик условным UPDATE и не выполняется дважды."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        client.post(url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+                    data={'operator_name': 'Оператор', 'quantity': 1, 'csrf_token': 'fake-token'})
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        history_id = StatusHistory.query.filter_by(part_pk=part.id).one().id
+        admin = User.query.filter_by(username='admin').first()
+
+        with sql_statements() as statements:
+            part_service.cancel_stage_by_history_id(history_id, admin)
+        updates = [s for s in statements if s.startswith('UPDATE')]
+        assert 'UPDATE "Parts"' in updates[0]
+        assert 'UPDATE "PartStageProgress"' in updates[1] and '>=' in updates[1]
+        assert db.session.get(PartStageProgress, (part.id, stage.id)).qty_done == 0
+        assert part.quantity_completed == 0
+
+        response = auth_client().post(url_for('admin.part.cancel_stage', history_id=history_id), follow_redirects=True)
+        assert 'Ошибка при отмене этапа: Запись уже отменена.' in response.data.decode('utf-8')
+        assert db.session.get(PartStageProgress, (part.id, stage.id)).qty_done == 0
+
+    def test_concurrent_cancel_is_reported(self, client, auth_client, database):
+        """Тест: Если запись отменили параллельно, пока отмена ждала блокировку, пользователь видит сообщение."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        client.post(url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+                    data={'operator_name': 'Оператор', 'quantity': 1, 'csrf_token': 'fake-token'})
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        history_id = StatusHistory.query.filter_by(part_pk=part.id).one().id
+        lock_part = progress_service.lock_part
+
+        def lock_after_concurrent_cancel(locked_part):
+            # Параллельная отмена завершилась до получения блокировки
+            db.session.execute(db.delete(StatusHistory).where(StatusHistory.id == history_id))
+            lock_part(locked_part)
+
+        logged_in = auth_client()
+        with patch.object(progress_service, 'lock_part', side_effect=lock_after_concurrent_cancel):
+            response = logged_in.post(url_for('admin.part.cancel_stage', history_id=history_id),
+                                      follow_redirects=True)
+        assert 'Ошибка при отмене этапа: Запись уже отменена.' in response.data.decode('utf-8')
+        assert db.session.get(PartStageProgress, (part.id, stage.id)).qty_done == 1
+        assert AuditLog.query.filter_by(action="Отмена этапа").count() == 0
+
+    def test_cancel_stage_rejects_counter_below_history(self, client, database):
+        """Тест: Если счетчик этапа меньше отменяемого количества, отмена откатывается целиком."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        client.post(url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+                    data={'operator_name': 'Оператор', 'quantity': 1, 'csrf_token': 'fake-token'})
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        db.session.get(PartStageProgress, (part.id, stage.id)).qty_done = 0
+        db.session.commit()
+        history_id = StatusHistory.query.filter_by(part_pk=part.id).one().id
+
+        with pytest.raises(ValueError):
+            part_service.cancel_stage_by_history_id(history_id, User.query.filter_by(username='admin').first())
+        assert db.session.get(StatusHistory, history_id) is not None
+        assert AuditLog.query.filter_by(action="Отмена этапа").count() == 0
+
+
+class TestPartsApi:
+    """Тесты для постраничного API деталей изделия."""
+
+    def test_keyset_pagination_and_fields(self, client, database):
+        """Тест: /api/parts отдает страницы по ключу part_id и только запрошенные поля."""
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        db.session.add_all([
+            Part(part_id=f'PAGE-{i:02d}', product_designation='Постраничное изделие',
+                 name=f'Деталь {i}', material='Ст3', route_template_id=route.id)
+            for i in range(5)
+        ])
+        db.session.commit()
+
+        seen, after = [], None
+        while True:
+            params = {'limit': 2, 'fields': 'part_id,route_stages'}
+            if after:
+                params['after'] = after
+            data = client.get(url_for('main.api_parts_for_product',
+                                      product_designation='Постраничное изделие', **params)).get_json()
+            assert all(set(part) == {'part_id', 'route_stages'} for part in data['parts'])
+            seen.extend(part['part_id'] for part in data['parts'])
+            after = data['next_cursor']
+            if not after:
+                break
+        assert seen == [f'PAGE-{i:02d}' for i in range(5)]
+
+        response = client.get(url_for('main.api_parts_for_product',
+                                      product_designation='Постраничное изделие', fields='part_id,secret'))
+        assert response.status_code == 400
+
+    def test_conditional_get_with_product_version(self, client, database):
+        """Тест: /api/parts и панель мониторинга отвечают 304, пока изделие не изменилось."""
+        url = url_for('main.api_parts_for_product', product_designation='Тестовое изделие')
+        response = client.get(url)
+        etag = response.headers['ETag']
+        assert response.status_code == 200 and not response.headers['ETag'].startswith('W/')
+        assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+
+        dashboard_etag = client.get(url_for('main.dashboard')).headers['ETag']
+        assert client.get(url_for('main.dashboard'), headers={'If-None-Match': dashboard_etag}).status_code == 304
+
+        stage = Stage.query.filter_by(name='Резка').first()
+        client.post(
+            url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+            data={'operator_name': 'Оператор', 'quantity': 1, 'csrf_token': 'fake-token'}
+        )
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+        assert response.get_json()['parts'][0]['route_stages'][0]['qty_done'] == 1
+        # Подтверждение оставило flash-сообщение: страница отрисовывается заново
+        assert client.get(url_for('main.dashboard'), headers={'If-None-Match': dashboard_etag}).status_code == 200
+
+    def test_dashboard_shows_stage_wip(self, client, database):
+        """Тест: Сводка показывает штуки на каждом этапе и обновляется вместе с версией изделия."""
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        part = Part(part_id='WIP-001', product_designation='Тестовое изделие', name='Деталь',
+                    material='Ст3', route_template_id=route.id, quantity_total=5)
+        db.session.add(part)
+        db.session.flush()
+        stages = {stage.name: stage.id for stage in Stage.query}
+        progress_service.add_stage_progress_batch({(part.id, stages['Резка']): 3, (part.id, stages['Сверловка']): 1})
+        progress_service.touch_parts([part])
+        db.session.commit()
+
+        # TEST-001 (1 шт.) ждет резки; у WIP-001 2 шт. ждут резки, 2 - сверловки, 1 - контроля
+        assert progress_service.get_stage_wip() == {
+            'Тестовое изделие': [('Резка', 3), ('Сверловка', 2), ('Контроль ОТК', 1)]
+        }
+        html = client.get(url_for('main.dashboard')).get_data(as_text=True)
+        assert 'Резка: 3' in html and 'Контроль ОТК: 1' in html
+
+        progress_service.add_stage_progress_batch({(part.id, stages['Резка']): 2})
+        progress_service.touch_parts([part])
+        db.session.commit()
+        html = client.get(url_for('main.dashboard')).get_data(as_text=True)
+        assert 'Резка: 1' in html and 'Сверловка: 4' in html
+
+    def test_stage_wip_recomputed_only_for_changed_product(self, client, database):
+        """Тест: После изменения одного изделия незавершенное производство пересчитывается только для него."""
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        other = Part(part_id='WIP-OTHER', product_designation='Другое изделие', name='Деталь',
+                     material='Ст3', route_template_id=route.id, quantity_total=2)
+        db.session.add(other)
+        progress_service.track_part_in_product_progress(other)
+        progress_service.touch_parts([other])
+        db.session.commit()
+
+        with patch.object(progress_service, 'get_stage_wip', wraps=progress_service.get_stage_wip) as get_stage_wip:
+            client.get(url_for('main.dashboard'))
+            assert sorted(get_stage_wip.call_args.args[0]) == ['Другое изделие', 'Тестовое изделие']
+
+            part = Part.query.filter_by(part_id='TEST-001').first()
+            stage_id = Stage.query.filter_by(name='Резка').first().id
+            progress_service.add_stage_progress_batch({(part.id, stage_id): 1})
+            progress_service.touch_parts([part])
+            db.session.commit()
+            html = client.get(url_for('main.dashboard')).get_data(as_text=True)
+            assert get_stage_wip.call_count == 2
+            assert get_stage_wip.call_args.args[0] == ['Тестовое изделие']
+        assert 'Сверловка: 1' in html and 'Резка: 2' in html
+
+    def test_parts_page_is_served_from_cache(self, client, database, sql_statements):
+        """Тест: Повторный запрос страницы не обращается к таблице деталей, изменение изделия сбрасывает кэш."""
+        url = url_for('main.api_parts_for_product', product_designation='Тестовое изделие')
+        client.get(url)
+        with sql_statements() as statements:
+            assert client.get(url).get_json()['parts'][0]['part_id'] == 'TEST-001'
+        assert not any('FROM "Parts"' in statement for statement in statements)
+
+        stage = Stage.query.filter_by(name='Резка').first()
+        client.post(
+            url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+            data={'operator_name': 'Оператор', 'quantity': 1, 'csrf_token': 'fake-token'}
+        )
+        assert client.get(url).get_json()['parts'][0]['route_stages'][0]['qty_done'] == 1
+
+    def test_changes_since_token(self, client, database):
+        """Тест: /changes возвращает только измененные после токена детали и отметки об удалении."""
+        url = url_for('main.api_parts_for_product', product_designation='Тестовое изделие')
+        token = client.get(url).get_json()['token']
+        changes_url = lambda since: url_for('main.api_part_changes', product_designation='Тестовое изделие',
+                                            since=since, fields='part_id,quantity_completed')
+
+        data = client.get(changes_url(token)).get_json()
+        assert (data['parts'], data['deleted'], data['token']) == ([], [], token)
+
+        admin = User.query.filter_by(username='admin').first()
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        form = MagicMock()
+        form.part_id.data, form.product.data, form.name.data = 'DELTA-001', 'Тестовое изделие', 'Деталь'
+        form.material.data, form.size.data, form.route_template.data = 'Ст3', '', route.id
+        form.quantity_total.data, form.drawing.data = 1, None
+        part_service.create_single_part(form, admin, {})
+        part_service.delete_single_part(Part.query.filter_by(part_id='TEST-001').first(), admin, {})
+
+        data = client.get(changes_url(token)).get_json()
+        assert data['parts'] == [{'part_id': 'DELTA-001', 'quantity_completed': 0}]
+        assert data['deleted'] == ['TEST-001']
+        assert data['token'] == token + 2
+
+        data = client.get(changes_url(data['token'])).get_json()
+        assert (data['parts'], data['deleted']) == ([], [])
+        assert client.get(changes_url(token + 100)).status_code == 410
+
+    def test_children_with_depth_limit(self, client, database, sql_statements):
+        """Тест: Поддерево отдается до заданной глубины с флагом has_children без запросов на каждый узел."""
+        admin = User.query.filter_by(username='admin').first()
+        tree = [('ASM-1', 'TEST-001'), ('ASM-2', 'TEST-001'), ('ASM-1-1', 'ASM-1'), ('ASM-1-1-1', 'ASM-1-1')]
+        for part_id, parent_id in tree:
+            form = MagicMock()
+            form.part_id.data, form.name.data, form.material.data = part_id, f'Узел {part_id}', 'Ст3'
+            form.quantity_total.data = 2
+            part_service.create_child_part(form, parent_id, admin)
+
+        with sql_statements() as statements:
+            response = client.get(url_for('main.api_part_children', part_id='TEST-001', depth=2,
+                                          fields='part_id,quantity_total,route_stages'))
+        assert response.status_code == 200
+        # Деталь, версия изделия, поддерево, маршруты и их этапы, подсчет потомков, прогресс
+        assert len(statements) <= 7
+
+        children = response.get_json()['children']
+        assert [c['part_id'] for c in children] == ['ASM-1', 'ASM-2']
+        assert [c['has_children'] for c in children] == [True, False]
+        grandchild = children[0]['children'][0]
+        assert grandchild['part_id'] == 'ASM-1-1'
+        assert grandchild['has_children'] is True
+        assert 'children' not in grandchild
+        assert [s['name'] for s in grandchild['route_stages']] == ['Резка', 'Сверловка', 'Контроль ОТК']
+
+        deeper = client.get(url_for('main.api_part_children', part_id='ASM-1-1')).get_json()
+        assert [c['part_id'] for c in deeper['children']] == ['ASM-1-1-1']
+
+
+class TestPartSearch:
+    """Тесты поиска деталей /api/search."""
+
+    @pytest.fixture
+    def search_parts(self, database):
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        db.session.add_all([
+            Part(part_id='НКР-100', product_designation='Наборка №3', name='Кронштейн',
+                 material='Ст3', route_template_id=route.id),
+            Part(part_id='НКР-100-01', product_designation='Наборка №3', name='Планка',
+                 material='АМг6', route_template_id=route.id),
+            Part(part_id='ПЛ-7', product_designation='Рама', name='Кронштейн усиленный',
+                 material='09Г2С', route_template_id=route.id),
+        ])
+        db.session.commit()
+
+    def test_search_ranks_part_id_matches_first(self, client, search_parts):
+        """Тест: Точное совпадение обозначения идет первым, затем совпадение по началу, затем остальные."""
+        data = client.get(url_for('main.api_search', q='НКР-100')).get_json()
+        assert [r['part_id'] for r in data['results']] == ['НКР-100', 'НКР-100-01']
+        assert data['results'][0]['history_url'] == url_for('main.history', part_id='НКР-100', _external=False)
+        assert data['results'][0]['product_designation'] == 'Наборка №3'
+
+    def test_search_across_columns_and_case(self, client, search_parts):
+        """Тест: Все слова запроса ищутся по наименованию, материалу и изделию без учета регистра."""
+        data = client.get(url_for('main.api_search', q='кронштейн')).get_json()
+        assert sorted(r['part_id'] for r in data['results']) == ['НКР-100', 'ПЛ-7']
+        data = client.get(url_for('main.api_search', q='кронштейн рама')).get_json()
+        assert [r['part_id'] for r in data['results']] == ['ПЛ-7']
+        # Слово короче трех символов проверяется без триграммного индекса
+        data = client.get(url_for('main.api_search', q='Ст3 №3')).get_json()
+        assert [r['part_id'] for r in data['results']] == ['НКР-100']
+
+    def test_search_index_follows_updates_and_deletes(self, client, search_parts):
+        """Тест: Поисковый индекс следует за изменением и удалением деталей."""
+        part = Part.query.filter_by(part_id='ПЛ-7').first()
+        part.name = 'Косынка'
+        db.session.commit()
+        assert client.get(url_for('main.api_search', q='косынка')).get_json()['results'][0]['part_id'] == 'ПЛ-7'
+        db.session.delete(part)
+        db.session.commit()
+        assert client.get(url_for('main.api_search', q='косынка')).get_json()['results'] == []
+
+    def test_search_pagination_and_validation(self, client, search_parts):
+        """Тест: Постраничная выдача и ошибка на пустой запрос."""
+        first = client.get(url_for('main.api_search', q='Наборка', limit=1)).get_json()
+        second = client.get(url_for('main.api_search', q='Наборка', limit=1, page=2)).get_json()
+        assert first['has_next'] is True and second['has_next'] is False
+        assert [r['part_id'] for r in first['results'] + second['results']] == ['НКР-100', 'НКР-100-01']
+        assert client.get(url_for('main.api_search', q='  ')).status_code == 400
+        assert client.get(url_for('main.api_search', q='100%_')).get_json()['results'] == []
+
+
+class TestBatchConfirmation:
+    """Тесты пакетного подтверждения этапов /api/confirm_batch."""
+
+    @pytest.fixture
+    def pallet(self, database):
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        parts = [Part(part_id=f'PAL-{i:02d}', product_designation='Палета', name='Деталь', material='Ст3',
+                      route_template_id=route.id, quantity_total=2) for i in range(40)]
+        db.session.add_all(parts)
+        db.session.commit()
+        progress_service.rebuild_product_progress()
+        return {stage.name: stage.id for stage in Stage.query}
+
+    def test_batch_is_applied_in_one_transaction(self, scanner_client, pallet, sql_statements):
+        """Тест: Пакет из 40 деталей проверяется и записывается фиксированным числом запросов, событие одно."""
+        items = [{'part_id': f'PAL-{i:02d}', 'stage_id': pallet['Резка'], 'quantity': 2} for i in range(40)]
+        items.append({'part_id': 'PAL-00', 'stage_id': pallet['Сверловка']})
+
+        with sql_statements() as statements:
+            with patch('app.services.confirmation_service.socketio.emit') as mock_emit:
+                response = scanner_client.post(url_for('main.api_confirm_batch'),
+                                               json={'operator_name': 'Оператор  Палеты', 'items': items})
+
+        assert response.status_code == 200, response.get_json()
+        data = response.get_json()
+        assert data['confirmed'] == 41 and len(data['parts']) == 40
+        # Число запросов не зависит от размера пакета
+        assert len(statements) < 25
+        mock_emit.assert_called_once()
+        event_name, payload = mock_emit.call_args.args
+        assert event_name == 'update_dashboard' and payload['product_designations'] == ['Палета']
+
+        part = Part.query.filter_by(part_id='PAL-00').first()
+        assert part.current_status == 'Сверловка'
+        assert db.session.get(PartStageProgress, (part.id, pallet['Сверловка'])).qty_done == 1
+        assert StatusHistory.query.filter_by(operator_name='Оператор Палеты').count() == 41
+        assert db.session.query(db.func.sum(PartStageProgress.qty_done)).scalar() == 81
+
+    def test_batch_is_rejected_as_a_whole(self, scanner_client, pallet):
+        """Тест: Ошибка в любой позиции (в том числе перерасход с учетом повторов) отклоняет весь пакет."""
+        items = [
+            {'part_id': 'PAL-01', 'stage_id': pallet['Резка'], 'quantity': 1},
+            {'part_id': 'PAL-02', 'stage_id': pallet['Резка'], 'quantity': 2},
+            {'part_id': 'PAL-02', 'stage_id': pallet['Резка'], 'quantity': 1},
+            {'part_id': 'NO-SUCH', 'stage_id': pallet['Резка']},
+        ]
+        response = scanner_client.post(url_for('main.api_confirm_batch'),
+                                       json={'operator_name': 'Оператор', 'items': items})
+        assert response.status_code == 400
+        assert [e['index'] for e in response.get_json()['errors']] == [3]
+
+        response = scanner_client.post(url_for('main.api_confirm_batch'),
+                                       json={'operator_name': 'Оператор', 'items': items[:3]})
+        assert response.status_code == 400
+        assert [e['index'] for e in response.get_json()['errors']] == [2]
+        assert PartStageProgress.query.count() == 0
+        assert StatusHistory.query.count() == 0
+
+        response = scanner_client.post(url_for('main.api_confirm_batch'), json={'items': items[:1]})
+        assert response.status_code == 400
+        response = scanner_client.post(url_for('main.api_confirm_batch'), json={
+            'operator_name': 'Оператор', 'items': [{'part_id': 'PAL-01', 'quantity': 0}]
+        })
+        assert response.status_code == 400
+        for body in ([], 'items', 5):
+            response = scanner_client.post(url_for('main.api_confirm_batch'), json=body)
+            assert response.status_code == 400
+            assert response.get_json()['message'] == "Тело запроса должно быть JSON-объектом."
+        assert scanner_client.post(url_for('main.api_confirm_batch'), data='{').status_code == 400
+
+    def test_batch_checks_part_routes(self, scanner_client, pallet):
+        """Тест: Этап вне маршрута детали и деталь без маршрута дают ошибку позиции, а не запись."""
+        painting = Stage(name='Покраска')
+        db.session.add_all([painting, Part(part_id='PAL-NOROUTE', product_designation='Палета', name='Деталь',
+                                           material='Ст3', quantity_total=2)])
+        db.session.commit()
+        items = [
+            {'part_id': 'PAL-01', 'stage_id': pallet['Резка']},
+            {'part_id': 'PAL-02', 'stage_id': painting.id},
+            {'part_id': 'PAL-NOROUTE', 'stage_id': pallet['Резка']},
+        ]
+        response = scanner_client.post(url_for('main.api_confirm_batch'),
+                                       json={'operator_name': 'Оператор', 'items': items})
+        assert response.status_code == 400
+        errors = response.get_json()['errors']
+        assert [e['index'] for e in errors] == [1, 2]
+        assert 'не входит в маршрут' in errors[0]['message'] and 'маршрут' in errors[1]['message']
+        assert StatusHistory.query.count() == 0
+
+    def test_batch_requires_token_and_skips_csrf(self, app, client, scanner_client, pallet, monkeypatch):
+        """Тест: При включенной CSRF-защите пакет проходит по токену терминала, без токена - 401."""
+        monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+        body = {'operator_name': 'Оператор', 'items': [{'part_id': 'PAL-01', 'stage_id': pallet['Резка']}]}
+
+        assert client.post(url_for('main.api_confirm_batch'), json=body).status_code == 401
+        response = client.post(url_for('main.api_confirm_batch'), json=body,
+                               headers={'Authorization': 'Bearer wrong-token'})
+        assert response.status_code == 401 and response.headers['WWW-Authenticate'] == 'Bearer'
+        assert scanner_client.post(url_for('main.api_confirm_batch'), json=body).status_code == 200
+        # Формы по-прежнему требуют CSRF-токен
+        response = client.post(url_for('main.confirm_stage', part_id='PAL-02', stage_id=pallet['Резка']),
+                               data={'operator_name': 'Оператор', 'quantity': 1})
+        assert response.status_code == 400
+        assert StatusHistory.query.count() == 1
+
+
+class TestIdempotentConfirmation:
+    """Тесты ключей идемпотентности подтверждений этапов."""
+
+    def test_repeated_form_submit_is_confirmed_once(self, client, database):
+        """Тест: Повторная отправка формы с тем же ключом не подтверждает этап второй раз."""
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        part.quantity_total = 5
+        db.session.commit()
+        stage = Stage.query.filter_by(name='Резка').first()
+        data = {'operator_name': 'Оператор', 'quantity': 2, 'csrf_token': 'fake-token',
+                'idempotency_key': 'form-key-1'}
+        url = url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id)
+
+        first = client.post(url, data=data, follow_redirects=True)
+        second = client.post(url, data=data, follow_redirects=True)
+        for response in (first, second):
+            assert response.status_code == 200
+            assert 'Статус для детали TEST-001 обновлен' in response.data.decode('utf-8')
+        assert StatusHistory.query.filter_by(part_pk=part.id).count() == 1
+
+        # Тот же ключ с другим количеством - ошибка, а не подтверждение
+        response = client.post(url, data=dict(data, quantity=1), follow_redirects=True)
+        assert 'Ключ идемпотентности уже использован' in response.data.decode('utf-8')
+        # Новый ключ - новое подтверждение
+        client.post(url, data=dict(data, idempotency_key='form-key-2'))
+        assert StatusHistory.query.filter_by(part_pk=part.id).count() == 2
+
+    def test_too_long_key_is_rejected(self, client, scanner_client, database):
+        """Тест: Ключ длиннее столбца отклоняется с сообщением в форме и 400 в JSON API, без записи."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        long_key = 'k' * 65
+        # Заголовок не проходит через валидаторы формы, ключ проверяет idempotency_service
+        response = client.post(url_for('main.confirm_stage', part_id='TEST-001', stage_id=stage.id),
+                               data={'operator_name': 'Оператор', 'quantity': 1, 'csrf_token': 'fake-token'},
+                               headers={'Idempotency-Key': long_key}, follow_redirects=True)
+        assert response.status_code == 200
+        assert 'Ключ идемпотентности длиннее 64 символов.' in response.data.decode('utf-8')
+
+        for url, body in (
+            (url_for('main.api_confirm_batch'),
+             {'operator_name': 'Оператор', 'items': [{'part_id': 'TEST-001', 'stage_id': stage.id}]}),
+            (url_for('main.api_scan_confirm', part_id='TEST-001'), {'operator_name': 'Оператор', 'stage_id': stage.id}),
+        ):
+            response = scanner_client.post(url, json=body, headers={'Idempotency-Key': long_key})
+            assert response.status_code == 400
+        assert StatusHistory.query.count() == 0
+        assert IdempotencyKey.query.count() == 0
+
+    def test_select_stage_form_has_idempotency_key(self, client, database):
+        """Тест: Форма подтверждения содержит новый ключ идемпотентности при каждом показе."""
+        keys = [re.search(r'name="idempotency_key"[^>]*value="([0-9a-f]{32})"',
+                          client.get(url_for('main.select_stage', part_id='TEST-001')).data.decode('utf-8'))
+                for _ in range(2)]
+        assert all(keys) and keys[0].group(1) != keys[1].group(1)
+
+    def test_repeated_batch_replays_response(self, scanner_client, database):
+        """Тест: Повтор пакета с тем же Idempotency-Key возвращает прежний ответ без записи."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        body = {'operator_name': 'Оператор', 'items': [{'part_id': 'TEST-001', 'stage_id': stage.id}]}
+        headers = {'Idempotency-Key': 'batch-key-1'}
+        with patch('app.services.confirmation_service.socketio.emit') as mock_emit:
+            first = scanner_client.post(url_for('main.api_confirm_batch'), json=body, headers=headers)
+            second = scanner_client.post(url_for('main.api_confirm_batch'), json=body, headers=headers)
+        assert first.status_code == second.status_code == 200
+        assert second.get_json() == first.get_json()
+        mock_emit.assert_called_once()
+        assert StatusHistory.query.count() == 1
+        assert db.session.query(db.func.sum(PartStageProgress.qty_done)).scalar() == 1
+
+        body['items'][0]['quantity'] = 2
+        response = scanner_client.post(url_for('main.api_confirm_batch'), json=body, headers=headers)
+        assert response.status_code == 422
+
+    def test_rejected_batch_releases_key(self, scanner_client, database):
+        """Тест: Отклоненный пакет не занимает ключ, исправленный пакет с тем же ключом проходит."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        headers = {'Idempotency-Key': 'batch-key-2'}
+        response = scanner_client.post(url_for('main.api_confirm_batch'), headers=headers, json={
+            'operator_name': 'Оператор', 'items': [{'part_id': 'TEST-001', 'stage_id': stage.id, 'quantity': 5}]
+        })
+        assert response.status_code == 400
+        response = scanner_client.post(url_for('main.api_confirm_batch'), headers=headers, json={
+            'operator_name': 'Оператор', 'items': [{'part_id': 'TEST-001', 'stage_id': stage.id}]
+        })
+        assert response.status_code == 200
+
+    def test_expired_keys_are_purged(self, app, scanner_client, database):
+        """Тест: Ключ старше IDEMPOTENCY_KEY_TTL удаляется и не мешает новому запросу."""
+        db.session.add_all([
+            IdempotencyKey(scope='confirm_batch', key='old-key', fingerprint='0' * 40,
+                           created_at=datetime.utcnow() - timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL'] + 60)),
+            IdempotencyKey(scope='confirm_batch', key='stale', fingerprint='0' * 40,
+                           created_at=datetime.utcnow() - timedelta(days=30)),
+        ])
+        db.session.commit()
+
+        stage = Stage.query.filter_by(name='Резка').first()
+        response = scanner_client.post(
+            url_for('main.api_confirm_batch'), headers={'Idempotency-Key': 'old-key'},
+            json={'operator_name': 'Оператор', 'items': [{'part_id': 'TEST-001', 'stage_id': stage.id}]}
+        )
+        assert response.status_code == 200
+        assert [record.key for record in IdempotencyKey.query] == ['old-key']
+        assert StatusHistory.query.count() == 1
+
+
+class TestScanApi:
+    """Тесты JSON API сканирования /api/scan для терминалов сбора данных."""
+
+    def test_get_next_stage_in_two_queries(self, client, database, sql_statements):
+        """Тест: Следующий этап и остаток возвращаются двумя запросами при прогретом кэше маршрутов."""
+        url = url_for('main.api_scan', part_id='TEST-001')
+        client.get(url)  # прогрев кэша маршрутов
+        with sql_statements() as statements:
+            response = client.get(url)
+
+        assert response.status_code == 200
+        assert response.mimetype == 'application/json'
+        data = response.get_json()
+        assert data['part']['part_id'] == 'TEST-001'
+        assert data['next_stage']['name'] == 'Резка'
+        assert data['next_stage']['remaining'] == 1 and not data['route_completed']
+        assert len(statements) <= 2, statements
+
+        assert client.get(url_for('main.api_scan', part_id='NO-SUCH')).status_code == 404
+
+    def test_confirm_returns_new_progress(self, scanner_client, database):
+        """Тест: POST подтверждает этап и возвращает новое состояние детали без перенаправления."""
+        stage = Stage.query.filter_by(name='Резка').first()
+        response = scanner_client.post(url_for('main.api_scan_confirm', part_id='TEST-001'),
+                                       json={'operator_name': 'Оператор  Сканера', 'stage_id': stage.id})
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data['part']['current_status'] == 'Резка'
+        assert data['next_stage']['name'] != 'Резка'
+        assert StatusHistory.query.filter_by(operator_name='Оператор Сканера').count() == 1
+
+        # Этап уже выполнен полностью - ошибка с сообщением, без записи
+        response = scanner_client.post(url_for('main.api_scan_confirm', part_id='TEST-001'),
+                                       json={'operator_name': 'Оператор', 'stage_id': stage.id})
+        assert response.status_code == 400
+        assert 'осталось 0 шт.' in response.get_json()['message']
+        assert StatusHistory.query.count() == 1
+
+    def test_confirm_rejects_malformed_payload(self, scanner_client, database):
+        """Тест: Тело не-объект, отсутствующий stage_id и нечисловое количество дают 400 с JSON-ошибкой."""
+        url = url_for('main.api_scan_confirm', part_id='TEST-001')
+        stage_id = Stage.query.filter_by(name='Резка').first().id
+        for body in ([], 'Резка', 7):
+            response = scanner_client.post(url, json=body)
+            assert response.status_code == 400
+            assert response.get_json()['message'] == "Тело запроса должно быть JSON-объектом."
+        for body in ({'operator_name': 'Оператор'},
+                     {'operator_name': 'Оператор', 'stage_id': 'Резка'},
+                     {'operator_name': 'Оператор', 'stage_id': stage_id, 'quantity': 'abc'},
+                     {'operator_name': 'Оператор', 'stage_id': stage_id, 'quantity': None}):
+            response = scanner_client.post(url, json=body)
+            assert response.status_code == 400
+            assert response.get_json()['status'] == 'error'
+        assert StatusHistory.query.count() == 0
+
+    def test_confirm_with_idempotency_key(self, scanner_client, database):
+        """
+        Тест: Повтор подтверждения со сканера с тем же ключом не пишет историю второй раз
+        и возвращает сохраненный исходный ответ, а не текущее состояние детали.
+        """
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        part.quantity_total = 3
+        db.session.commit()
+        stage = Stage.query.filter_by(name='Резка').first()
+        url = url_for('main.api_scan_confirm', part_id='TEST-001')
+        body = {'operator_name': 'Оператор', 'stage_id': stage.id}
+
+        first = scanner_client.post(url, json=body, headers={'Idempotency-Key': 'scan-key-1'})
+        assert first.status_code == 200
+        assert first.get_json()['next_stage']['remaining'] == 2
+        # Деталь меняется другим подтверждением, повтор первого ключа отдает прежний ответ
+        assert scanner_client.post(url, json=body, headers={'Idempotency-Key': 'scan-key-2'}).status_code == 200
+        replay = scanner_client.post(url, json=body, headers={'Idempotency-Key': 'scan-key-1'})
+        assert replay.status_code == 200
+        assert replay.get_json() == first.get_json()
+        assert StatusHistory.query.count() == 2
+
+    def test_confirm_requires_token_and_skips_csrf(self, app, client, scanner_client, database, monkeypatch):
+        """Тест: При включенной CSRF-защите сканер подтверждает этап по токену, без токена - 401."""
+        monkeypatch.setitem(app.config, 'WTF_CSRF_ENABLED', True)
+        url = url_for('main.api_scan_confirm', part_id='TEST-001')
+        body = {'operator_name': 'Оператор', 'stage_id': Stage.query.filter_by(name='Резка').first().id}
+
+        assert client.post(url, json=body).status_code == 401
+        assert StatusHistory.query.count() == 0
+        assert scanner_client.post(url, json=body).status_code == 200
+        assert StatusHistory.query.count() == 1
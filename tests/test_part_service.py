@@ -7,8 +7,9 @@ from unittest.mock import patch, MagicMock
 from werkzeug.datastructures import FileStorage
 
 from app import db
-from app.services import part_service
-from app.models.models import Part, RouteTemplate, Stage, User
+from app.services import hierarchy_service, part_service, progress_service
+from app.models.models import (AuditLog, Part, PartClosure, ProductProgress, ProductVersion, RouteStage,
+                               RouteTemplate, Stage, User)
 
 
 @pytest.fixture
@@ -55,7 +56,7 @@ class TestPartService:
         assert added_count == 3
         assert skipped_count == 0
 
-        part1 = db.session.get(Part, "АСЦБ-000475")
+        part1 = Part.query.filter_by(part_id="АСЦБ-000475").first()
         assert part1 is not None
         assert part1.product_designation == "Наборка №3"
         assert part1.name == "Палец"
@@ -68,7 +69,7 @@ class TestPartService:
         assert Stage.query.filter_by(name="Фр").first() is not None
 
         # Полные проверки для всех деталей
-        part2 = db.session.get(Part, "АСЦБ-000459")
+        part2 = Part.query.filter_by(part_id="АСЦБ-000459").first()
         assert part2 is not None
         assert part2.name == "Болт осевой"
         route2 = RouteTemplate.query.filter_by(name="Св -> HRC").first()
@@ -121,4 +122,211 @@ class TestPartService:
             )
         
         # 3. Дополнительная проверка:
-        assert "Не найдены заголовки" in str(excinfo.value)
\ No newline at end of file
+        assert "Не найдены заголовки" in str(excinfo.value)
+    def test_product_progress_rollup_is_maintained(self, database):
+        """
+        Тест: Сводка ProductProgress обновляется при создании и удалении
+        детали и совпадает с результатом полной пересборки.
+        """
+        admin_user = User.query.filter_by(username='admin').first()
+        mock_form = MagicMock()
+        mock_form.part_id.data = "ROLLUP-001"
+        mock_form.product.data = "Тестовое изделие"
+        mock_form.name.data = "Деталь"
+        mock_form.material.data = "Ст3"
+        mock_form.size.data = ""
+        mock_form.route_template.data = RouteTemplate.query.first().id
+        mock_form.quantity_total.data = 4
+        mock_form.drawing.data = None
+        part_service.create_single_part(mock_form, admin_user, {})
+
+        rollup = db.session.get(ProductProgress, "Тестовое изделие")
+        assert rollup.total_parts == 2
+        assert rollup.total_quantity == 5
+
+        part_service.delete_single_part(Part.query.filter_by(part_id="TEST-001").first(), admin_user, {})
+        rollup = db.session.get(ProductProgress, "Тестовое изделие")
+        assert (rollup.total_parts, rollup.total_quantity, rollup.completed_quantity) == (1, 4, 0)
+
+        progress_service.rebuild_product_progress()
+        rebuilt = db.session.get(ProductProgress, "Тестовое изделие")
+        assert (rebuilt.total_parts, rebuilt.total_quantity, rebuilt.completed_quantity) == (1, 4, 0)
+
+    def test_part_closure_is_maintained(self, database):
+        """
+        Тест: Таблица замыкания PartClosure поддерживается при добавлении
+        и удалении узлов и совпадает с результатом полной пересборки.
+        """
+        admin_user = User.query.filter_by(username='admin').first()
+        for part_id, parent_id in (("ASM-1", "TEST-001"), ("ASM-1-1", "ASM-1"), ("ASM-2", "TEST-001")):
+            mock_form = MagicMock()
+            mock_form.part_id.data = part_id
+            mock_form.name.data = f"Узел {part_id}"
+            mock_form.material.data = "Ст3"
+            mock_form.quantity_total.data = 1
+            part_service.create_child_part(mock_form, parent_id, admin_user)
+
+        root = Part.query.filter_by(part_id="TEST-001").first()
+        leaf = Part.query.filter_by(part_id="ASM-1-1").first()
+        assert [p.part_id for p in hierarchy_service.get_subtree(root)] == ["ASM-1", "ASM-1-1", "ASM-2"]
+        assert [p.part_id for p in hierarchy_service.get_subtree(root, max_depth=1)] == ["ASM-1", "ASM-2"]
+        assert [p.part_id for p in hierarchy_service.get_ancestors(leaf)] == ["TEST-001", "ASM-1"]
+        assert hierarchy_service.count_descendants(root) == 3
+
+        closure_before = set(db.session.query(PartClosure.ancestor_pk, PartClosure.descendant_pk, PartClosure.depth))
+        hierarchy_service.rebuild_part_closure()
+        assert set(db.session.query(PartClosure.ancestor_pk, PartClosure.descendant_pk, PartClosure.depth)) == closure_before
+
+        # Удаление узла удаляет его поддерево вместе со строками замыкания
+        part_service.delete_single_part(Part.query.filter_by(part_id="ASM-1").first(), admin_user, {})
+        assert hierarchy_service.count_descendants(root) == 1
+        assert PartClosure.query.filter_by(descendant_pk=leaf.id).count() == 0
+
+    def test_product_version_is_bumped(self, database):
+        """
+        Тест: Создание, редактирование и удаление детали увеличивают версию
+        изделия, а версия панели мониторинга растет вместе с ней.
+        """
+        admin_user = User.query.filter_by(username='admin').first()
+        version = progress_service.get_product_version("Тестовое изделие")
+        dashboard_version = progress_service.get_dashboard_version()
+        assert version > 0
+
+        mock_form = MagicMock()
+        mock_form.part_id.data = "VERSION-001"
+        mock_form.product.data = "Тестовое изделие"
+        mock_form.name.data = "Деталь"
+        mock_form.material.data = "Ст3"
+        mock_form.size.data = ""
+        mock_form.route_template.data = RouteTemplate.query.first().id
+        mock_form.quantity_total.data = 1
+        mock_form.drawing.data = None
+        part_service.create_single_part(mock_form, admin_user, {})
+        assert progress_service.get_product_version("Тестовое изделие") == version + 1
+
+        part = Part.query.filter_by(part_id="VERSION-001").first()
+        mock_form.product_designation.data = "Другое изделие"
+        mock_form.drawing.data = None
+        part_service.update_part_from_form(part, mock_form, admin_user, {})
+        assert progress_service.get_product_version("Тестовое изделие") == version + 2
+        assert progress_service.get_product_version("Другое изделие") == 1
+
+        part_service.delete_single_part(part, admin_user, {})
+        assert progress_service.get_product_version("Другое изделие") == 2
+        assert progress_service.get_dashboard_version() == dashboard_version + 4
+
+    def test_import_assemblies_in_bulk(self, database):
+        """
+        Тест: Импорт со сборками привязывает детали к ближайшей сборке выше,
+        пропускает повторы и строки без обозначения, а таблица замыкания и
+        сводка по изделию совпадают с результатом полной пересборки.
+        """
+        csv_content = "\n".join([
+            ',,,,,',
+            ',Тестовое изделие,,,,',
+            'Обозначение,Наименование,Кол-во,Размер,Операции,Прим.',
+            'ROOT-1,Шайба,2.7,,,',
+            'СБ-1,,,,,',
+            'СБ-1-01,Планка,3,10x20,"Рез, Гиб",Ст3',
+            'СБ-1-02,Уголок,abc,,,',
+            'ROOT-1,Шайба,1,,,',
+            ',,5,,,',
+            'TEST-001,,,,,',
+            'TEST-001-01,Втулка,inf,,,Бронза',
+        ])
+        csv_file = FileStorage(stream=io.BytesIO(csv_content.encode('utf-8')), filename="assemblies.csv")
+        admin_user = User.query.filter_by(username='admin').first()
+
+        added_count, skipped_count = part_service.import_parts_from_excel(csv_file, admin_user, {})
+
+        assert (added_count, skipped_count) == (5, 3)
+        parts = {part.part_id: part for part in Part.query}
+        assert parts['ROOT-1'].parent_pk is None and parts['ROOT-1'].quantity_total == 2
+        assert parts['СБ-1'].name == "Сборка СБ-1"
+        assert parts['СБ-1-01'].parent_pk == parts['СБ-1'].id
+        assert parts['СБ-1-01'].route_template.name == "Рез -> Гиб"
+        assert parts['СБ-1-02'].quantity_total == 1 and parts['СБ-1-02'].material == "Не указан"
+        # Существующая сборка принимает новые детали
+        assert parts['TEST-001-01'].parent_pk == parts['TEST-001'].id
+        assert parts['TEST-001-01'].quantity_total == 1
+        assert AuditLog.query.filter(AuditLog.details.like('%assemblies.csv%')).count() == 5
+
+        closure = set(db.session.query(PartClosure.ancestor_pk, PartClosure.descendant_pk, PartClosure.depth))
+        hierarchy_service.rebuild_part_closure()
+        assert set(db.session.query(PartClosure.ancestor_pk, PartClosure.descendant_pk, PartClosure.depth)) == closure
+
+        rollup = db.session.get(ProductProgress, "Тестовое изделие")
+        rollup = (rollup.total_parts, rollup.total_quantity, rollup.completed_quantity)
+        progress_service.rebuild_product_progress()
+        rebuilt = db.session.get(ProductProgress, "Тестовое изделие")
+        assert rollup == (rebuilt.total_parts, rebuilt.total_quantity, rebuilt.completed_quantity) == (3, 4, 0)
+
+    def test_import_checks_existing_parts_by_set(self, database, mock_csv_file, sql_statements):
+        """
+        Тест: Существующие обозначения проверяются списками IN на весь файл,
+        а не запросом на строку; повторный импорт пропускает все строки.
+        """
+        admin_user = User.query.filter_by(username='admin').first()
+        assert part_service.import_parts_from_excel(mock_csv_file, admin_user, {}) == (3, 0)
+
+        mock_csv_file.stream.seek(0)
+        with sql_statements() as statements:
+            with patch.object(part_service, 'EXISTING_LOOKUP_CHUNK_SIZE', 2):
+                assert part_service.import_parts_from_excel(mock_csv_file, admin_user, {}) == (0, 3)
+
+        lookups = [statement for statement in statements if '"Parts".part_id IN' in statement]
+        assert len(lookups) == 2
+        assert not any('"Parts".part_id = ' in statement for statement in statements)
+
+    def test_import_resolves_routes_once(self, database, sql_statements):
+        """
+        Тест: Маршруты импорта разрешаются фиксированным числом запросов
+        независимо от числа строк; этапы сопоставляются без учета регистра.
+        """
+        operations = [f'РЕЗКА, Операция {i % 5}, Гиб {i}' for i in range(14)] + ['']
+        lines = ['Изделие маршрутов,,,', 'Обозначение,Наименование,Кол-во,Операции']
+        lines += [f'R-{i:05d},Деталь,1,"{operations[i % len(operations)]}"' for i in range(3000)]
+        csv_file = FileStorage(stream=io.BytesIO('\n'.join(lines).encode('utf-8')), filename="routes.csv")
+        admin_user = User.query.filter_by(username='admin').first()
+        stages_before = Stage.query.count()
+
+        with sql_statements() as statements:
+            assert part_service.import_parts_from_excel(csv_file, admin_user, {}) == (3000, 0)
+
+        routing = [statement for statement in statements
+                   if any(table in statement for table in ('"RouteTemplates"', '"Stages"', '"RouteStages"'))]
+        # Маршрут по умолчанию, маршруты по именам, справочник этапов и три пакетные вставки
+        assert len(routing) <= 6, routing
+        # 'РЕЗКА' - существующий этап 'Резка'; новые: 5 операций и 14 гибов
+        assert Stage.query.count() == stages_before + 19
+        route = RouteTemplate.query.filter_by(name='РЕЗКА -> Операция 3 -> Гиб 8').one()
+        assert [rs.stage.name for rs in RouteStage.query.filter_by(template_id=route.id).order_by(RouteStage.order)] \
+            == ['Резка', 'Операция 3', 'Гиб 8']
+        default_route = RouteTemplate.query.filter_by(is_default=True).first()
+        assert Part.query.filter_by(part_id='R-00014').one().route_template_id == default_route.id
+        assert Part.query.filter_by(part_id='R-00008').one().route_template_id == route.id
+
+
+    def test_product_rows_are_upserted(self, database, sql_statements):
+        """
+        Тест: Версии и сводка изделий создаются и увеличиваются одним upsert,
+        без чтения строки перед вставкой; загруженные объекты обновляются.
+        """
+        known = db.session.get(ProductVersion, "Тестовое изделие")
+        version = known.version
+        with sql_statements() as statements:
+            versions = progress_service.bump_product_versions(["Тестовое изделие", "Новое изделие"])
+        assert versions == {"Тестовое изделие": version + 1, "Новое изделие": 1}
+        assert len(statements) == 1
+        assert known.version == version + 1
+
+        with sql_statements() as statements:
+            progress_service.adjust_product_progress("Новое изделие", parts=2, quantity=7)
+            progress_service.adjust_product_progress("Новое изделие", parts=1, quantity=3, completed=1)
+        assert len(statements) == 2
+        rollup = db.session.get(ProductProgress, "Новое изделие")
+        assert (rollup.total_parts, rollup.total_quantity, rollup.completed_quantity) == (3, 10, 1)
+
+        progress_service.adjust_product_progress("Новое изделие", parts=-3, quantity=-10, completed=-1)
+        db.session.commit()
+        assert db.session.get(ProductProgress, "Новое изделие") is None
@@ -0,0 +1,286 @@
+# tests/test_performance.py
+
+import io
+import json
+import threading
+import time
+from unittest.mock import patch
+
+import pytest
+from flask import jsonify, url_for
+from sqlalchemy import insert
+from werkzeug.datastructures import FileStorage
+
+from app import create_app, db
+from config import TestingConfig
+from app.main import routes as main_routes
+from app.models.models import (Part, PartStageProgress, ProductProgress, RouteStage, RouteTemplate, Stage,
+                               StatusHistory, User)
+from app.services import part_service, progress_service, route_service
+from app.utils import ORJSON_AVAILABLE, json_response
+from legacy_import import import_parts_row_by_row
+
+# Обозначения с символами, которые url_for кодирует по-разному
+TRICKY_PART_IDS = ('АБВГ.123-01', 'DET/01 02', 'A&B=C?#%', "X'(1)*+,;@!$:")
+
+
+@pytest.fixture
+def large_product(database):
+    """Изделие из нескольких тысяч корневых деталей."""
+    route = RouteTemplate.query.filter_by(is_default=True).first()
+    db.session.execute(insert(Part), [{
+        'part_id': f'BENCH/{i:05d} №', 'product_designation': 'Изделие для замеров',
+        'name': f'Деталь {i}', 'material': 'Ст3', 'route_template_id': route.id,
+        'quantity_total': 10, 'quantity_completed': 0
+    } for i in range(3000)])
+    db.session.commit()
+    yield Part.query.filter_by(product_designation='Изделие для замеров').order_by(Part.part_id).all()
+
+
+def _serialize_with_url_for(part):
+    """Прежний способ: url_for и strftime для каждой детали."""
+    return {
+        'part_id': part.part_id,
+        'creation_date': part.date_added.strftime('%Y-%m-%d'),
+        'history_url': url_for('main.history', part_id=part.part_id),
+        'delete_url': url_for('admin.part.delete_part', part_id=part.part_id),
+        'edit_url': url_for('admin.part.edit_part', part_id=part.part_id),
+        'qr_url': url_for('admin.part.generate_single_qr', part_id=part.part_id),
+    }
+
+
+class TestPartSerializationPerformance:
+    """Замеры сериализации списков деталей для /api/parts."""
+
+    FIELDS = ('part_id', 'creation_date', 'history_url', 'delete_url', 'edit_url', 'qr_url')
+
+    def test_url_templates_match_url_for(self, app, database):
+        """Тест: Адреса из шаблонов совпадают с url_for для любых обозначений."""
+        with app.test_request_context():
+            templates = main_routes._part_url_templates(main_routes.PART_FIELDS)
+            for part_id in TRICKY_PART_IDS:
+                for field, endpoint in main_routes.PART_URL_ENDPOINTS.items():
+                    prefix, suffix = templates[field]
+                    expected = url_for(endpoint, part_id=part_id)
+                    assert prefix + main_routes._quote_part_id(part_id) + suffix == expected
+
+    def test_serialization_matches_url_for(self, app, large_product):
+        """
+        Тест: Шаблоны адресов и orjson на 3000 деталях дают тот же ответ, что url_for
+        и jsonify, а url_for вызывается один раз на поле, а не на деталь.
+        """
+        with app.test_request_context():
+            legacy_response = jsonify({'parts': [_serialize_with_url_for(part) for part in large_product]})
+            with patch.object(main_routes, 'url_for', wraps=url_for) as counted_url_for:
+                templates = main_routes._part_url_templates(self.FIELDS)
+                fast_response = json_response({'parts': [
+                    main_routes._serialize_part(part, self.FIELDS, {}, templates) for part in large_product
+                ]})
+        assert json.loads(fast_response.get_data()) == json.loads(legacy_response.get_data())
+        assert counted_url_for.call_count <= len(main_routes.PART_URL_ENDPOINTS)
+
+    @pytest.mark.benchmark
+    def test_serialization_speed(self, app, large_product):
+        """Замер: url_for и jsonify против шаблонов адресов и orjson на 3000 деталях, лучшее из трех."""
+        def fast_parts():
+            templates = main_routes._part_url_templates(self.FIELDS)
+            return {'parts': [main_routes._serialize_part(part, self.FIELDS, {}, templates) for part in large_product]}
+
+        def best_of_three(build):
+            timings = []
+            for _ in range(3):
+                start = time.perf_counter()
+                build().get_data()
+                timings.append(time.perf_counter() - start)
+            return min(timings)
+
+        with app.test_request_context():
+            legacy_time = best_of_three(
+                lambda: jsonify({'parts': [_serialize_with_url_for(part) for part in large_product]})
+            )
+            templates_time = best_of_three(lambda: jsonify(fast_parts()))
+            fast_time = best_of_three(lambda: json_response(fast_parts()))
+
+        print(f"\n{len(large_product)} деталей: url_for + jsonify {legacy_time * 1000:.0f} мс, "
+              f"шаблоны + jsonify {templates_time * 1000:.0f} мс, "
+              f"шаблоны + {'orjson' if ORJSON_AVAILABLE else 'jsonify'} {fast_time * 1000:.0f} мс "
+              f"(x{legacy_time / fast_time:.1f})")
+
+    @pytest.mark.skipif(not ORJSON_AVAILABLE, reason="orjson не установлен")
+    def test_fast_json_can_be_disabled(self, app, database):
+        """Тест: При FAST_JSON = False ответ строится через jsonify с тем же содержимым."""
+        payload = {'parts': [{'part_id': 'АБВ', 'route_stages': [], 'size': None}], 'token': 5}
+        with app.test_request_context():
+            fast = json_response(payload)
+            app.config['FAST_JSON'] = False
+            try:
+                standard = json_response(payload, status=201)
+            finally:
+                app.config['FAST_JSON'] = True
+        assert fast.mimetype == standard.mimetype == 'application/json'
+        assert standard.status_code == 201
+        assert json.loads(fast.get_data()) == json.loads(standard.get_data()) == payload
+
+
+class TestScanApiPerformance:
+    """JSON API сканирования против HTML-страниц сканирования и подтверждения."""
+
+    SCANS = 30
+
+    def test_scan_api_issues_fewer_statements(self, app, client, scanner_client, large_product, sql_statements):
+        """
+        Тест: Сканирование и подтверждение через /api/scan выполняют меньше SQL-запросов,
+        чем /scan и confirm_stage с переходом на панель.
+        """
+        stage_id = route_service.get_route_stages(large_product[0].route_template_id)[0].stage_id
+        part_ids = [part.part_id for part in large_product[:2 * self.SCANS]]
+        html_parts, api_parts = part_ids[:self.SCANS], part_ids[self.SCANS:]
+
+        with sql_statements() as html_statements:
+            for part_id in html_parts:
+                assert client.get(url_for('main.select_stage', part_id=part_id)).status_code == 200
+                response = client.post(
+                    url_for('main.confirm_stage', part_id=part_id, stage_id=stage_id),
+                    data={'operator_name': 'Оператор', 'quantity': 10, 'csrf_token': 'fake-token'},
+                    follow_redirects=True
+                )
+                assert response.status_code == 200
+
+        with sql_statements() as api_statements:
+            for part_id in api_parts:
+                assert client.get(url_for('main.api_scan', part_id=part_id)).status_code == 200
+                response = scanner_client.post(url_for('main.api_scan_confirm', part_id=part_id), json={
+                    'operator_name': 'Оператор', 'stage_id': stage_id, 'quantity': 10
+                })
+                assert response.status_code == 200
+
+        assert StatusHistory.query.count() == 2 * self.SCANS
+        assert len(api_statements) < len(html_statements)
+
+
+class TestImportPerformance:
+    """Число SQL-запросов при импорте деталей из файла."""
+
+    ROWS = 2000
+    OPERATIONS = ('Рез, Гиб', 'Ток, Фр', 'Св, HRC', '', 'Ток')
+    # 100 сборок, 1900 деталей и 5 маршрутов укладываются в несколько десятков запросов
+    STATEMENT_LIMIT = 40
+
+    def _bom(self, prefix):
+        """CSV-спецификация: сборка на каждые 20 строк, детали с несколькими маршрутами."""
+        lines = [f'Изделие {prefix},,,,,', 'Обозначение,Наименование,Кол-во,Размер,Операции,Прим.']
+        for i in range(self.ROWS):
+            if i % 20 == 0:
+                lines.append(f'{prefix}-СБ{i // 20:04d},,,,,')
+            else:
+                lines.append(f'{prefix}-{i:05d},Деталь {i},{i % 7 + 1},{i}x10,"{self.OPERATIONS[i % 5]}",Ст3')
+        return FileStorage(stream=io.BytesIO('\n'.join(lines).encode('utf-8')), filename=f'{prefix}.csv')
+
+    def test_import_statements_do_not_grow_with_rows(self, app, database, sql_statements):
+        """
+        Тест: Пакетный импорт 2000 строк выполняет число SQL-запросов, не зависящее
+        от числа строк: проверка существования, маршруты и вставка идут пакетами.
+        """
+        user = User.query.filter_by(username='admin').first()
+
+        with sql_statements() as statements:
+            added, skipped = part_service.import_parts_from_excel(self._bom('NEW'), user, {})
+
+        assert added == self.ROWS and skipped == 0
+        assert Part.query.filter(Part.part_id.startswith('NEW-')).count() == self.ROWS
+        assert len(statements) <= self.STATEMENT_LIMIT
+
+    @pytest.mark.benchmark
+    def test_import_rows_per_second(self, app, database):
+        """Замер: пакетный импорт против прежнего построчного (iterrows, ORM и AuditLog на строку), строк в секунду."""
+        user = User.query.filter_by(username='admin').first()
+
+        start = time.perf_counter()
+        legacy_added = import_parts_row_by_row(self._bom('OLD'), user)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        bulk_added, _ = part_service.import_parts_from_excel(self._bom('NEW'), user, {})
+        bulk_time = time.perf_counter() - start
+
+        print(f"\nИмпорт {self.ROWS} строк: построчно {legacy_added / legacy_time:.0f} строк/с, "
+              f"пакетно {bulk_added / bulk_time:.0f} строк/с (x{legacy_time / bulk_time:.1f})")
+
+
+class TestConcurrentConfirmation:
+    """Нагрузочный тест подтверждения этапов несколькими сканерами одновременно."""
+
+    QUANTITY = 40
+    SCANNERS = 8
+    ATTEMPTS = 12
+
+    @pytest.fixture
+    def file_app(self, tmp_path):
+        """
+        Отдельное приложение с базой SQLite в файле: база в памяти обслуживает
+        все потоки одним соединением и не воспроизводит параллельную запись.
+        """
+        config = type('ConcurrentTestingConfig', (TestingConfig,), {
+            'SQLALCHEMY_DATABASE_URI': f"sqlite:///{tmp_path / 'concurrent.db'}",
+            'SQLALCHEMY_ENGINE_OPTIONS': {'connect_args': {'timeout': 30}},
+        })
+        flask_app, _ = create_app(config)
+        with flask_app.app_context():
+            db.create_all()
+            stages = [Stage(name='Резка'), Stage(name='Сверловка')]
+            route = RouteTemplate(name='Маршрут', is_default=True)
+            db.session.add_all(stages + [route])
+            db.session.flush()
+            db.session.add_all([RouteStage(template_id=route.id, stage_id=stage.id, order=i)
+                                for i, stage in enumerate(stages)])
+            part = Part(part_id='LOT-001', product_designation='Партия', name='Деталь', material='Ст3',
+                        route_template_id=route.id, quantity_total=self.QUANTITY)
+            db.session.add(part)
+            progress_service.track_part_in_product_progress(part)
+            db.session.commit()
+        yield flask_app
+        with flask_app.app_context():
+            db.session.remove()
+            db.engine.dispose()
+
+    def test_no_over_confirmation(self, file_app):
+        """Тест: Параллельные сканеры не подтверждают больше общего количества; выводит пропускную способность."""
+        with file_app.app_context():
+            stage_ids = [stage.id for stage in Stage.query.order_by(Stage.id)]
+            urls = [url_for('main.confirm_stage', part_id='LOT-001', stage_id=stage_id, _external=False)
+                    for stage_id in stage_ids]
+
+        errors = []
+
+        def scanner(number):
+            client = file_app.test_client()
+            try:
+                for attempt in range(self.ATTEMPTS):
+                    response = client.post(urls[(number + attempt) % len(urls)], data={
+                        'operator_name': f'Оператор {number}', 'quantity': 1, 'csrf_token': 'fake-token'
+                    })
+                    assert response.status_code == 302
+            except Exception as e:  # исключение потока не дошло бы до pytest
+                errors.append(e)
+
+        threads = [threading.Thread(target=scanner, args=(n,)) for n in range(self.SCANNERS)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        attempts = self.SCANNERS * self.ATTEMPTS
+        print(f"\n{self.SCANNERS} сканеров, {attempts} подтверждений за {elapsed:.2f} с: "
+              f"{attempts / elapsed:.0f} запросов/с")
+        assert not errors, errors
+
+        with file_app.app_context():
+            part = Part.query.filter_by(part_id='LOT-001').one()
+            for stage_id in stage_ids:
+                confirmed = db.session.query(db.func.sum(StatusHistory.quantity)).filter_by(
+                    part_pk=part.id, stage_id=stage_id).scalar()
+                counter = db.session.get(PartStageProgress, (part.id, stage_id)).qty_done
+                assert confirmed == counter == self.QUANTITY
+            assert part.quantity_completed == self.QUANTITY
+            assert db.session.get(ProductProgress, 'Партия').completed_quantity == self.QUANTITY
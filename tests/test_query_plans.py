@@ -0,0 +1,128 @@
+# tests/test_query_plans.py
+
+import pytest
+from datetime import datetime, timedelta, timezone
+from flask import url_for
+from sqlalchemy import insert
+
+from app import db
+from app.models.models import Part, StatusHistory, AuditLog, User, RouteTemplate, Stage
+from app.services import query_service, search_service
+
+# Таблицы, к которым горячие запросы обязаны обращаться через индекс
+HOT_TABLES = ('StatusHistory', 'Parts', 'AuditLogs')
+
+
+@pytest.fixture
+def seeded_database(database):
+    """
+    Наполняет базу объемом данных, при котором планировщик
+    начинает различать полный просмотр таблицы и поиск по индексу.
+    """
+    admin = User.query.filter_by(username='admin').first()
+    route = RouteTemplate.query.filter_by(is_default=True).first()
+    stages = Stage.query.filter(Stage.name.in_(('Резка', 'Сверловка', 'Контроль ОТК'))).all()
+    now = datetime.now(timezone.utc)
+
+    first_pk = (db.session.query(db.func.max(Part.id)).scalar() or 0) + 1
+    parts, history, logs = [], [], []
+    for p in range(400):
+        part_id = f'SEED-{p:04d}'
+        part_pk = first_pk + p
+        parts.append({
+            'id': part_pk, 'part_id': part_id, 'product_designation': f'Изделие {p % 20}',
+            'name': f'Деталь {p}', 'material': 'Ст3', 'route_template_id': route.id,
+            'parent_pk': part_pk - 1 if p % 4 else None,
+            'quantity_total': 10, 'quantity_completed': 0
+        })
+        for h in range(8):
+            history.append({
+                'part_pk': part_pk, 'stage_id': stages[h % 3].id, 'status': stages[h % 3].name,
+                'operator_name': f'Оператор {h}', 'quantity': 1,
+                'timestamp': now - timedelta(minutes=p * 10 + h)
+            })
+            logs.append({
+                'part_id': part_id, 'user_id': admin.id, 'action': 'Генерация QR',
+                'details': '-', 'timestamp': now - timedelta(minutes=p * 10 + h),
+                'category': ('part', 'auth', 'management', 'general')[h % 4]
+            })
+
+    db.session.execute(insert(Part), parts)
+    db.session.execute(insert(StatusHistory), history)
+    db.session.execute(insert(AuditLog), logs)
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+    yield database
+
+
+def explain(statement, parameters):
+    """Возвращает строки плана выполнения запроса для текущего диалекта."""
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        rows = connection.exec_driver_sql('EXPLAIN ' + statement, parameters).all()
+        return [row[0] for row in rows]
+    rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+    return [row[-1] for row in rows]
+
+
+def full_scans(plan_lines):
+    """Находит в плане полные просмотры "горячих" таблиц."""
+    offending = []
+    for line in plan_lines:
+        for table in HOT_TABLES:
+            # SQLite: "SCAN AuditLogs" без "USING ... INDEX" - последовательный просмотр таблицы
+            if line.startswith(f'SCAN {table}') and 'INDEX' not in line:
+                offending.append(line)
+            # PostgreSQL: "Seq Scan on "AuditLogs""
+            if f'Seq Scan on "{table}"' in line:
+                offending.append(line)
+    return offending
+
+
+def assert_no_full_scans(statements):
+    """Проверяет планы SELECT-запросов из пар (запрос, параметры), собранных sql_statements."""
+    selects = [(statement, parameters) for statement, parameters in statements
+               if statement.lstrip().upper().startswith('SELECT')]
+    assert selects, "Не перехвачено ни одного запроса"
+    for statement, parameters in selects:
+        plan = explain(statement, parameters)
+        offending = full_scans(plan)
+        assert not offending, f"Полный просмотр таблицы:\n{statement}\nПлан: {plan}"
+
+
+class TestHotPathQueryPlans:
+    """Регрессионные тесты планов выполнения для горячих запросов."""
+
+    def test_combined_history_uses_indexes(self, app, seeded_database, sql_statements):
+        """Тест: История детали (UNION ALL) выбирает строки по индексам детали."""
+        part = Part.query.filter_by(part_id='SEED-0123').first()
+        with sql_statements(with_parameters=True) as statements:
+            query_service.get_combined_history(part)
+        assert_no_full_scans(statements)
+
+    def test_parts_for_product_uses_index(self, client, seeded_database, sql_statements):
+        """Тест: Страница корневых деталей изделия выбирается по (product_designation, parent_pk, part_id)."""
+        with sql_statements(with_parameters=True) as statements:
+            response = client.get(url_for('main.api_parts_for_product', product_designation='Изделие 7'))
+            client.get(url_for('main.api_parts_for_product', product_designation='Изделие 7',
+                               after='SEED-0100', limit=5))
+            client.get(url_for('main.api_part_changes', product_designation='Изделие 7', since=0))
+        assert response.status_code == 200
+        assert_no_full_scans(statements)
+
+    def test_audit_log_pages_use_category_index(self, client, auth_client, seeded_database, sql_statements):
+        """Тест: Журналы аудита фильтруются и сортируются по (category, timestamp)."""
+        auth_client('admin')
+        for endpoint in ('admin.user.audit_log', 'admin.user.user_log'):
+            with sql_statements(with_parameters=True) as statements:
+                response = client.get(url_for(endpoint))
+            assert response.status_code == 200
+            audit_statements = [s for s in statements if 'AuditLogs' in s[0]]
+            assert_no_full_scans(audit_statements)
+
+    def test_search_uses_search_index(self, app, seeded_database, sql_statements):
+        """Тест: Поиск деталей выбирает кандидатов по поисковому индексу, а не просмотром Parts."""
+        with sql_statements(with_parameters=True) as statements:
+            parts, _ = search_service.search_parts('SEED-012 Деталь')
+        assert parts
+        assert_no_full_scans(statements)
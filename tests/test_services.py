@@ -2,11 +2,24 @@
 
 import pytest
 import io
+from datetime import date, datetime, timedelta
+from fnmatch import fnmatchcase
+
 import openpyxl
 from docx import Document
+from flask import g
 
+from app import create_app, db
+from app.models.models import AuditLog, CacheGeneration, Operator, Part, RouteStage, RouteTemplate, Stage, User
 from app.services import document_service
 from app.services import graph_service
+from app.services import partition_service
+from app.services import archive_service
+from app.services import cache_service
+from app.services import query_service
+from app.services import operator_service
+from app.services import route_service
+from config import TestingConfig
 
 
 class TestDocumentService:
@@ -112,4 +125,175 @@ class TestGraphService:
             graph_service.read_row_from_excel_bytes(excel_bytes, row_number=3)
         
         with pytest.raises(IndexError):
-            graph_service.read_row_from_excel_bytes(excel_bytes, row_number=1) # Строка 1 - это заголовки
\ No newline at end of file
+            graph_service.read_row_from_excel_bytes(excel_bytes, row_number=1) # Строка 1 - это заголовки
+
+class TestPartitionService:
+    """Тесты для сервиса помесячных секций."""
+
+    def test_month_arithmetic_and_names(self):
+        assert partition_service.month_start(date(2025, 9, 18)) == date(2025, 9, 1)
+        assert partition_service.add_months(date(2025, 11, 1), 3) == date(2026, 2, 1)
+        assert partition_service.add_months(date(2025, 1, 1), -1) == date(2024, 12, 1)
+        assert partition_service.partition_name('AuditLogs', date(2025, 9, 1)) == 'AuditLogs_2025_09'
+
+    def test_sqlite_is_not_partitioned(self, database):
+        """Тест: На SQLite таблицы истории остаются обычными."""
+        assert not partition_service.is_supported()
+        assert not partition_service.is_partitioned('StatusHistory')
+
+
+class TestArchiveService:
+    """Тесты для архивации журнала аудита."""
+
+    def test_parse_age(self):
+        assert archive_service.parse_age('90d').days == 90
+        assert archive_service.parse_age('2w').days == 14
+        with pytest.raises(ValueError):
+            archive_service.parse_age('3 месяца')
+
+    def test_archive_and_read_back(self, app, database, tmp_path, monkeypatch):
+        """Тест: Старые записи переносятся в файлы архива и читаются только по запросу."""
+        monkeypatch.setitem(app.config, 'AUDIT_ARCHIVE_FOLDER', str(tmp_path))
+        admin = User.query.filter_by(username='admin').first()
+        old = datetime.now() - timedelta(days=200)
+        db.session.add_all([
+            AuditLog(part_id='TEST-001', user_id=admin.id, action='Создание', details=f'Старая запись {i}',
+                     category='part', timestamp=old + timedelta(minutes=i))
+            for i in range(5)
+        ] + [
+            AuditLog(user_id=admin.id, action='Вход в систему', details='Старый вход', category='auth', timestamp=old),
+            AuditLog(part_id='TEST-001', user_id=admin.id, action='Генерация QR', details='Свежая запись',
+                     category='part', timestamp=datetime.now()),
+        ])
+        db.session.commit()
+
+        rows, files = archive_service.archive_audit_logs(timedelta(days=90), str(tmp_path), chunk_size=4)
+        assert (rows, files) == (6, 2)
+        assert AuditLog.query.count() == 1
+        assert len(list(tmp_path.glob('*.jsonl.gz'))) == 2
+
+        archived = archive_service.read_archived_logs(str(tmp_path), part_id='TEST-001')
+        assert [r['details'] for r in archived] == [f'Старая запись {i}' for i in reversed(range(5))]
+
+        part = Part.query.filter_by(part_id='TEST-001').first()
+        hot_history = query_service.get_combined_history(part)
+        assert [e['details'] for e in hot_history if e['type'] == 'audit'] == ['Свежая запись']
+        full_history = query_service.get_combined_history(part, include_archived=True)
+        assert len([e for e in full_history if e['type'] == 'audit']) == 6
+
+
+class _LocalRedis:
+    """Заменитель Redis в памяти процесса с тем же подмножеством команд."""
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def set(self, key, value, ex=None):
+        self.data[key] = value.encode('utf-8')
+
+    def scan_iter(self, match):
+        return [key for key in list(self.data) if fnmatchcase(key, match)]
+
+    def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+
+class TestCacheService:
+    """Тесты для кэша списков деталей."""
+
+    def test_lru_is_bounded(self):
+        cache = cache_service.LRUCache(max_entries=2)
+        cache.set('a:1', 1)
+        cache.set('b:1', 2)
+        cache.get('a:1')
+        cache.set('c:1', 3)
+        assert len(cache) == 2
+        assert cache.get('b:1') is None
+        assert cache.get('a:1') == 1
+
+    def test_tiered_cache_shares_entries_and_invalidates(self):
+        """Тест: Второй процесс читает запись из общего кэша; инвалидация очищает оба уровня."""
+        shared = _LocalRedis()
+        first = cache_service.TieredCache(cache_service.LRUCache(), cache_service.RedisCache(shared))
+        second = cache_service.TieredCache(cache_service.LRUCache(), cache_service.RedisCache(shared))
+
+        key = cache_service.parts_page_key('Изделие [1]*', 3, ('part_id',))
+        other_key = cache_service.parts_page_key('Изделие 2', 1, ('part_id',))
+        first.set(key, {'parts': [{'part_id': 'A'}], 'next_cursor': None})
+        first.set(other_key, {'parts': [], 'next_cursor': None})
+        assert second.get(key) == {'parts': [{'part_id': 'A'}], 'next_cursor': None}
+
+        second.delete_prefix(key.split(':')[0] + ':')
+        assert second.get(key) is None
+        assert first.shared.get(key) is None
+        assert first.get(other_key) is not None
+
+
+class TestRouteService:
+    """Тесты для кэша этапов маршрутов."""
+
+    def test_route_stages_are_cached(self, database, sql_statements):
+        """Тест: Повторное обращение к этапам маршрута не идет в базу."""
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        with sql_statements() as statements:
+            first = route_service.get_route_stages(route.id)
+            second = route_service.get_route_stages(route.id)
+        assert [rs.stage_name for rs in first] == ['Резка', 'Сверловка', 'Контроль ОТК']
+        assert second is first
+        assert len([statement for statement in statements if 'FROM "RouteStages"' in statement]) == 1
+        assert route_service.get_route_stages(None) == ()
+
+    def test_generation_bump_from_other_process(self, database):
+        """Тест: Увеличение счетчика поколения другим процессом сбрасывает кэш."""
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        assert len(route_service.get_route_stages(route.id)) == 3
+
+        # "Другой процесс" меняет маршрут и увеличивает счетчик напрямую в базе
+        extra = Stage.query.filter_by(name='Test Stage 1').first()
+        db.session.add(RouteStage(template_id=route.id, stage_id=extra.id, order=3))
+        db.session.add(CacheGeneration(name=route_service.GENERATION_NAME, generation=41))
+        db.session.commit()
+
+        # В пределах одного запроса счетчик повторно не читается
+        assert len(route_service.get_route_stages(route.id)) == 3
+        g.pop('cache_generations', None)
+        stages = route_service.get_route_stages(route.id)
+        assert [rs.stage_name for rs in stages][-1] == 'Test Stage 1'
+        assert route_service.find_route_stage(route.id, extra.id).name == 'Test Stage 1'
+
+    def test_caches_belong_to_app(self, app, database):
+        """Тест: Кэши маршрутов и операторов хранятся в приложении, а не в процессе."""
+        route = RouteTemplate.query.filter_by(is_default=True).first()
+        route_service.get_route_stages(route.id)
+        operator_service.resolve_operator_id('Иван Петров')
+        db.session.commit()
+        operator_id = operator_service.resolve_operator_id('Иван Петров')
+        other_app, _ = create_app(TestingConfig)
+        with other_app.app_context():
+            assert cache_service.GENERATION_CACHES_KEY not in other_app.extensions
+        assert app.extensions[cache_service.GENERATION_CACHES_KEY][route_service.GENERATION_NAME].get(route.id)
+        assert app.extensions[cache_service.GENERATION_CACHES_KEY][operator_service.GENERATION_NAME].get('иван петров') == operator_id
+
+
+class TestOperatorService:
+    """Тесты для кэша справочника операторов."""
+
+    def test_deleted_operators_are_not_served_from_cache(self, database):
+        """Тест: После удаления операторов в другом процессе кэш не выдает старый id."""
+        old_id = operator_service.resolve_operator_id('Иван Петров')
+        db.session.commit()
+        g.pop('cache_generations', None)
+        assert operator_service.resolve_operator_id('иван  петров') == old_id
+
+        # "Другой процесс" (flask seed-cypress) удаляет операторов и увеличивает счетчик напрямую в базе
+        Operator.query.delete()
+        db.session.add(CacheGeneration(name=operator_service.GENERATION_NAME, generation=7))
+        db.session.commit()
+
+        g.pop('cache_generations', None)
+        new_id = operator_service.resolve_operator_id('Иван Петров')
+        assert db.session.get(Operator, new_id).normalized_name == 'иван петров'